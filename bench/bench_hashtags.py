@@ -0,0 +1,88 @@
+"""Бенчмарк поиска хэштегов новелл в collect_any.
+
+Сравнивает старый разбор (lower + split по всему тексту) с новым:
+хэштеги из entities Telegram и предкомпилированная регулярка как запасной путь.
+
+Запуск: python bench/bench_hashtags.py
+"""
+import datetime
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import Chat, Message, MessageEntity  # noqa: E402
+
+from bot import extract_hashtag_codes, find_hashtag_codes, registry  # noqa: E402
+
+NOVELS = registry.current.novels
+
+WORDS = ("опечатка тут в главе пропущена запятая спасибо за перевод очень нравится "
+         "персонаж сказал that line was translated wrong please fix слово повторяется").split()
+OTHER_TAGS = ["#спойлер", "#вопрос", "#fanart", "#mood", "#2024"]
+ROUNDS = 20
+
+
+def legacy_extract(text):
+    if not text:
+        return None
+    for w in text.lower().split():
+        if w.startswith("#"):
+            code = w[1:]
+            if code in NOVELS:
+                return code
+    return None
+
+
+def make_message(rnd: random.Random, i: int, codes: list[str]) -> Message:
+    kind = rnd.random()
+    n_words = rnd.randint(3, 25)
+    if kind < 0.10:
+        n_words = rnd.randint(300, 600)  # длинные простыни
+    words = [rnd.choice(WORDS) for _ in range(n_words)]
+    if 0.70 <= kind < 0.80:
+        words.insert(rnd.randrange(len(words) + 1), rnd.choice(OTHER_TAGS))
+    elif kind >= 0.80:
+        for _ in range(rnd.choice((1, 1, 1, 2))):
+            tag = "#" + rnd.choice(codes) + rnd.choice(("", "", ",", ".", "!"))
+            words.insert(rnd.randrange(len(words) + 1), tag)
+    text = " ".join(words)
+    entities = [
+        MessageEntity(MessageEntity.HASHTAG, m.start(), len(m.group(0)))
+        for m in re.finditer(r"#\w+", text)
+    ]
+    now = datetime.datetime.now()
+    chat = Chat(1, Chat.PRIVATE)
+    if rnd.random() < 0.2:
+        return Message(i, now, chat, caption=text, caption_entities=entities)
+    return Message(i, now, chat, text=text, entities=entities)
+
+
+def run(name, fn, items):
+    started = time.perf_counter()
+    found = 0
+    for _ in range(ROUNDS):
+        for item in items:
+            if fn(item):
+                found += 1
+    elapsed = time.perf_counter() - started
+    per = elapsed / (ROUNDS * len(items)) * 1e6
+    print(f"{name:<28} {per:>8.2f} us/msg   matched {found // ROUNDS}")
+
+
+def main():
+    rnd = random.Random(7)
+    codes = sorted(NOVELS)
+    msgs = [make_message(rnd, i, codes) for i in range(5000)]
+    texts = [m.text or m.caption for m in msgs]
+    print(f"{len(msgs)} сообщений, {ROUNDS} прогонов\n")
+    run("legacy split", legacy_extract, texts)
+    run("regex fallback (text)", find_hashtag_codes, texts)
+    run("entities + regex (Message)", extract_hashtag_codes, msgs)
+
+
+if __name__ == "__main__":
+    main()
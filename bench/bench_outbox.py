@@ -0,0 +1,66 @@
+"""Бенчмарк журнала доставок (Outbox): сколько доставок в секунду выдерживает запись в SQLite.
+
+Каждая «доставка» — record (ждёт коммита с fsync) и done (без ожидания), как в deliver().
+Параллельные производители имитируют одновременные репорты; group commit должен
+собирать их в общие транзакции, поэтому пропускная способность растёт с параллельностью.
+
+Запуск: python bench/bench_outbox.py --deliveries 5000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bot import Delivery, Outbox  # noqa: E402
+from loadtest import percentile  # noqa: E402
+
+REFS = [(10_000 + i, 100 + i) for i in range(3)]
+HEADER = "📬 Репорт по новелле: <b>Novel (#code)</b>\nОт: <a href='tg://user?id=1'>User</a>"
+
+
+async def bench(path: str, synchronous: str, producers: int, deliveries: int) -> tuple[float, list[float], float]:
+    outbox = Outbox(path, max_attempts=10, retry_base=5, retry_max=60, synchronous=synchronous)
+    latencies: list[float] = []
+    per_producer = deliveries // producers
+
+    async def producer(n: int):
+        for i in range(per_producer):
+            d = Delivery(-1000 - n, REFS, HEADER)
+            started = time.perf_counter()
+            await outbox.record(d)
+            latencies.append(time.perf_counter() - started)
+            outbox.done(d)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(producer(n) for n in range(producers)))
+    elapsed = time.perf_counter() - started
+    batch = outbox.ops_written / outbox.commits if outbox.commits else 0
+    await outbox.close()
+    latencies.sort()
+    return per_producer * producers / elapsed, latencies, batch
+
+
+async def run(args):
+    print(f"{args.deliveries} deliveries per run")
+    print(f"{'sync':<8}{'producers':>10}{'deliv/s':>10}{'p50':>9}{'p99':>9}{'ops/commit':>12}")
+    for synchronous in ("FULL", "NORMAL"):
+        for producers in (1, 8, 64, 256):
+            with tempfile.TemporaryDirectory() as tmp:
+                rate, lat, batch = await bench(os.path.join(tmp, "outbox.sqlite3"), synchronous,
+                                               producers, args.deliveries)
+            print(f"{synchronous:<8}{producers:>10}{rate:>10.0f}{percentile(lat, 50) * 1000:>7.2f}ms"
+                  f"{percentile(lat, 99) * 1000:>7.2f}ms{batch:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deliveries", type=int, default=5000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
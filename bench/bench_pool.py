@@ -0,0 +1,116 @@
+"""Бенчмарк пула HTTP-соединений к Bot API: как размер пула и keep-alive влияют на доставку репортов.
+
+Каждый репорт — как в send_cmd: заголовок переводчику, forwardMessages, заголовок в ленту,
+forwardMessages в ленту. Репорты приходят пачками с паузой между ними; считаем задержку
+доставки репорта, число новых TCP-соединений и таймауты ожидания пула.
+Сервер — фейковый Bot API из bench/loadtest.py.
+
+Запуск: python bench/bench_pool.py --reports 50 --bursts 3 --gap 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import Bot  # noqa: E402
+from telegram.error import TimedOut  # noqa: E402
+from tornado.httpserver import HTTPServer  # noqa: E402
+
+from bot import build_send_request  # noqa: E402
+from loadtest import TOKEN, FakeBotAPI, percentile  # noqa: E402
+
+TRANSLATOR_CHAT = -1001
+FEED_CHAT = -1002
+USER_CHAT = 10_000
+
+# (название, размер пула, keep-alive в секундах)
+CONFIGS = [
+    ("pool=1", 1, 30.0),
+    ("pool=4", 4, 30.0),
+    ("pool=16", 16, 30.0),
+    ("pool=64", 64, 30.0),
+    ("pool=64 keepalive=1s", 64, 1.0),
+]
+
+
+class CountingServer(HTTPServer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections = 0
+
+    def handle_stream(self, stream, address):
+        self.connections += 1
+        return super().handle_stream(stream, address)
+
+
+async def deliver_report(bot: Bot, n: int):
+    ids = list(range(n * 10 + 1, n * 10 + 4))
+    await bot.send_message(TRANSLATOR_CHAT, f"📬 Репорт {n}")
+    await bot.forward_messages(TRANSLATOR_CHAT, USER_CHAT, ids)
+    await bot.send_message(FEED_CHAT, f"🆕 Репорт {n}")
+    await bot.forward_messages(FEED_CHAT, USER_CHAT, ids)
+
+
+async def bench_config(args, server: CountingServer, pool: int, keepalive: float):
+    request = build_send_request(pool, keepalive_expiry=keepalive, pool_timeout=args.pool_timeout)
+    bot = Bot(TOKEN, base_url=f"http://127.0.0.1:{args.port}/bot", request=request)
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+    timeouts = 0
+
+    async def one(n: int, started: float):
+        nonlocal timeouts
+        async with sem:
+            try:
+                await deliver_report(bot, n)
+            except TimedOut:
+                timeouts += 1
+                return
+        latencies.append(time.perf_counter() - started)
+
+    server.connections = 0
+    async with bot:
+        for burst in range(args.bursts):
+            if burst:
+                await asyncio.sleep(args.gap)
+            started = time.perf_counter()
+            await asyncio.gather(*(one(burst * args.reports + i, started) for i in range(args.reports)))
+    latencies.sort()
+    return latencies, server.connections, timeouts
+
+
+async def run(args):
+    api = FakeBotAPI(args.latency_ms / 1000, args.jitter_ms / 1000, 0.0, 1, seed=1)
+    server = CountingServer(api.make_app())
+    server.listen(args.port, address="127.0.0.1")
+    print(f"{args.bursts} x {args.reports} reports, gap {args.gap}s, concurrency {args.concurrency}, "
+          f"api latency {args.latency_ms}±{args.jitter_ms}ms")
+    print(f"{'config':<22}{'p50':>9}{'p95':>9}{'p99':>9}{'conns':>7}{'timeouts':>10}")
+    try:
+        for name, pool, keepalive in CONFIGS:
+            lat, conns, timeouts = await bench_config(args, server, pool, keepalive)
+            print(f"{name:<22}{percentile(lat, 50) * 1000:8.0f}ms{percentile(lat, 95) * 1000:7.0f}ms"
+                  f"{percentile(lat, 99) * 1000:7.0f}ms{conns:>7}{timeouts:>10}")
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reports", type=int, default=50, help="репортов в пачке")
+    parser.add_argument("--bursts", type=int, default=3)
+    parser.add_argument("--gap", type=float, default=2.0, help="пауза между пачками, секунд")
+    parser.add_argument("--concurrency", type=int, default=24, help="одновременных доставок (воркеры очереди)")
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--pool-timeout", type=float, default=5.0)
+    parser.add_argument("--port", type=int, default=18082)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Микробенчмарк UserRateLimiter: стоимость одной проверки при разном числе пользователей.
+
+Запуск: python bench/bench_ratelimit.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bot import UserRateLimiter  # noqa: E402
+
+LIMITS = {"report_start": (1, 3), "collect": (5, 5), "hashtag": (1, 3)}
+ACTIONS = list(LIMITS)
+CHECKS = 200_000
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def bench(users: int) -> tuple[float, int, float]:
+    clock = FakeClock()
+    limiter = UserRateLimiter(LIMITS, idle_ttl=60, clock=clock)
+    # заполняем лимитер, чтобы мерить на «прогретом» состоянии
+    for uid in range(users):
+        limiter.hit(uid, "hashtag")
+    rnd = random.Random(42)
+    ids = [rnd.randrange(users * 2) for _ in range(CHECKS)]
+    acts = [ACTIONS[i % 3] for i in range(CHECKS)]
+    hit = limiter.hit
+    started = time.perf_counter()
+    for i in range(CHECKS):
+        clock.now += 0.0001
+        hit(ids[i], acts[i])
+    elapsed = time.perf_counter() - started
+    size = len(limiter)
+
+    # простой: все уходят, новые пользователи должны вытеснить старых
+    clock.now += 120
+    for uid in range(users * 10, users * 10 + 1000):
+        hit(uid, "collect")
+    limiter.sweep()
+    return elapsed / CHECKS * 1e9, size, len(limiter)
+
+
+def main():
+    print(f"{'users':>10} {'ns/check':>10} {'tracked':>10} {'after idle':>11}")
+    for users in (1_000, 10_000, 100_000, 500_000):
+        ns, size, after = bench(users)
+        print(f"{users:>10} {ns:>10.0f} {size:>10} {after:>11}")
+
+
+if __name__ == "__main__":
+    main()
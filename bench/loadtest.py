@@ -0,0 +1,450 @@
+"""Нагрузочный стенд: настоящий Application из bot.py против локального фейкового Bot API.
+
+Фейковый сервер отвечает на sendMessage, forwardMessage(s), copyMessage(s), getChat,
+deleteMessage(s) и остальные вызовы с настраиваемой задержкой и может подмешивать
+429 Too Many Requests (RetryAfter). Генератор прогоняет через бота синтетический поток:
+репорты по хэштегу, многосообщенческие сессии /report, альбомы и рассылки.
+Апдейты идут тем же путём, что и в проде: update_processor → process_update.
+
+На выходе: p50/p95/p99 задержки обработки апдейта (по сценариям) и updates/sec.
+По умолчанию лимиты исходящей отправки сняты, чтобы мерить сам бот;
+с --real-limits остаются боевые SEND_GLOBAL_RATE/SEND_PER_CHAT_*.
+
+С --workers N бот запускается отдельным процессом в режиме вебхука (при N > 1 — главный
+процесс и N воркеров), апдейты приходят HTTP-запросами, как от Telegram. Задержка тогда —
+до ответа вебхука (апдейт принят), а время прогона — до последнего вызова Bot API.
+Сравнение --workers 1 и --workers 4 на многоядерной машине показывает, масштабируется ли роутер.
+
+Запуск: python bench/loadtest.py --users 500 --latency-ms 40 --retry-after-rate 0.01
+        python bench/loadtest.py --users 2000 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import tornado.web  # noqa: E402
+from tornado.httpserver import HTTPServer  # noqa: E402
+
+BOT_ID = 123456
+TOKEN = f"{BOT_ID}:LOADTEST"
+ADMIN_ID = 1
+FEED_CHAT_ID = -1009999999
+# методы, в которые подмешивается 429: исходящие сообщения бота
+RETRY_METHODS = {"sendMessage", "forwardMessage", "forwardMessages", "copyMessage", "copyMessages"}
+
+
+# ── Фейковый Bot API ───────────────────────────────────────────────────────────
+class FakeBotAPI:
+    def __init__(self, latency: float, jitter: float, retry_after_rate: float, retry_after: int, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.rnd = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.injected: Counter = Counter()
+        self.last_call = 0.0
+        self._message_id = 1_000_000
+
+    def _next_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    def _message(self, chat_id, text: str = "") -> dict:
+        return {
+            "message_id": self._next_id(), "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private" if int(chat_id) > 0 else "supergroup"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Loadtest"},
+            "text": text or "ok",
+        }
+
+    def result(self, method: str, p: dict):
+        if method == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Loadtest", "username": "loadtest_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if method in ("sendMessage", "forwardMessage", "editMessageText", "editMessageReplyMarkup"):
+            return self._message(p.get("chat_id", 0), p.get("text", ""))
+        if method == "copyMessage":
+            return {"message_id": self._next_id()}
+        if method in ("forwardMessages", "copyMessages"):
+            return [{"message_id": self._next_id()} for _ in p.get("message_ids", [])]
+        if method == "getChat":
+            chat_id = int(p["chat_id"])
+            return {"id": chat_id, "type": "supergroup", "title": f"Chat {chat_id}",
+                    "accent_color_id": 0, "max_reaction_count": 11}
+        if method == "getMyCommands":
+            return []
+        return True
+
+    def make_app(self) -> tornado.web.Application:
+        api = self
+
+        class MethodHandler(tornado.web.RequestHandler):
+            async def post(self, token: str, method: str):
+                params = {}
+                for name in self.request.body_arguments:
+                    raw = self.get_body_argument(name)
+                    try:
+                        params[name] = json.loads(raw)
+                    except ValueError:
+                        params[name] = raw
+                api.calls[method] += 1
+                if not method.startswith("delete"):
+                    # автоудаление срабатывает через ACK_TTL после ответа и в конец прогона не входит
+                    api.last_call = time.perf_counter()
+                if api.latency or api.jitter:
+                    await asyncio.sleep(max(0.0, api.rnd.gauss(api.latency, api.jitter)))
+                if method in RETRY_METHODS and api.rnd.random() < api.retry_after_rate:
+                    api.injected[method] += 1
+                    self.set_status(429)
+                    self.write({"ok": False, "error_code": 429,
+                                "description": f"Too Many Requests: retry after {api.retry_after}",
+                                "parameters": {"retry_after": api.retry_after}})
+                    return
+                self.write({"ok": True, "result": api.result(method, params)})
+
+            get = post
+
+        return tornado.web.Application([(r"/bot([^/]+)/(\w+)", MethodHandler)], log_function=lambda h: None)
+
+
+# ── Синтетический поток апдейтов ───────────────────────────────────────────────
+class UpdateFactory:
+    def __init__(self, codes: list[str], seed: int):
+        self.codes = codes
+        self.rnd = random.Random(seed)
+        self.update_id = 0
+        self.message_id = 0
+        self.callback_id = 0
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def _base(self, user_id: int) -> dict:
+        self.message_id += 1
+        return {"message_id": self.message_id, "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+                "from": self._user(user_id)}
+
+    def _wrap(self, key: str, payload: dict) -> dict:
+        self.update_id += 1
+        return {"update_id": self.update_id, key: payload}
+
+    def text(self, user_id: int, text: str) -> dict:
+        msg = self._base(user_id)
+        msg["text"] = text
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        elif text.startswith("#"):
+            msg["entities"] = [{"type": "hashtag", "offset": 0, "length": len(text.split()[0])}]
+        return self._wrap("message", msg)
+
+    def photo(self, user_id: int, media_group_id: str, caption: str = "") -> dict:
+        msg = self._base(user_id)
+        msg["media_group_id"] = media_group_id
+        msg["photo"] = [{"file_id": f"photo{self.message_id}", "file_unique_id": f"u{self.message_id}",
+                         "width": 1280, "height": 720}]
+        if caption:
+            msg["caption"] = caption
+            msg["caption_entities"] = [{"type": "hashtag", "offset": 0, "length": len(caption.split()[0])}]
+        return self._wrap("message", msg)
+
+    def callback(self, user_id: int, data: str) -> dict:
+        self.callback_id += 1
+        msg = self._base(user_id)
+        msg["from"] = {"id": BOT_ID, "is_bot": True, "first_name": "Loadtest"}
+        msg["text"] = "Выбери новеллу:"
+        return self._wrap("callback_query", {"id": str(self.callback_id), "from": self._user(user_id),
+                                             "chat_instance": f"ci{user_id}", "data": data, "message": msg})
+
+    def phrase(self) -> str:
+        return self.rnd.choice(["опечатка в главе", "пропущена запятая", "имя написано иначе",
+                                "строка не переведена", "повтор слова"])
+
+    def hashtag_session(self, user_id: int) -> list:
+        code = self.rnd.choice(self.codes)
+        return [("hashtag", self.text(user_id, f"#{code} {self.phrase()}"))]
+
+    def report_session(self, user_id: int) -> list:
+        code = self.rnd.choice(self.codes)
+        items = [("report", self.text(user_id, "/report")), ("report", self.callback(user_id, f"pick:{code}"))]
+        items += [("report", self.text(user_id, self.phrase())) for _ in range(self.rnd.randint(2, 5))]
+        items.append(("report", self.text(user_id, "/send")))
+        return items
+
+    def album_session(self, user_id: int) -> list:
+        code = self.rnd.choice(self.codes)
+        group = f"album{user_id}"
+        parts = [("album", self.photo(user_id, group, f"#{code} {self.phrase()}"))]
+        parts += [("album", self.photo(user_id, group)) for _ in range(self.rnd.randint(1, 4))]
+        return parts
+
+    def broadcast_session(self) -> list:
+        return [("broadcast", self.text(ADMIN_ID, f"/broadcast -silent Нагрузочный тест {self.update_id}"))]
+
+
+def build_stream(factory: UpdateFactory, users: int, broadcasts: int, mix: dict, seed: int) -> list:
+    rnd = random.Random(seed)
+    kinds, weights = zip(*mix.items())
+    sessions = []
+    for i in range(users):
+        user_id = 10_000 + i
+        kind = rnd.choices(kinds, weights)[0]
+        sessions.append(getattr(factory, f"{kind}_session")(user_id))
+    sessions += [factory.broadcast_session() for _ in range(broadcasts)]
+    # перемешиваем сессии между собой, сохраняя порядок внутри каждой
+    stream = []
+    while sessions:
+        i = rnd.randrange(len(sessions))
+        stream.append(sessions[i].pop(0))
+        if not sessions[i]:
+            sessions.pop(i)
+    return stream
+
+
+# ── Прогон ─────────────────────────────────────────────────────────────────────
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def report_line(name: str, values: list[float]) -> str:
+    v = sorted(values)
+    return (f"  {name:<10} n={len(v):<6} p50={percentile(v, 50) * 1000:8.1f}ms "
+            f"p95={percentile(v, 95) * 1000:8.1f}ms p99={percentile(v, 99) * 1000:8.1f}ms "
+            f"max={(v[-1] if v else 0) * 1000:8.1f}ms")
+
+
+async def run(args) -> None:
+    import bot
+    from telegram import Update
+
+    api = FakeBotAPI(args.latency_ms / 1000, args.jitter_ms / 1000, args.retry_after_rate,
+                     args.retry_after, args.seed)
+    server = HTTPServer(api.make_app())
+    server.listen(args.port, address="127.0.0.1")
+
+    app = bot.build_application(TOKEN, base_url=f"http://127.0.0.1:{args.port}/bot", updater=False)
+    factory = UpdateFactory(sorted(bot.registry.current.novels), args.seed)
+    mix = {"hashtag": args.hashtag, "report": args.report, "album": args.album}
+    stream = build_stream(factory, args.users, args.broadcasts, mix, args.seed)
+
+    latencies: dict[str, list[float]] = defaultdict(list)
+    album_started: dict[str, float] = {}
+
+    # альбом обрабатывается после окна MEDIA_GROUP_WINDOW — меряем от первой части до доставки
+    album_handler = bot.albums.handler
+
+    async def timed_album(update, context, msgs):
+        try:
+            return await album_handler(update, context, msgs)
+        finally:
+            started = album_started.pop(msgs[0].media_group_id, None)
+            if started is not None:
+                latencies["album"].append(time.perf_counter() - started)
+
+    bot.albums.handler = timed_album
+
+    async def feed(kind: str, update: Update, arrived: float):
+        # тот же путь, что у Application._update_fetcher
+        await app.update_processor.process_update(update, app.process_update(update))
+        if kind != "album":
+            latencies[kind].append(time.perf_counter() - arrived)
+
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    try:
+        started = time.perf_counter()
+        tasks = []
+        interval = 1 / args.rate if args.rate > 0 else 0
+        for i, (kind, data) in enumerate(stream):
+            if interval:
+                delay = started + i * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            update = Update.de_json(data, app.bot)
+            arrived = time.perf_counter()
+            if kind == "album":
+                album_started.setdefault(update.effective_message.media_group_id, arrived)
+            tasks.append(asyncio.create_task(feed(kind, update, arrived)))
+        await asyncio.gather(*tasks)
+        # хвосты: альбомы ждут окна, доставки идут в фоне после ответа пользователю
+        while (len(bot.albums) or bot.outbound.depth()
+               or any(t.get_name().startswith(("album-", "delivery-", "digest-")) for t in bot._background_tasks)):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+    finally:
+        await app.stop()
+        await app.post_stop(app)
+        await app.shutdown()
+        server.stop()
+
+    total = len(stream)
+    print(f"updates: {total}, users: {args.users}, broadcasts: {args.broadcasts}, "
+          f"api latency {args.latency_ms}±{args.jitter_ms}ms, 429 rate {args.retry_after_rate:.3f}")
+    print(f"elapsed: {elapsed:.2f}s, throughput: {total / elapsed:.1f} updates/sec")
+    print("latency per update:")
+    print(report_line("all", [x for v in latencies.values() for x in v]))
+    for kind in ("hashtag", "report", "album", "broadcast"):
+        if latencies.get(kind):
+            print(report_line(kind, latencies[kind]))
+    print("api calls: " + ", ".join(f"{m}={n}" for m, n in api.calls.most_common()))
+    if api.injected:
+        print("injected 429: " + ", ".join(f"{m}={n}" for m, n in api.injected.most_common()))
+    print("outbound:")
+    print("  " + bot.outbound.render().replace("\n", "\n  "))
+
+
+async def run_workers(args) -> None:
+    import httpx
+
+    api = FakeBotAPI(args.latency_ms / 1000, args.jitter_ms / 1000, args.retry_after_rate,
+                     args.retry_after, args.seed)
+    server = HTTPServer(api.make_app())
+    server.listen(args.port, address="127.0.0.1")
+    bot_port = args.port + 1
+    secret = "loadtest"
+    env = dict(os.environ, MODE="webhook", WEBHOOK_WORKERS=str(args.workers), PORT=str(bot_port),
+               WORKER_BASE_PORT=str(bot_port + 1), RENDER_EXTERNAL_URL="http://127.0.0.1",
+               WEBHOOK_SECRET=secret, BOT_API_URL=f"http://127.0.0.1:{args.port}/bot",
+               LOG_FORMAT="text", LOG_LEVEL="WARNING")
+    proc = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot.py")],
+                            env=env)
+
+    # тот же список новелл, что загрузит бот (без импорта bot.py в этот процесс)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "novels.json"), encoding="utf-8") as f:
+        factory = UpdateFactory(sorted(json.load(f)), args.seed)
+    mix = {"hashtag": args.hashtag, "report": args.report, "album": args.album}
+    stream = build_stream(factory, args.users, args.broadcasts, mix, args.seed)
+
+    url = f"http://127.0.0.1:{bot_port}/{secret}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret}
+    latencies: dict[str, list[float]] = defaultdict(list)
+    failed = Counter()
+    # апдейты одного пользователя уходят строго по очереди, как их шлёт Telegram
+    user_locks: dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=200), timeout=30) as client:
+        try:
+            # готовность: по апдейту на каждый воркер (id с разными остатками от деления)
+            pending = set(range(5_000, 5_000 + args.workers))
+            for _ in range(300):
+                for user_id in list(pending):
+                    try:
+                        r = await client.post(url, json=factory.text(user_id, "ping"), headers=headers)
+                        if r.status_code == 200:
+                            pending.discard(user_id)
+                    except httpx.HTTPError:
+                        pass
+                if not pending:
+                    break
+                await asyncio.sleep(0.2)
+            else:
+                raise RuntimeError("бот не поднялся")
+            await asyncio.sleep(0.5)
+            api.calls.clear()
+
+            async def post(kind: str, data: dict, user_id: int):
+                async with user_locks[user_id]:
+                    sent = time.perf_counter()
+                    try:
+                        r = await client.post(url, json=data, headers=headers)
+                        if r.status_code != 200:
+                            failed[r.status_code] += 1
+                    except httpx.HTTPError as e:
+                        failed[type(e).__name__] += 1
+                    latencies[kind].append(time.perf_counter() - sent)
+
+            started = time.perf_counter()
+            tasks = []
+            interval = 1 / args.rate if args.rate > 0 else 0
+            for i, (kind, data) in enumerate(stream):
+                if interval:
+                    delay = started + i * interval - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                user_id = next(v for v in data.values() if isinstance(v, dict))["from"]["id"]
+                tasks.append(asyncio.create_task(post(kind, data, user_id)))
+            await asyncio.gather(*tasks)
+            # доставки идут в фоне после ответа вебхука: ждём, пока Bot API не затихнет
+            while time.perf_counter() - max(api.last_call, started) < args.settle:
+                await asyncio.sleep(0.05)
+            elapsed = api.last_call - started
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            await asyncio.to_thread(proc.wait, 60)
+            server.stop()
+
+    total = len(stream)
+    print(f"updates: {total}, users: {args.users}, workers: {args.workers}, "
+          f"api latency {args.latency_ms}±{args.jitter_ms}ms, 429 rate {args.retry_after_rate:.3f}")
+    print(f"elapsed: {elapsed:.2f}s (до последнего вызова Bot API), throughput: {total / elapsed:.1f} updates/sec")
+    print("webhook accept latency:")
+    print(report_line("all", [x for v in latencies.values() for x in v]))
+    for kind in ("hashtag", "report", "album", "broadcast"):
+        if latencies.get(kind):
+            print(report_line(kind, latencies[kind]))
+    if failed:
+        print("failed posts: " + ", ".join(f"{k}={n}" for k, n in failed.most_common()))
+    print("api calls: " + ", ".join(f"{m}={n}" for m, n in api.calls.most_common()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=300, help="синтетических пользователей (по сессии на каждого)")
+    parser.add_argument("--broadcasts", type=int, default=1)
+    parser.add_argument("--hashtag", type=float, default=0.5, help="доля сессий-хэштегов")
+    parser.add_argument("--report", type=float, default=0.3, help="доля сессий /report")
+    parser.add_argument("--album", type=float, default=0.2, help="доля альбомов")
+    parser.add_argument("--rate", type=float, default=0, help="апдейтов в секунду (0 — всё сразу)")
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="доля исходящих вызовов с ответом 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответе 429, секунд")
+    parser.add_argument("--media-group-window", type=float, default=0.3)
+    parser.add_argument("--real-limits", action="store_true", help="оставить боевые лимиты отправки")
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="запустить бот процессом-вебхуком с N воркерами (0 — в этом же процессе)")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="с --workers: сколько секунд Bot API должен молчать, чтобы прогон считался законченным")
+    args = parser.parse_args()
+
+    # окружение бота задаётся до импорта bot.py; настоящий токен и чаты из .env не используются
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ.update({
+        "BOT_TOKEN": TOKEN,
+        "ADMINS": str(ADMIN_ID),
+        "FEED_ERRORS_CHAT_ID": str(FEED_CHAT_ID),
+        "NOVELS_RELOAD_INTERVAL": "0",
+        "REPORTS_DB": os.path.join(tmp, "reports.sqlite3"),
+        "AUTODELETE_STATE_FILE": os.path.join(tmp, "autodelete.json"),
+        "OUTBOX_DB": os.path.join(tmp, "outbox.sqlite3"),
+        "AUTODELETE_ON_SHUTDOWN": "drain",
+        "MEDIA_GROUP_WINDOW": str(args.media_group_window),
+    })
+    if not args.real_limits:
+        os.environ.update({"SEND_GLOBAL_RATE": "1000000", "SEND_PER_CHAT_RATE": "1000000",
+                           "SEND_PER_CHAT_BURST": "1000000"})
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(run_workers(args) if args.workers else run(args))
+
+
+if __name__ == "__main__":
+    main()
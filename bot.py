@@ -1,371 +1,2609 @@
+import time
+_BOOT_STARTED = time.perf_counter()  # до остальных импортов — для профиля старта
+
+import abc
 import logging
+import logging.handlers
 import os
-import time
 import html
 import asyncio
+import copy
+import functools
+import signal
+import hashlib
+import heapq
+import json
+import queue
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import threading
+from array import array
+from collections import OrderedDict, defaultdict, deque
 from dataclasses import dataclass, field
-from typing import Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from telegram import (
+    Update, InlineKeyboardMarkup, InlineKeyboardButton, Message, MessageEntity,
+    ReplyKeyboardMarkup, KeyboardButton, BotCommand, Bot
+)
+from telegram.constants import ChatAction, ParseMode
+from telegram.ext import (
+    ApplicationBuilder, CommandHandler, MessageHandler,
+    ConversationHandler, CallbackQueryHandler, ContextTypes, filters, BaseUpdateProcessor,
+)
+from telegram.error import Forbidden, BadRequest, TimedOut, RetryAfter, NetworkError
+from telegram.request import HTTPXRequest
+
+_BOOT_IMPORTED = time.perf_counter()
+
+# ── Окружение ──────────────────────────────────────────────────────────────────
+load_dotenv()
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+ADMINS = {int(x) for x in os.getenv("ADMINS", "").split(",") if x.strip().isdigit()}
+MODE = os.getenv("MODE", "polling").lower()
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "dev-secret")
+# Несколько процессов в режиме вебхука: главный принимает апдейты и раздаёт их воркерам по user_id
+# (апдейты одного пользователя всегда попадают в один воркер, диалог не теряется).
+# Незавершённые репорты и отложенные удаления воркеры держат в общем STATE_STORE, антифлуд — у себя.
+# Дедупликация, дайджесты и отключение недоступных чатов помнят репорты только своего процесса,
+# поэтому при нескольких воркерах выключены (кэш getChat у каждого свой — это лишь лишние запросы).
+WEBHOOK_WORKERS = max(1, int(os.getenv("WEBHOOK_WORKERS", "1") or 1)) if MODE == "webhook" else 1
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "0") or 0)  # 0 — PORT + 1
+# номер воркера выставляет главный процесс; -1 — обычный одиночный запуск
+WORKER_INDEX = int(os.getenv("BOT_WORKER_INDEX", "-1"))
+# свой Bot API сервер (telegram-bot-api --local) или стенд: префикс вида http://host:port/bot
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+# /metrics: на публичном порту вебхука — только если задан METRICS_TOKEN (?token=... или Authorization: Bearer ...);
+# METRICS_BIND=host:port — отдельный сервер только для метрик, например 127.0.0.1:9100.
+# Без токена и без METRICS_BIND метрики наружу не отдаются (воркеры отдают их на своих локальных портах)
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_BIND = os.getenv("METRICS_BIND", "")
+# STARTUP_PROFILE=1 — подробный лог фаз старта (импорты, сборка, post_init, до первого апдейта)
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "").lower() in ("1", "true", "yes")
+# Логи: json (по строке на запись) или text; пишутся в фоновом потоке из очереди LOG_QUEUE_SIZE.
+# Одинаковые предупреждения/ошибки сверх LOG_REPEAT_BURST за LOG_REPEAT_WINDOW секунд отбрасываются (0 — не резать)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000") or 10000)
+LOG_REPEAT_WINDOW = float(os.getenv("LOG_REPEAT_WINDOW", "60") or 0)
+LOG_REPEAT_BURST = int(os.getenv("LOG_REPEAT_BURST", "5") or 5)
+
+FEED_ERRORS_CHAT_ID = int(os.getenv("FEED_ERRORS_CHAT_ID", "0") or 0)
+FEED_ERRORS_TOPIC_ID = int(os.getenv("FEED_ERRORS_TOPIC_ID", "0") or 0)
+
+# Реестр новелл и период проверки файла на изменения (0 — только по /reload)
+NOVELS_FILE = os.getenv("NOVELS_FILE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "novels.json")
+NOVELS_RELOAD_INTERVAL = float(os.getenv("NOVELS_RELOAD_INTERVAL", "30") or 0)
+
+# Параллельная обработка апдейтов: разные пользователи — параллельно, один пользователь — строго по порядку.
+# Долгие админ-команды идут отдельной полосой и не занимают общие слоты.
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32") or 32)
+ADMIN_CONCURRENCY = int(os.getenv("ADMIN_CONCURRENCY", "2") or 2)
+LONG_ADMIN_COMMANDS = {"broadcast", "listnovels", "reload"}
+
+# Кэш данных чатов (секунды / количество записей)
+CHAT_CACHE_TTL = int(os.getenv("CHAT_CACHE_TTL", "3600") or 3600)
+CHAT_CACHE_NEGATIVE_TTL = int(os.getenv("CHAT_CACHE_NEGATIVE_TTL", "300") or 300)
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "512") or 512)
+CHAT_LOOKUP_CONCURRENCY = int(os.getenv("CHAT_LOOKUP_CONCURRENCY", "8") or 8)
+
+# Лимиты Bot API: ~30 сообщений/с на бота и ~1 сообщение/с в один чат
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30") or 30)
+SEND_PER_CHAT_RATE = float(os.getenv("SEND_PER_CHAT_RATE", "1") or 1)
+SEND_PER_CHAT_BURST = float(os.getenv("SEND_PER_CHAT_BURST", "3") or 3)
+
+# Исходящая очередь: воркеры на все отправки и повторы при сетевых ошибках
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "16") or 16)
+DISPATCH_MAX_ATTEMPTS = int(os.getenv("DISPATCH_MAX_ATTEMPTS", "5") or 5)
+# сколько репортов одновременно доставляются в один чат (ленту, переводчику): сообщения одного репорта
+# всегда идут подряд, а разных — могут чередоваться. 1 — строго по одному репорту
+DELIVERY_STREAMS_PER_CHAT = max(1, int(os.getenv("DELIVERY_STREAMS_PER_CHAT", "4") or 4))
+
+# Недоступные чаты: после CIRCUIT_FAILURES постоянных ошибок подряд (бот удалён, нет прав, чат исчез)
+# репорты по новеллам чата идут только в ленту; доступность проверяется с паузой от CIRCUIT_PROBE_BASE,
+# удваивающейся до CIRCUIT_PROBE_MAX секунд. 0 — не отключать
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "3") or 3)
+CIRCUIT_PROBE_BASE = float(os.getenv("CIRCUIT_PROBE_BASE", "60") or 60)
+CIRCUIT_PROBE_MAX = float(os.getenv("CIRCUIT_PROBE_MAX", "21600") or 21600)
+CIRCUIT_MAX_CHATS = int(os.getenv("CIRCUIT_MAX_CHATS", "10000") or 10000)
+
+# Защита от перегрузки: пороги очереди исходящих (задачи и доставки в ожидании) и задержки цикла событий (секунды)
+# для ступеней 1..4 — без подтверждений «Принял», отложенное автоудаление, пачки для занятых
+# переводчиков (SHED_BUSY_CHAT доставок в очереди чата), отказ «попробуй позже». 0 — ступень по этому
+# признаку не включается. Вниз — по ступени, после SHED_COOLDOWN секунд спокойствия.
+SHED_QUEUE_LEVELS = os.getenv("SHED_QUEUE_LEVELS", "200,500,1000,2000")
+SHED_LAG_LEVELS = os.getenv("SHED_LAG_LEVELS", "0.2,0.5,1,2")
+SHED_BUSY_CHAT = int(os.getenv("SHED_BUSY_CHAT", "5") or 5)
+# сколько копятся пачки занятых переводчиков (своё окно, короче DIGEST_WINDOW)
+SHED_BATCH_WINDOW = float(os.getenv("SHED_BATCH_WINDOW", "30") or 30)
+SHED_CHECK_INTERVAL = float(os.getenv("SHED_CHECK_INTERVAL", "0.5") or 0.5)
+SHED_COOLDOWN = float(os.getenv("SHED_COOLDOWN", "10") or 10)
+
+# HTTP к Bot API: отдельные пулы для исходящих вызовов и для long polling getUpdates.
+# Пул исходящих должен покрывать DISPATCH_WORKERS + BROADCAST_CONCURRENCY + прямые вызовы из хендлеров.
+# HTTP_VERSION=2 требует python-telegram-bot[http2].
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "64") or 64)
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30") or 30)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5") or 5)
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10") or 10)
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "10") or 10)
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5") or 5)
+HTTP_MEDIA_WRITE_TIMEOUT = float(os.getenv("HTTP_MEDIA_WRITE_TIMEOUT", "30") or 30)
+HTTP_VERSION = os.getenv("HTTP_VERSION", "1.1")
+GET_UPDATES_POOL_SIZE = int(os.getenv("GET_UPDATES_POOL_SIZE", "1") or 1)
+# к read-таймауту getUpdates PTB сам добавляет timeout long polling
+GET_UPDATES_READ_TIMEOUT = float(os.getenv("GET_UPDATES_READ_TIMEOUT", "10") or 10)
+
+# Рассылка
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8") or 8)
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "2") or 2)
+
+# Антифлуд: "ёмкость/период_в_секундах" для каждого типа действия
+RATE_LIMIT_REPORT_START = os.getenv("RATE_LIMIT_REPORT_START", "1/3")
+RATE_LIMIT_COLLECT = os.getenv("RATE_LIMIT_COLLECT", "5/5")
+RATE_LIMIT_HASHTAG = os.getenv("RATE_LIMIT_HASHTAG", "1/3")
+RATE_LIMIT_IDLE_TTL = float(os.getenv("RATE_LIMIT_IDLE_TTL", "60") or 60)
+
+# Незавершённые репорты: лимит сообщений, время жизни без активности и файл, где они переживают рестарт
+REPORT_MAX_MESSAGES = int(os.getenv("REPORT_MAX_MESSAGES", "50") or 50)
+REPORT_IDLE_TTL = float(os.getenv("REPORT_IDLE_TTL", "86400") or 86400)
+REPORTS_DB = os.getenv("REPORTS_DB", "pending_reports.sqlite3")
+REPORTS_FLUSH_INTERVAL = float(os.getenv("REPORTS_FLUSH_INTERVAL", "2") or 2)
+# Хранилище общего состояния: sqlite[:путь] (по умолчанию — файл REPORTS_DB)
+STATE_STORE = os.getenv("STATE_STORE", "sqlite")
+
+# Дубликаты: одинаковый репорт по той же новелле в пределах окна DEDUP_WINDOW секунд (0 — выключено,
+# по умолчанию) не пересылается повторно, а добавляется счётчиком к первому. Сравниваются только репорты,
+# где у каждого сообщения есть файл или не меньше DEDUP_MIN_TEXT символов текста: короткие фразы вроде
+# «опечатка в главе» у разных читателей совпадают, а означают разное
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "0") or 0)
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "5000") or 5000)
+DEDUP_MIN_TEXT = int(os.getenv("DEDUP_MIN_TEXT", "60") or 60)
+
+# Журнал доставок: каждая доставка переводчику/в ленту фиксируется в SQLite до попытки
+# и удаляется после успеха; неудачные повторяются с экспоненциальной паузой, после рестарта — тоже.
+# OUTBOX_SYNC=FULL — fsync на каждый групповой коммит, NORMAL — быстрее, но можно потерять последние записи
+OUTBOX_DB = os.getenv("OUTBOX_DB", "outbox.sqlite3")
+OUTBOX_SYNC = os.getenv("OUTBOX_SYNC", "FULL").upper()
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10") or 10)
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "5") or 5)
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "1800") or 1800)
+
+# Дайджест переводчикам: для перечисленных чатов репорты копятся DIGEST_WINDOW секунд
+# (или до DIGEST_MAX_REPORTS штук) и уходят одним заголовком + пачкой пересылок
+DIGEST_CHATS = {int(x) for x in os.getenv("DIGEST_CHATS", "").split(",") if x.strip().lstrip("-").isdigit()}
+DIGEST_WINDOW = float(os.getenv("DIGEST_WINDOW", "300") or 300)
+DIGEST_MAX_REPORTS = int(os.getenv("DIGEST_MAX_REPORTS", "10") or 10)
+
+# Альбомы: сколько ждать следующую часть media_group, прежде чем обработать альбом целиком
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.0") or 1.0)
+
+# Автоудаление служебных сообщений: при остановке persist (сохранить в файл) или drain (удалить сразу)
+AUTODELETE_STATE_FILE = os.getenv("AUTODELETE_STATE_FILE", "autodelete_pending.json")
+AUTODELETE_ON_SHUTDOWN = os.getenv("AUTODELETE_ON_SHUTDOWN", "persist").lower()
+
+# Клавиатура выбора новеллы: новелл на страницу
+NOVEL_PAGE_SIZE = int(os.getenv("NOVEL_PAGE_SIZE", "20") or 20)
+
+# Доставка репортов: forward (с подписью «переслано от») или copy (без неё)
+REPORT_DELIVERY_MODE = os.getenv("REPORT_DELIVERY_MODE", "forward").lower()
+
+# ── Новеллы ────────────────────────────────────────────────────────────────────
+# Реестр хранится в NOVELS_FILE: {"код": {"chat_id": 123, "label": "Название (#код)"}}.
+# При перезагрузке индексы строятся заново и подменяются одним присваиванием.
+def build_hashtag_matcher(codes) -> re.Pattern:
+    # длинные коды раньше коротких, чтобы #choprosta не съелся как #chopro
+    alts = "|".join(re.escape(c) for c in sorted(codes, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)#({alts})(?!\w)", re.IGNORECASE)
+
+@dataclass(frozen=True)
+class NovelIndex:
+    version: int
+    novels: Dict[str, int]                 # код → chat_id переводчика
+    labels: Dict[str, str]                 # код → подпись
+    by_chat: Dict[int, tuple[str, ...]]    # chat_id → коды
+    sorted_codes: tuple[str, ...]          # по подписи, без учёта регистра
+    hashtag_re: re.Pattern
+
+    def label(self, code: str) -> str:
+        return self.labels.get(code, code)
+
+def build_novel_index(raw: dict, version: int) -> NovelIndex:
+    novels: Dict[str, int] = {}
+    labels: Dict[str, str] = {}
+    for code, entry in raw.items():
+        code = str(code).strip().lower()
+        if not code:
+            raise ValueError("пустой код новеллы")
+        if not isinstance(entry, dict):
+            entry = {"chat_id": entry}
+        novels[code] = int(entry.get("chat_id") or 0)
+        labels[code] = str(entry.get("label") or f"{code} (#{code})")
+    by_chat: Dict[int, list[str]] = {}
+    for code in sorted(novels):
+        by_chat.setdefault(novels[code], []).append(code)
+    return NovelIndex(
+        version=version,
+        novels=novels,
+        labels=labels,
+        by_chat={chat_id: tuple(codes) for chat_id, codes in by_chat.items()},
+        sorted_codes=tuple(sorted(novels, key=lambda c: labels[c].lower())),
+        hashtag_re=build_hashtag_matcher(novels),
+    )
+
+class NovelRegistry:
+    def __init__(self, path: str):
+        self.path = path
+        self.current: Optional[NovelIndex] = None
+        self._mtime: Optional[int] = None
+
+    def load(self) -> NovelIndex:
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, encoding="utf-8") as f:
+            raw = json.load(f)
+        index = build_novel_index(raw, version=self.current.version + 1 if self.current else 1)
+        self.current, self._mtime = index, mtime
+        logging.info("Novel registry v%d loaded: %d novels, %d chats",
+                     index.version, len(index.novels), len(index.by_chat))
+        return index
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            logging.warning("Файл реестра %s пропал, оставляю v%d", self.path, self.current.version)
+            return False
+        if mtime == self._mtime:
+            return False
+        self.load()
+        return True
+
+registry = NovelRegistry(NOVELS_FILE)
+registry.load()
+
+# ── Константы меню ─────────────────────────────────────────────────────────────
+BTN_START = "📝 Начать отчёт"
+BTN_SEND  = "📤 Отправить отчёт"
+BTN_CANCEL= "❌ Отмена"
+
+MENU_KB = ReplyKeyboardMarkup(
+    [
+        [KeyboardButton(BTN_START)],
+        [KeyboardButton(BTN_SEND)],
+        [KeyboardButton(BTN_CANCEL)],
+    ],
+    resize_keyboard=True, one_time_keyboard=False, selective=False
+)
+
+# ── Диалог ─────────────────────────────────────────────────────────────────────
+CHOOSE_NOVEL, COLLECT_MESSAGES = range(2)
+
+# ── Общее состояние ────────────────────────────────────────────────────────────
+# Незавершённые репорты, а при нескольких воркерах — ещё отложенные удаления.
+# Другой бэкенд (Redis и т.п.) — подкласс StateStore с теми же методами и ветка в open_state_store.
+class StateStore(abc.ABC):
+    @abc.abstractmethod
+    def load_reports(self, max_age: float, shard: int = 0, shards: int = 1) -> list[tuple]: ...
+
+    @abc.abstractmethod
+    def write_reports(self, upserts: list[tuple], deletes: list[tuple]): ...
+
+    @abc.abstractmethod
+    def write_deletions(self, worker: int, adds: list[tuple[int, int, float]], removes: list[tuple[int, int]]): ...
+
+    @abc.abstractmethod
+    def claim_deletions(self, worker: int, workers: int) -> list[tuple[int, int, float]]: ...
+
+    def close(self):
+        pass
+
+class SqliteStateStore(StateStore):
+    # WAL и по соединению на поток: процессы-воркеры и потоки to_thread пишут в один файл,
+    # SQLite упорядочивает их сам (блокировку ждём до timeout секунд).
+    # synchronous=NORMAL: репорты и так пишутся с задержкой, fsync на каждую транзакцию не нужен.
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._conns: list[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            with self._conns_lock:
+                if not self._conns:
+                    self._migrate(db)
+                self._conns.append(db)
+            self._local.db = db
+        return db
+
+    def _migrate(self, db: sqlite3.Connection):
+        with db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS pending_reports ("
+                " user_id INTEGER PRIMARY KEY, code TEXT, chat_ids BLOB, message_ids BLOB,"
+                " kinds BLOB, updated_at REAL, fingerprint BLOB)"
+            )
+            db.execute("CREATE TABLE IF NOT EXISTS autodelete (chat_id INTEGER, message_id INTEGER, due_at REAL, worker INTEGER NOT NULL DEFAULT 0)")
+            db.execute("CREATE INDEX IF NOT EXISTS autodelete_message ON autodelete (chat_id, message_id)")
+        for table, column, decl in (("pending_reports", "fingerprint", "BLOB"),
+                                    ("autodelete", "worker", "INTEGER NOT NULL DEFAULT 0")):
+            if column in {row[1] for row in db.execute(f"PRAGMA table_info({table})")}:
+                continue
+            try:
+                db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+            except sqlite3.OperationalError:
+                pass  # колонку успел добавить соседний воркер
+
+    def load_reports(self, max_age: float, shard: int = 0, shards: int = 1) -> list[tuple]:
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM pending_reports WHERE updated_at < ?", (time.time() - max_age,))
+        return db.execute("SELECT * FROM pending_reports WHERE user_id % ? = ?", (shards, shard)).fetchall()
+
+    def write_reports(self, upserts: list[tuple], deletes: list[tuple]):
+        db = self._db()
+        with db:
+            if upserts:
+                db.executemany("INSERT OR REPLACE INTO pending_reports VALUES (?, ?, ?, ?, ?, ?, ?)", upserts)
+            if deletes:
+                db.executemany("DELETE FROM pending_reports WHERE user_id = ?", deletes)
+
+    def write_deletions(self, worker: int, adds: list[tuple[int, int, float]], removes: list[tuple[int, int]]):
+        db = self._db()
+        with db:
+            if adds:
+                db.executemany("INSERT INTO autodelete (chat_id, message_id, due_at, worker) VALUES (?, ?, ?, ?)",
+                               [(chat_id, message_id, due_at, worker) for chat_id, message_id, due_at in adds])
+            if removes:
+                db.executemany("DELETE FROM autodelete WHERE chat_id = ? AND message_id = ?", removes)
+
+    def claim_deletions(self, worker: int, workers: int) -> list[tuple[int, int, float]]:
+        # свои записи (остались от упавшего или остановленного воркера с тем же номером)
+        # и ничьи — от воркеров, которых после смены WEBHOOK_WORKERS больше нет
+        db = self._db()
+        with db:
+            return db.execute(
+                "UPDATE autodelete SET worker = ?1 WHERE worker = ?1 OR worker >= ?2 "
+                "RETURNING chat_id, message_id, due_at",
+                (worker, workers),
+            ).fetchall()
+
+    def close(self):
+        with self._conns_lock:
+            for db in self._conns:
+                db.close()
+            self._conns.clear()
+        self._local = threading.local()
+
+def open_state_store(spec: str) -> StateStore:
+    kind, _, arg = spec.partition(":")
+    if kind == "sqlite":
+        return SqliteStateStore(arg or REPORTS_DB)
+    raise RuntimeError(f"Неизвестное хранилище состояния STATE_STORE={spec!r}")
+
+state_store = open_state_store(STATE_STORE)
+
+def worker_path(path: str) -> str:
+    # файлы, которые нельзя делить между воркерами (журнал доставок), получают номер воркера
+    if WORKER_INDEX < 0:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{WORKER_INDEX}{ext}"
+
+# ── Антифлуд ───────────────────────────────────────────────────────────────────
+def parse_rate(spec: str) -> tuple[float, float]:
+    capacity, _, period = spec.partition("/")
+    return float(capacity), float(period or 1)
+
+class UserRateLimiter:
+    # Token bucket на (действие, пользователь) по монотонным часам.
+    # Записи лежат в порядке последнего обращения, поэтому простаивающие
+    # вычищаются с головы за O(1) на проверку, и память не растёт бесконечно.
+    def __init__(self, limits: Dict[str, tuple[float, float]], idle_ttl: float, clock=time.monotonic):
+        self.limits = {action: (cap, cap / period) for action, (cap, period) in limits.items()}
+        # раньше полного восполнения выкидывать нельзя — это подарило бы лишние токены
+        self.idle_ttl = max([idle_ttl] + [period for _, period in limits.values()])
+        self.clock = clock
+        self._buckets: "OrderedDict[tuple[str, int], list[float]]" = OrderedDict()
+        self.rejected: Dict[str, int] = {action: 0 for action in limits}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def hit(self, user_id: int, action: str) -> bool:
+        now = self.clock()
+        self._evict(now)
+        capacity, rate = self.limits[action]
+        key = (action, user_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [capacity, now]
+        else:
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        if bucket[0] < 1:
+            self.rejected[action] += 1
+            return True
+        bucket[0] -= 1
+        return False
+
+    def _evict(self, now: float, budget: int = 8):
+        # ограниченное число выселений за вызов — стоимость проверки остаётся O(1)
+        buckets = self._buckets
+        deadline = now - self.idle_ttl
+        while budget and buckets:
+            key, bucket = next(iter(buckets.items()))
+            if bucket[1] > deadline:
+                return
+            del buckets[key]
+            budget -= 1
+
+    def sweep(self):
+        self._evict(self.clock(), budget=len(self._buckets))
+
+_user_limits = {
+    "report_start": parse_rate(RATE_LIMIT_REPORT_START),
+    "collect": parse_rate(RATE_LIMIT_COLLECT),
+    "hashtag": parse_rate(RATE_LIMIT_HASHTAG),
+}
+# при нескольких воркерах роутер закрепляет пользователя за одним из них,
+# так что вёдра в памяти процесса видят все его апдейты
+user_limiter = UserRateLimiter(_user_limits, idle_ttl=RATE_LIMIT_IDLE_TTL)
+
+def rate_limited(user_id: int, action: str = "report_start") -> bool:
+    return user_limiter.hit(user_id, action)
+
+# ── Модель состояния ───────────────────────────────────────────────────────────
+MEDIA_KINDS = ("text", "photo", "document", "video", "animation", "voice", "audio", "sticker", "video_note", "other")
+
+def media_kind(msg: Message) -> int:
+    for i, kind in enumerate(MEDIA_KINDS[:-1]):
+        if getattr(msg, kind, None):
+            return i
+    return len(MEDIA_KINDS) - 1
+
+_FINGERPRINT_NOISE_RE = re.compile(r"#\w+|[^\w]+")
+
+def normalize_report_text(text: str) -> str:
+    # регистр, ё/е, пунктуация, хэштеги и лишние пробелы не делают репорт другим
+    return " ".join(_FINGERPRINT_NOISE_RE.sub(" ", text.lower().replace("ё", "е")).split())
+
+def message_fingerprint(msg: Message) -> Optional[bytes]:
+    # None — сообщение нельзя надёжно сравнить: без файла и с текстом короче DEDUP_MIN_TEXT
+    media = msg.photo[-1] if msg.photo else getattr(msg, MEDIA_KINDS[media_kind(msg)], None)
+    file_id = getattr(media, "file_unique_id", "") or ""
+    text = normalize_report_text(msg.text or msg.caption or "")
+    if not file_id and len(text) < DEDUP_MIN_TEXT:
+        return None
+    return hashlib.blake2b(f"{file_id}\x1f{text}".encode(), digest_size=16).digest()
+
+def chain_fingerprint(acc: Optional[bytes], fp: Optional[bytes]) -> Optional[bytes]:
+    if acc is None or fp is None:
+        return None
+    return hashlib.blake2b(acc + fp, digest_size=16).digest()
+
+def report_fingerprint(msgs) -> Optional[bytes]:
+    acc: Optional[bytes] = b""
+    for m in msgs:
+        acc = chain_fingerprint(acc, message_fingerprint(m))
+    return acc or None
+
+class PendingReport:
+    # только (chat_id, message_id, вид) в плоских массивах — сами Message не храним;
+    # fingerprint — свёртка отпечатков сообщений (b"" — пусто, None — не сравнивается)
+    __slots__ = ("code", "chat_ids", "message_ids", "kinds", "updated_at", "fingerprint")
+
+    def __init__(self, code: Optional[str] = None):
+        self.code = code
+        self.chat_ids = array("q")
+        self.message_ids = array("q")
+        self.kinds = bytearray()
+        self.updated_at = time.time()
+        self.fingerprint: Optional[bytes] = b""
+
+    def __len__(self) -> int:
+        return len(self.message_ids)
+
+    def add(self, msg: Message) -> bool:
+        if len(self) >= REPORT_MAX_MESSAGES:
+            return False
+        self.chat_ids.append(msg.chat_id)
+        self.message_ids.append(msg.message_id)
+        self.kinds.append(media_kind(msg))
+        self.fingerprint = chain_fingerprint(self.fingerprint, message_fingerprint(msg))
+        self.touch()
+        return True
+
+    def touch(self):
+        self.updated_at = time.time()
+
+    def refs(self) -> list[tuple[int, int]]:
+        return list(zip(self.chat_ids, self.message_ids))
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        return (now or time.time()) - self.updated_at > REPORT_IDLE_TTL
+
+    def to_row(self, user_id: int) -> tuple:
+        return (user_id, self.code, self.chat_ids.tobytes(), self.message_ids.tobytes(),
+                bytes(self.kinds), self.updated_at, self.fingerprint)
+
+    @classmethod
+    def from_row(cls, row) -> "PendingReport":
+        _, code, chat_ids, message_ids, kinds, updated_at, fingerprint = row
+        report = cls(code)
+        report.chat_ids.frombytes(chat_ids)
+        report.message_ids.frombytes(message_ids)
+        report.kinds.extend(kinds)
+        report.updated_at = updated_at
+        # у строк из старой схемы отпечатка нет — такие репорты дубликатами не считаются
+        report.fingerprint = fingerprint
+        return report
+
+class ReportStore:
+    # write-behind в хранилище состояния: изменения копятся по user_id (последнее побеждает)
+    # и пишутся одной транзакцией раз в REPORTS_FLUSH_INTERVAL.
+    # Воркер читает и пишет только своих пользователей (user_id % shards == shard).
+    def __init__(self, store: StateStore, shard: int = 0, shards: int = 1):
+        self.store = store
+        self.shard = shard
+        self.shards = shards
+        self._dirty: Dict[int, Optional[PendingReport]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.rows_written = 0
+
+    def mark(self, user_id: int, report: Optional[PendingReport]):
+        self._dirty[user_id] = report
+
+    def load_all(self) -> Dict[int, PendingReport]:
+        rows = self.store.load_reports(REPORT_IDLE_TTL, self.shard, self.shards)
+        return {row[0]: PendingReport.from_row(row) for row in rows}
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        # строки снимаются в цикле событий, в поток уходят уже готовые байты
+        upserts = [r.to_row(uid) for uid, r in dirty.items() if r is not None and r.code]
+        deletes = [(uid,) for uid, r in dirty.items() if r is None or not r.code]
+        try:
+            await asyncio.to_thread(self.store.write_reports, upserts, deletes)
+        except Exception as e:
+            logging.warning("Report store flush failed: %s", e)
+            for uid, r in dirty.items():
+                self._dirty.setdefault(uid, r)
+            return
+        self.flushes += 1
+        self.rows_written += len(upserts) + len(deletes)
+
+    def start(self, app):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(app), name="report-store")
+
+    async def _run(self, app):
+        last_sweep = time.monotonic()
+        while True:
+            await asyncio.sleep(REPORTS_FLUSH_INTERVAL)
+            if time.monotonic() - last_sweep > 60:
+                last_sweep = time.monotonic()
+                self.sweep(app.user_data)
+            await self.flush()
+
+    def sweep(self, user_data) -> int:
+        now = time.time()
+        expired = [uid for uid, data in user_data.items()
+                   if data.get("pending") is not None and data["pending"].expired(now)]
+        for uid in expired:
+            user_data[uid]["pending"] = None
+            self.mark(uid, None)
+        return len(expired)
+
+    def restore(self, app) -> int:
+        reports = self.load_all()
+        for uid, report in reports.items():
+            app.user_data[uid]["pending"] = report
+        if reports:
+            logging.info("Restored %d open reports (shard %d/%d)", len(reports), self.shard, self.shards)
+        return len(reports)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+report_store = ReportStore(state_store, max(WORKER_INDEX, 0), WEBHOOK_WORKERS)
+
+def get_pending(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> Optional[PendingReport]:
+    pending: Optional[PendingReport] = context.user_data.get("pending")
+    if pending is not None and pending.expired():
+        set_pending(context, user_id, None)
+        return None
+    return pending
+
+def set_pending(context: ContextTypes.DEFAULT_TYPE, user_id: int, report: Optional[PendingReport]):
+    context.user_data["pending"] = report
+    report_store.mark(user_id, report)
+
+ACK_TTL   = 15
+DONE_TTL  = 10
+CANCEL_TTL= 7
+
+class AutoDeleteScheduler:
+    # одна куча на все отложенные удаления вместо задачи-спящего на каждое сообщение
+    BATCH = 100  # лимит deleteMessages
+
+    def __init__(self, state_file: str, on_shutdown: str = "persist",
+                 store: Optional[StateStore] = None, shard: int = 0, shards: int = 1):
+        # store задан (несколько воркеров) — каждое удаление сразу уходит в общее хранилище
+        # и стирается оттуда после вызова API, так что и упавший воркер их не теряет:
+        # перезапущенный воркер с тем же номером забирает свои записи при старте
+        self.state_file = state_file
+        self.on_shutdown = on_shutdown
+        self.store = store
+        self.shard = shard
+        self.shards = shards
+        self._heap: list[tuple[float, int, int]] = []
+        self._adds: list[tuple[int, int, float]] = []
+        self._removes: list[tuple[int, int]] = []
+        self._sync_task: Optional[asyncio.Task] = None
+        self._bot = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.deleted = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def start(self, bot):
+        self._bot = bot
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="autodelete")
+
+    def schedule(self, bot, chat_id: int, message_id: int, seconds: float, persist: bool = True):
+        if self._task is None:
+            self.start(bot)
+        due = time.monotonic() + seconds
+        if not self._heap or due < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (due, chat_id, message_id))
+        if self.store is not None and persist:
+            self._adds.append((chat_id, message_id, time.time() + seconds))
+            self._kick()
+
+    def _kick(self):
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.create_task(self._sync(), name="autodelete-store")
+
+    async def _sync(self):
+        # запись в хранилище — в потоке, цикл событий не ждёт блокировку SQLite;
+        # всё, что накопилось за время записи, уходит следующей транзакцией
+        while self._adds or self._removes:
+            adds, self._adds = self._adds, []
+            removes, self._removes = self._removes, []
+            try:
+                await asyncio.to_thread(self.store.write_deletions, self.shard, adds, removes)
+            except Exception as e:
+                logging.warning("Autodelete store write failed: %s", e)
+                self._adds[:0] = adds
+                self._removes[:0] = removes
+                await asyncio.sleep(1)
+
+    def _pop_due(self, now: float) -> Dict[int, list[int]]:
+        by_chat: Dict[int, list[int]] = {}
+        while self._heap and self._heap[0][0] <= now:
+            _, chat_id, message_id = heapq.heappop(self._heap)
+            by_chat.setdefault(chat_id, []).append(message_id)
+        return by_chat
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            if shedding.defer_deletes:
+                # под нагрузкой удаления ждут: это самые необязательные вызовы API
+                shedding.count("autodelete_deferred")
+                await asyncio.sleep(shedding.interval)
+                continue
+            await self._delete(self._pop_due(time.monotonic()))
+
+    async def _delete(self, by_chat: Dict[int, list[int]]):
+        for chat_id, ids in by_chat.items():
+            for i in range(0, len(ids), self.BATCH):
+                chunk = ids[i:i + self.BATCH]
+                try:
+                    if len(chunk) == 1:
+                        await outbound.send(LANE_SERVICE, chat_id, self._bot.delete_message,
+                                            chat_id=chat_id, message_id=chunk[0])
+                    else:
+                        await outbound.send(LANE_SERVICE, chat_id, self._bot.delete_messages,
+                                            chat_id=chat_id, message_ids=chunk)
+                    self.deleted += len(chunk)
+                except Exception as e:
+                    self.failed += len(chunk)
+                    logging.debug("Autodelete failed (%s:%s): %s", chat_id, chunk, e)
+                if self.store is not None:
+                    self._removes.extend((chat_id, message_id) for message_id in chunk)
+        if self._removes:
+            self._kick()
+
+    @property
+    def _target(self) -> str:
+        return "хранилище состояния" if self.store is not None else self.state_file
+
+    def _load(self) -> list:
+        if self.store is not None:
+            return self.store.claim_deletions(self.shard, self.shards)
+        with open(self.state_file, encoding="utf-8") as f:
+            items = json.load(f)
+        os.remove(self.state_file)
+        return items
+
+    def restore(self, bot):
+        try:
+            items = self._load()
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.warning("Не удалось прочитать %s: %s", self._target, e)
+            return
+        if not items:
+            return
+        now_wall = time.time()
+        for chat_id, message_id, due_wall in items:
+            # записи из хранилища там и остаются — повторно их не пишем
+            self.schedule(bot, chat_id, message_id, max(0.0, due_wall - now_wall), persist=False)
+        logging.info("Autodelete: restored %d pending deletions", len(items))
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._heap and self.on_shutdown == "drain":
+            pending = len(self._heap)
+            await self._delete(self._pop_due(float("inf")))
+            logging.info("Autodelete: drained %d pending deletions", pending)
+        elif self._heap and self.store is None:
+            now, now_wall = time.monotonic(), time.time()
+            items = [(chat_id, message_id, now_wall + (due - now)) for due, chat_id, message_id in self._heap]
+            try:
+                with open(self.state_file, "w", encoding="utf-8") as f:
+                    json.dump(items, f)
+                logging.info("Autodelete: persisted %d pending deletions", len(items))
+            except Exception as e:
+                logging.warning("Не удалось сохранить %s: %s", self.state_file, e)
+        elif self._heap:
+            logging.info("Autodelete: %d pending deletions stay in the state store", len(self._heap))
+        self._heap.clear()
+        if self._sync_task is not None:
+            # дописываем хвост очереди записи, но не держим остановку дольше нескольких секунд
+            try:
+                await asyncio.wait_for(self._sync_task, timeout=5)
+            except Exception as e:
+                logging.warning("Не удалось дописать %s: %s", self._target, e)
+            self._sync_task = None
+
+autodelete = AutoDeleteScheduler(AUTODELETE_STATE_FILE, AUTODELETE_ON_SHUTDOWN,
+                                 store=state_store if WEBHOOK_WORKERS > 1 else None,
+                                 shard=max(WORKER_INDEX, 0), shards=WEBHOOK_WORKERS)
+
+def schedule_autodelete(context: ContextTypes.DEFAULT_TYPE, message: Message, seconds: int):
+    autodelete.schedule(context.bot, message.chat_id, message.message_id, seconds)
+
+NOVEL_KB_COLUMNS = 2
+NOVEL_KB_LETTERS_PER_ROW = 7
+
+_novel_keyboard_pages: tuple[int, list[InlineKeyboardMarkup]] = (0, [])
+
+def _build_novel_keyboard_pages(index: NovelIndex) -> list[InlineKeyboardMarkup]:
+    items = [(code, index.labels[code]) for code in index.sorted_codes]
+    size = max(NOVEL_KB_COLUMNS, NOVEL_PAGE_SIZE)
+    chunks = [items[i:i + size] for i in range(0, len(items), size)] or [[]]
+
+    # буква → первая страница, где встречается
+    letters: Dict[str, int] = {}
+    for i, (_, label) in enumerate(items):
+        first = label[:1].upper()
+        letters.setdefault(first if first.isalpha() else "#", i // size)
+    letter_rows, row = [], []
+    for letter, page in letters.items():
+        row.append(InlineKeyboardButton(letter, callback_data=f"page:{page}"))
+        if len(row) == NOVEL_KB_LETTERS_PER_ROW:
+            letter_rows.append(row); row = []
+    if row: letter_rows.append(row)
+
+    pages = []
+    for n, chunk in enumerate(chunks):
+        rows, row = [], []
+        for i, (code, label) in enumerate(chunk, start=1):
+            row.append(InlineKeyboardButton(label, callback_data=f"pick:{code}"))
+            if i % NOVEL_KB_COLUMNS == 0:
+                rows.append(row); row=[]
+        if row: rows.append(row)
+        if len(chunks) > 1:
+            rows.append([
+                InlineKeyboardButton("◀", callback_data=f"page:{(n - 1) % len(chunks)}"),
+                InlineKeyboardButton(f"{n + 1}/{len(chunks)}", callback_data="page:noop"),
+                InlineKeyboardButton("▶", callback_data=f"page:{(n + 1) % len(chunks)}"),
+            ])
+            rows.extend(letter_rows)
+        rows.append([InlineKeyboardButton("Отмена", callback_data="cancel")])
+        pages.append(InlineKeyboardMarkup(rows))
+    return pages
+
+def novel_keyboard_pages() -> list[InlineKeyboardMarkup]:
+    # клавиатура собирается один раз на версию реестра
+    global _novel_keyboard_pages
+    index = registry.current
+    if _novel_keyboard_pages[0] != index.version:
+        _novel_keyboard_pages = (index.version, _build_novel_keyboard_pages(index))
+    return _novel_keyboard_pages[1]
+
+def build_novel_keyboard(page: int = 0) -> InlineKeyboardMarkup:
+    pages = novel_keyboard_pages()
+    return pages[min(max(page, 0), len(pages) - 1)]
+
+def find_hashtag_codes(text: str) -> list[str]:
+    if not text or "#" not in text:
+        return []
+    return list(dict.fromkeys(m.lower() for m in registry.current.hashtag_re.findall(text)))
+
+def extract_hashtag_codes(msg: Message) -> list[str]:
+    # сначала хэштеги, которые уже разметил Telegram; регулярка — запасной путь
+    text = msg.text or msg.caption
+    if not text or "#" not in text:
+        return []
+    if msg.text:
+        entities, parse = msg.entities, msg.parse_entities
+    else:
+        entities, parse = msg.caption_entities, msg.parse_caption_entities
+    if entities:
+        if not any(e.type == MessageEntity.HASHTAG for e in entities):
+            return []
+        tags = parse([MessageEntity.HASHTAG]).values()
+        novels = registry.current.novels
+        return list(dict.fromkeys(code for code in (t[1:].lower() for t in tags) if code in novels))
+    return find_hashtag_codes(text)
+
+# ── Логи ───────────────────────────────────────────────────────────────────────
+# Хендлеры только кладут запись в очередь: трейсбеки форматируются и пишутся в отдельном потоке,
+# и вывод в stderr не тормозит цикл событий во время сбоя или шторма RetryAfter.
+_STD_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + ".%03dZ" % record.msecs,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if WORKER_INDEX >= 0:
+            entry["worker"] = WORKER_INDEX
+        # suppressed, dropped и прочие поля из extra=
+        entry.update((k, v) for k, v in vars(record).items() if k not in _STD_RECORD_ATTRS)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RepeatFilter(logging.Filter):
+    # (логгер, уровень, шаблон, тип исключения) — «одна и та же» ошибка независимо от аргументов;
+    # сколько выкинуто за прошлое окно, сообщает полем suppressed первая запись следующего окна
+    def __init__(self, window: float, burst: int, max_keys: int = 1024, clock: Callable[[], float] = time.monotonic):
+        super().__init__()
+        self.window = window
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self.clock = clock
+        self._seen: "OrderedDict[tuple, list]" = OrderedDict()  # ключ → [начало окна, записей, выкинуто]
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.window <= 0:
+            return True
+        exc_type = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else ""
+        key = (record.name, record.levelno, str(record.msg), exc_type)
+        now = self.clock()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                if entry is not None and entry[2]:
+                    record.suppressed = entry[2]
+                self._seen[key] = [now, 1, 0]
+                self._seen.move_to_end(key)
+                if len(self._seen) > self.max_keys:
+                    self._seen.popitem(last=False)
+                return True
+            entry[1] += 1
+            if entry[1] <= self.burst:
+                return True
+            entry[2] += 1
+            self.suppressed += 1
+            return False
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    # не блокируется: при полной очереди запись выкидывается, а число потерь
+    # уходит полем dropped со следующей записью, которая пролезла
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+        self._unreported = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # аргументы подставляем сразу (объекты могут поменяться), трейсбек — уже в потоке записи
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self._unreported:
+            record.dropped = self._unreported
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+        else:
+            self._unreported = 0
+
+log_repeats = RepeatFilter(LOG_REPEAT_WINDOW, LOG_REPEAT_BURST)
+log_handler = AsyncLogHandler(queue.Queue(LOG_QUEUE_SIZE))
+log_handler.addFilter(log_repeats)
+
+def setup_logging() -> logging.handlers.QueueListener:
+    out = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        out.setFormatter(JsonFormatter())
+    else:
+        out.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [log_handler]
+    root.setLevel(LOG_LEVEL)
+    listener = logging.handlers.QueueListener(log_handler.queue, out)
+    listener.start()
+    return listener
+
+# ── Профиль старта ─────────────────────────────────────────────────────────────
+class StartupProfile:
+    def __init__(self, started: float):
+        self.started = started
+        self.marks: list[tuple[str, float]] = []
+        self.reported = False
+
+    def mark(self, phase: str):
+        self.marks.append((phase, time.perf_counter()))
+
+    def render(self) -> str:
+        lines, prev = [], self.started
+        for phase, at in self.marks:
+            lines.append(f"  {phase:<14}{(at - prev) * 1000:8.1f} ms  (итого {(at - self.started) * 1000:8.1f} ms)")
+            prev = at
+        return "\n".join(lines)
+
+    def report(self):
+        # один раз — на первом апдейте
+        self.reported = True
+        total = (self.marks[-1][1] - self.started) * 1000 if self.marks else 0.0
+        if STARTUP_PROFILE:
+            logging.info("Startup profile (от первого импорта bot.py):\n%s", self.render())
+        else:
+            logging.info("Startup: first update handled %.0f ms after start", total)
+
+startup = StartupProfile(_BOOT_STARTED)
+startup.marks.append(("imports", _BOOT_IMPORTED))
+
+# ── Фоновые задачи ─────────────────────────────────────────────────────────────
+_background_tasks: set[asyncio.Task] = set()
+
+def spawn_background(coro, name: Optional[str] = None) -> asyncio.Task:
+    # держим ссылку, иначе задачу может собрать GC
+    task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+# ── Метрики ────────────────────────────────────────────────────────────────────
+# Минимальный реестр в формате Prometheus (text exposition 0.0.4)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = tuple[tuple[str, str], ...]
+
+def _fmt_value(value) -> str:
+    # без округления: {:g} оставлял 6 значащих цифр, и счётчик за миллионом переставал расти
+    if isinstance(value, (bool, int)):
+        return str(int(value))
+    value = float(value)
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+def _fmt_labels(labels: Labels, extra: Labels = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for k, v in items)
+    return "{" + body + "}"
+
+class Metrics:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._meta: Dict[str, tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = defaultdict(lambda: defaultdict(float))
+        self._hists: Dict[str, Dict[Labels, list]] = defaultdict(dict)
+        self._callbacks: Dict[str, Callable[[], Any]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        self._counters[name][tuple(labels.items())] += value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(labels.items())
+        h = self._hists[name].get(key)
+        if h is None:
+            # [счётчики по корзинам..., сумма, количество]
+            h = self._hists[name][key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+    def callback(self, name: str, kind: str, help_text: str, fn: Callable[[], Any]):
+        # значение считается в момент выгрузки: число или {labels: число}
+        self.describe(name, kind, help_text)
+        self._callbacks[name] = fn
+
+    def render(self) -> str:
+        out: list[str] = []
+
+        def head(name: str, default_kind: str):
+            kind, help_text = self._meta.get(name, (default_kind, ""))
+            if help_text:
+                out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+
+        for name, series in sorted(self._counters.items()):
+            head(name, "counter")
+            for labels, value in series.items():
+                out.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+        for name, series in sorted(self._hists.items()):
+            head(name, "histogram")
+            for labels, h in series.items():
+                for bound, count in zip(self.buckets, h):
+                    out.append(f"{name}_bucket{_fmt_labels(labels, (('le', f'{bound:g}'),))} {count}")
+                out.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {h[-1]}")
+                out.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(h[-2])}")
+                out.append(f"{name}_count{_fmt_labels(labels)} {h[-1]}")
+        for name, fn in sorted(self._callbacks.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                logging.debug("Metric %s failed: %s", name, e)
+                continue
+            head(name, "gauge")
+            if isinstance(value, dict):
+                for labels, v in value.items():
+                    out.append(f"{name}{_fmt_labels(labels)} {_fmt_value(v)}")
+            else:
+                out.append(f"{name} {_fmt_value(value)}")
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+metrics.describe("bot_handler_seconds", "histogram", "Handler latency")
+metrics.describe("bot_handler_errors_total", "counter", "Handler exceptions")
+metrics.describe("tg_api_request_seconds", "histogram", "Bot API call latency by method")
+metrics.describe("tg_api_requests_total", "counter", "Bot API calls by method and HTTP status")
+metrics.describe("tg_api_retry_after_total", "counter", "429 Too Many Requests by method")
+metrics.describe("bot_update_errors_total", "counter", "Errors reported to the error handler")
+
+def timed_handler(fn):
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await fn(update, context)
+        except Exception:
+            metrics.inc("bot_handler_errors_total", handler=name)
+            raise
+        finally:
+            metrics.observe("bot_handler_seconds", time.perf_counter() - started, handler=name)
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    # HTTPXRequest с учётом времени и кодов ответа Bot API по методам
+    # и настраиваемым временем жизни keep-alive соединений (у httpx по умолчанию 5 с)
+    def __init__(self, *args, keepalive_expiry: Optional[float] = None, **kwargs):
+        self._keepalive_expiry = keepalive_expiry
+        super().__init__(*args, **kwargs)
+
+    def _build_client(self) -> httpx.AsyncClient:
+        if self._keepalive_expiry is not None:
+            limits = self._client_kwargs["limits"]
+            self._client_kwargs["limits"] = httpx.Limits(
+                max_connections=limits.max_connections,
+                max_keepalive_connections=limits.max_keepalive_connections,
+                keepalive_expiry=self._keepalive_expiry,
+            )
+        return super()._build_client()
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            metrics.inc("tg_api_requests_total", method=api_method, status=type(e).__name__)
+            raise
+        finally:
+            metrics.observe("tg_api_request_seconds", time.perf_counter() - started, method=api_method)
+        metrics.inc("tg_api_requests_total", method=api_method, status=str(code))
+        if code == 429:
+            metrics.inc("tg_api_retry_after_total", method=api_method)
+        return code, payload
+
+def build_send_request(pool_size: int = HTTP_POOL_SIZE, **overrides) -> InstrumentedRequest:
+    kwargs = dict(
+        connection_pool_size=pool_size,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        write_timeout=HTTP_WRITE_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        media_write_timeout=HTTP_MEDIA_WRITE_TIMEOUT,
+        http_version=HTTP_VERSION,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    kwargs.update(overrides)
+    return InstrumentedRequest(**kwargs)
+
+def build_get_updates_request() -> InstrumentedRequest:
+    # одно долгоживущее соединение под long polling, не конкурирует с отправками
+    return InstrumentedRequest(
+        connection_pool_size=GET_UPDATES_POOL_SIZE,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=GET_UPDATES_READ_TIMEOUT,
+        write_timeout=HTTP_WRITE_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        http_version=HTTP_VERSION,
+    )
+
+# ── Параллельная обработка апдейтов ────────────────────────────────────────────
+def _long_admin_command(update: object) -> bool:
+    if not isinstance(update, Update) or not update.effective_user or update.effective_user.id not in ADMINS:
+        return False
+    text = update.message.text if update.message else None
+    if not text or not text.startswith("/"):
+        return False
+    return text[1:].split(maxsplit=1)[0].split("@", 1)[0].lower() in LONG_ADMIN_COMMANDS
+
+class UserLaneProcessor(BaseUpdateProcessor):
+    def __init__(self, concurrency: int, admin_concurrency: int):
+        # внешний семафор PTB — только верхняя граница задач; реальный параллелизм ниже
+        super().__init__(max(256, (concurrency + admin_concurrency) * 4))
+        self._regular = asyncio.BoundedSemaphore(max(1, concurrency))
+        self._admin = asyncio.BoundedSemaphore(max(1, admin_concurrency))
+        self._lanes: Dict[int, list] = {}
+
+    @property
+    def lanes(self) -> int:
+        return len(self._lanes)
+
+    async def run_in_lane(self, key: Optional[int], coroutine: Awaitable[Any], admin: bool = False) -> Any:
+        sem = self._admin if admin else self._regular
+        if key is None:
+            async with sem:
+                return await coroutine
+        entry = self._lanes.get(key)
+        if entry is None:
+            entry = self._lanes[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # сначала очередь пользователя, потом общий слот — чтобы ожидающие не занимали слоты
+            async with entry[0]:
+                async with sem:
+                    return await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._lanes[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = None
+        if isinstance(update, Update):
+            if update.effective_user:
+                key = update.effective_user.id
+            elif update.effective_chat:
+                key = update.effective_chat.id
+        if not startup.reported:
+            startup.mark("first_update")
+            startup.report()
+        admin = _long_admin_command(update)
+        # админская полоса не ждёт очередь пользователя, иначе /broadcast держал бы его же репорты
+        await self.run_in_lane(None if admin else key, coroutine, admin=admin)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+update_lanes = UserLaneProcessor(UPDATE_CONCURRENCY, ADMIN_CONCURRENCY)
+
+# ── Кэш чатов ──────────────────────────────────────────────────────────────────
+@dataclass(frozen=True)
+class ChatInfo:
+    chat_id: int
+    name: str
+    username: Optional[str] = None
+    type: Optional[str] = None
+    url: Optional[str] = None
+    resolved: bool = True
+
+class ChatInfoCache:
+    # TTL + LRU; неудачные запросы кэшируются отдельно, с коротким TTL
+    def __init__(self, ttl: float, negative_ttl: float, max_size: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max(1, max_size)
+        self._items: "OrderedDict[int, tuple[float, ChatInfo]]" = OrderedDict()
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def peek(self, chat_id: int) -> Optional[ChatInfo]:
+        item = self._items.get(chat_id)
+        if item is None:
+            return None
+        expires_at, info = item
+        if expires_at <= time.monotonic():
+            del self._items[chat_id]
+            return None
+        self._items.move_to_end(chat_id)
+        return info
+
+    def put(self, info: ChatInfo):
+        ttl = self.ttl if info.resolved else self.negative_ttl
+        self._items[info.chat_id] = (time.monotonic() + ttl, info)
+        self._items.move_to_end(info.chat_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, chat_id: Optional[int] = None):
+        if chat_id is None:
+            self._items.clear()
+        else:
+            self._items.pop(chat_id, None)
+
+    async def get(self, bot, chat_id: int) -> ChatInfo:
+        info = self.peek(chat_id)
+        if info is not None:
+            self.hits += 1
+            return info
+        self.misses += 1
+        # параллельные запросы одного и того же чата ждут общий get_chat
+        fut = self._inflight.get(chat_id)
+        if fut is None:
+            fut = asyncio.ensure_future(self._fetch(bot, chat_id))
+            self._inflight[chat_id] = fut
+            fut.add_done_callback(lambda _f, cid=chat_id: self._inflight.pop(cid, None))
+        return await asyncio.shield(fut)
+
+    async def _fetch(self, bot, chat_id: int) -> ChatInfo:
+        try:
+            chat = await bot.get_chat(chat_id)
+        except Exception as e:
+            logging.warning("Не удалось получить данные чата %s: %s", chat_id, e)
+            info = ChatInfo(chat_id=chat_id, name="❓(неизвестно)", resolved=False)
+        else:
+            username = getattr(chat, "username", None)
+            url = None
+            if username:
+                url = f"https://t.me/{username}"
+            elif chat.type == "private" and chat_id > 0:
+                url = f"tg://user?id={chat_id}"
+            info = ChatInfo(
+                chat_id=chat_id,
+                name=chat.title or chat.full_name or username or "❓Безымянный",
+                username=username,
+                type=chat.type,
+                url=url,
+            )
+        self.put(info)
+        return info
+
+    def resolve_many(self, bot, chat_ids, concurrency: int = CHAT_LOOKUP_CONCURRENCY) -> Dict[int, asyncio.Task]:
+        # уникальные chat_id резолвятся параллельно, не больше concurrency одновременно
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(cid: int) -> ChatInfo:
+            info = self.peek(cid)
+            if info is not None:
+                self.hits += 1
+                return info
+            async with sem:
+                return await self.get(bot, cid)
+
+        return {cid: asyncio.ensure_future(one(cid)) for cid in dict.fromkeys(chat_ids) if cid}
+
+    async def warm(self, bot, chat_ids):
+        started = time.monotonic()
+        tasks = self.resolve_many(bot, chat_ids)
+        await asyncio.gather(*tasks.values())
+        logging.info("Chat cache warmed: %d chats in %.2fs", len(tasks), time.monotonic() - started)
+
+chat_cache = ChatInfoCache(CHAT_CACHE_TTL, CHAT_CACHE_NEGATIVE_TTL, CHAT_CACHE_SIZE)
+
+def chat_name_html(info: ChatInfo) -> str:
+    if info.url:
+        return f'<a href="{html.escape(info.url, quote=True)}">{html.escape(info.name)}</a>'
+    return html.escape(info.name)
+
+# ── Лимиты отправки ────────────────────────────────────────────────────────────
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def idle(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return now >= self._blocked_until and self._tokens + (now - self._updated) * self.rate >= self.capacity
+
+    def block(self, seconds: float):
+        # после RetryAfter ведро молчит, пока Telegram не разрешит снова
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self, tokens: float = 1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+class ChatRateLimiter:
+    # по ведру на чат; полные (простаивающие) вёдра выкидываются при переполнении.
+    # shares > 1 — в чаты, для которых shared(chat_id), пишут все воркеры: каждому своя доля лимита
+    # (запас ведра не меньше одного сообщения, иначе acquire ждал бы вечно)
+    def __init__(self, rate: float, burst: float = 1.0, max_chats: int = 4096,
+                 shares: int = 1, shared: Callable[[int], bool] = lambda chat_id: False):
+        self.rate = rate
+        self.burst = burst
+        self.max_chats = max_chats
+        self.shares = max(1, shares)
+        self.shared = shared
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+
+    def bucket(self, chat_id: int) -> TokenBucket:
+        b = self._buckets.get(chat_id)
+        if b is None:
+            if len(self._buckets) >= self.max_chats:
+                now = time.monotonic()
+                for cid in [cid for cid, old in self._buckets.items() if old.idle(now)]:
+                    del self._buckets[cid]
+            if self.shares > 1 and self.shared(chat_id):
+                b = TokenBucket(self.rate / self.shares, capacity=max(1.0, self.burst / self.shares))
+            else:
+                b = TokenBucket(self.rate, capacity=self.burst)
+            self._buckets[chat_id] = b
+        self._buckets.move_to_end(chat_id)
+        return b
+
+    async def acquire(self, chat_id: int):
+        await self.bucket(chat_id).acquire()
+
+    def block(self, chat_id: int, seconds: float):
+        self.bucket(chat_id).block(seconds)
+
+def shared_chat(chat_id: int) -> bool:
+    # лента и чаты переводчиков получают репорты от всех воркеров; личку пользователя пишет только его воркер
+    return chat_id == FEED_ERRORS_CHAT_ID or chat_id in registry.current.by_chat
+
+# лимит на бота общий для всех воркеров — каждый берёт свою долю; лимит на чат — только в общих чатах
+global_send_bucket = TokenBucket(SEND_GLOBAL_RATE / WEBHOOK_WORKERS)
+chat_send_limiter = ChatRateLimiter(SEND_PER_CHAT_RATE, SEND_PER_CHAT_BURST,
+                                    shares=WEBHOOK_WORKERS, shared=shared_chat)
+
+def retry_after_seconds(e: RetryAfter) -> float:
+    ra = e.retry_after
+    return ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    # экспоненциальная задержка с джиттером
+    return min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+# ── Исходящая очередь ──────────────────────────────────────────────────────────
+# Полосы приоритета: чем меньше число, тем раньше уходит.
+# service — служебные вызовы (автоудаление, прогресс рассылки): после репортов, но раньше самой рассылки,
+# иначе прогресс не обновлялся бы, пока она идёт. Номера полос translator/feed лежат в журнале доставок
+LANE_ACK, LANE_TRANSLATOR, LANE_FEED, LANE_SERVICE, LANE_BROADCAST = range(5)
+LANE_NAMES = {LANE_ACK: "ack", LANE_TRANSLATOR: "translator", LANE_FEED: "feed", LANE_SERVICE: "service",
+              LANE_BROADCAST: "broadcast"}
+
+@dataclass
+class _OutboundJob:
+    lane: int
+    chat_id: int
+    fn: Callable[..., Awaitable[Any]]
+    args: tuple
+    kwargs: dict
+    future: asyncio.Future
+    enqueued_at: float
+    attempt: int = 0
+    on_retry: Optional[Callable[[], None]] = None
+    after: Optional[asyncio.Future] = None
+    stream: Any = None
+
+class SkippedSend(Exception):
+    # отправка не выполнялась: не удалась та, после которой она должна была идти
+    pass
+
+@dataclass
+class LaneStats:
+    submitted: int = 0
+    done: int = 0
+    failed: int = 0
+    retry_after: int = 0
+    retries: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+
+    @property
+    def wait_avg(self) -> float:
+        started = self.done + self.failed
+        return self.wait_total / started if started else 0.0
+
+class OutboundDispatcher:
+    def __init__(self, workers: int, global_bucket: TokenBucket, chat_limiter: ChatRateLimiter,
+                 max_attempts: int = DISPATCH_MAX_ATTEMPTS, lane_limits: Optional[Dict[int, int]] = None):
+        self.workers_n = max(1, workers)
+        self.global_bucket = global_bucket
+        self.chat_limiter = chat_limiter
+        self.max_attempts = max_attempts
+        self.stats: Dict[int, LaneStats] = {lane: LaneStats() for lane in LANE_NAMES}
+        self._lane_limits = {lane: asyncio.Semaphore(n) for lane, n in (lane_limits or {}).items()}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._depth: Dict[int, int] = {lane: 0 for lane in LANE_NAMES}
+        self._seq = 0
+        self._workers: list[asyncio.Task] = []
+        # поток (по умолчанию чат) → отправки, ждущие воркера, который уже занят этим потоком:
+        # порядок в потоке строгий, а остальные воркеры не простаивают в ожидании горячего чата
+        self._chat_waiting: Dict[Any, deque] = {}
+
+    def depth(self, lane: Optional[int] = None) -> int:
+        return self._depth[lane] if lane is not None else sum(self._depth.values())
+
+    def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker(), name=f"outbound-{i}") for i in range(self.workers_n)]
+
+    async def stop(self):
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        while self._queue is not None and not self._queue.empty():
+            *_, job = self._queue.get_nowait()
+            if not job.future.done():
+                job.future.cancel()
+        for waiting in self._chat_waiting.values():
+            for job in waiting:
+                if not job.future.done():
+                    job.future.cancel()
+        self._chat_waiting.clear()
+
+    def submit(self, lane: int, chat_id: int, fn: Callable[..., Awaitable[Any]], /, *args,
+               on_retry: Optional[Callable[[], None]] = None, after: Optional[asyncio.Future] = None,
+               stream: Any = None, **kwargs) -> asyncio.Future:
+        # after — отправка, поставленная раньше в тот же поток: если она не удалась, эта не выполняется;
+        # stream — ключ порядка (по умолчанию chat_id), лимиты всё равно считаются по чату
+        self.start()
+        loop = asyncio.get_running_loop()
+        job = _OutboundJob(lane, chat_id, fn, args, kwargs, loop.create_future(), time.monotonic(),
+                           on_retry=on_retry, after=after, stream=chat_id if stream is None else stream)
+        self.stats[lane].submitted += 1
+        self._put(job)
+        return job.future
+
+    async def send(self, lane: int, chat_id: int, fn: Callable[..., Awaitable[Any]], /, *args, **kwargs) -> Any:
+        return await self.submit(lane, chat_id, fn, *args, **kwargs)
+
+    def _put(self, job: _OutboundJob):
+        self._seq += 1
+        self._depth[job.lane] += 1
+        self._queue.put_nowait((job.lane, self._seq, job))
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            stream = job.stream
+            waiting = self._chat_waiting.get(stream)
+            if waiting is not None:
+                # потоком уже занят другой воркер — он отправит и это, следом
+                waiting.append(job)
+                continue
+            waiting = self._chat_waiting[stream] = deque()
+            try:
+                while True:
+                    self._depth[job.lane] -= 1
+                    if not job.future.done():
+                        await self._run_limited(job)
+                    if not waiting:
+                        break
+                    job = waiting.popleft()
+            finally:
+                self._chat_waiting.pop(stream, None)
+
+    async def _run_limited(self, job: _OutboundJob):
+        if job.after is not None:
+            # обычно уже завершена: поток обслуживается по порядку постановки
+            await asyncio.wait([job.after])
+            if job.after.cancelled() or job.after.exception() is not None:
+                self.stats[job.lane].failed += 1
+                if not job.future.done():
+                    job.future.set_exception(SkippedSend("предыдущая отправка в чат не удалась"))
+                return
+        lane_sem = self._lane_limits.get(job.lane)
+        if lane_sem:
+            await lane_sem.acquire()
+        try:
+            await self.chat_limiter.acquire(job.chat_id)
+            await self.global_bucket.acquire()
+            await self._run(job)
+        finally:
+            if lane_sem:
+                lane_sem.release()
+
+    async def _run(self, job: _OutboundJob):
+        # повторы выполняются здесь же, пока чат занят этим воркером, чтобы не нарушить порядок
+        st = self.stats[job.lane]
+        wait = time.monotonic() - job.enqueued_at
+        st.wait_total += wait
+        st.wait_max = max(st.wait_max, wait)
+        while True:
+            try:
+                result = await job.fn(*job.args, **job.kwargs)
+            except RetryAfter as e:
+                st.retry_after += 1
+                delay = retry_after_seconds(e)
+                self.chat_limiter.block(job.chat_id, delay)
+            except (TimedOut, NetworkError) as e:
+                if isinstance(e, BadRequest) or job.attempt + 1 >= self.max_attempts:
+                    st.failed += 1
+                    chat_health.failure(job.chat_id, e)
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                    return
+                delay = backoff_delay(job.attempt)
+            except Exception as e:
+                st.failed += 1
+                chat_health.failure(job.chat_id, e)
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            else:
+                st.done += 1
+                chat_health.success(job.chat_id)
+                if not job.future.done():
+                    job.future.set_result(result)
+                return
+            job.attempt += 1
+            st.retries += 1
+            if job.on_retry:
+                job.on_retry()
+            await asyncio.sleep(delay)
+            await self.chat_limiter.acquire(job.chat_id)
+            await self.global_bucket.acquire()
+
+    def render(self) -> str:
+        lines = []
+        for lane, name in LANE_NAMES.items():
+            st = self.stats[lane]
+            lines.append(
+                f"{name}: в очереди {self._depth[lane]}, отправлено {st.done}, ошибок {st.failed}, "
+                f"RetryAfter {st.retry_after}, ожидание ср. {st.wait_avg:.2f}s / макс. {st.wait_max:.2f}s"
+            )
+        return "\n".join(lines)
+
+outbound = OutboundDispatcher(
+    DISPATCH_WORKERS, global_send_bucket, chat_send_limiter,
+    lane_limits={LANE_BROADCAST: BROADCAST_CONCURRENCY},
+)
+
+async def reply_text(msg: Message, text: str, /, lane: int = LANE_ACK, **kwargs) -> Message:
+    return await outbound.send(lane, msg.chat_id, msg.reply_text, text, **kwargs)
+
+async def reply_html(msg: Message, text: str, /, lane: int = LANE_ACK, **kwargs) -> Message:
+    return await outbound.send(lane, msg.chat_id, msg.reply_html, text, **kwargs)
+
+# ── Здоровье чатов ─────────────────────────────────────────────────────────────
+# Ошибки, после которых слать в чат бессмысленно, пока там что-то не поменяют руками.
+# "message to forward not found" и подобное — про исходное сообщение, а не про чат, и не считаются.
+_UNREACHABLE_MARKERS = (
+    "chat not found", "bot was kicked", "bot was blocked", "bot is not a member", "user is deactivated",
+    "not enough rights", "have no rights", "need administrator rights", "chat_write_forbidden",
+    "chat_restricted", "peer_id_invalid",
+)
+
+def chat_unreachable(e: BaseException) -> bool:
+    if isinstance(e, Forbidden):
+        return True
+    return isinstance(e, BadRequest) and any(m in str(e).lower() for m in _UNREACHABLE_MARKERS)
+
+class ChatUnavailable(Exception):
+    pass
+
+@dataclass
+class ChatHealth:
+    failures: int = 0
+    opened_at: float = 0.0      # 0 — цепь замкнута, чат считается доступным
+    next_probe: float = 0.0
+    probes: int = 0
+    probing: bool = False
+    last_error: str = ""
+
+class ChatCircuitBreaker:
+    # хранит только чаты с ошибками; успешная отправка (или проверка) удаляет запись
+    def __init__(self, threshold: int, probe_base: float, probe_max: float, max_chats: int,
+                 clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.probe_base = probe_base
+        self.probe_max = probe_max
+        self.max_chats = max(1, max_chats)
+        self.clock = clock
+        self._chats: "OrderedDict[int, ChatHealth]" = OrderedDict()
+        self.opened = 0
+        self.skipped = 0
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def get(self, chat_id: int) -> Optional[ChatHealth]:
+        h = self._chats.get(chat_id)
+        return h if h is not None and h.opened_at else None
+
+    def unhealthy(self) -> Dict[int, ChatHealth]:
+        return {chat_id: h for chat_id, h in self._chats.items() if h.opened_at}
+
+    def allow(self, chat_id: int) -> bool:
+        h = self._chats.get(chat_id)
+        return h is None or not h.opened_at
+
+    def probe_due(self, chat_id: int) -> bool:
+        # True ровно одному вызывающему, когда пора проверить разомкнутый чат
+        h = self._chats.get(chat_id)
+        now = self.clock()
+        if h is None or not h.opened_at or h.probing or now < h.next_probe:
+            return False
+        h.probing = True
+        h.next_probe = now + self._delay(h.probes)
+        return True
+
+    def probe_finished(self, chat_id: int):
+        h = self._chats.get(chat_id)
+        if h is not None:
+            h.probing = False
+
+    def _delay(self, probes: int) -> float:
+        return min(self.probe_max, self.probe_base * 2 ** min(probes, 32))
+
+    def success(self, chat_id: int):
+        h = self._chats.pop(chat_id, None)
+        if h is not None and h.opened_at:
+            logging.info("Chat %s is reachable again after %.0fs, circuit closed",
+                         chat_id, self.clock() - h.opened_at)
+
+    def failure(self, chat_id: int, e: BaseException):
+        if self.threshold <= 0 or not chat_unreachable(e):
+            return
+        h = self._chats.get(chat_id)
+        if h is None:
+            if len(self._chats) >= self.max_chats:
+                self._chats.popitem(last=False)
+            h = self._chats[chat_id] = ChatHealth()
+        h.failures += 1
+        h.last_error = str(e)[:200]
+        now = self.clock()
+        if h.opened_at:
+            h.probes += 1
+            h.next_probe = now + self._delay(h.probes)
+        elif h.failures >= self.threshold:
+            h.opened_at = now
+            h.next_probe = now + self._delay(0)
+            self.opened += 1
+            logging.warning("Chat %s unreachable after %d failures, circuit open: %s", chat_id, h.failures, e)
+
+chat_health = ChatCircuitBreaker(CIRCUIT_FAILURES if WEBHOOK_WORKERS == 1 else 0, CIRCUIT_PROBE_BASE, CIRCUIT_PROBE_MAX, CIRCUIT_MAX_CHATS)
+
+async def probe_chat(bot, chat_id: int):
+    # итог (успех/ошибку) записывает сама исходящая очередь
+    try:
+        await outbound.send(LANE_TRANSLATOR, chat_id, bot.send_chat_action, chat_id=chat_id, action=ChatAction.TYPING)
+    except Exception as e:
+        logging.info("Probe of chat %s failed: %s", chat_id, e)
+    finally:
+        chat_health.probe_finished(chat_id)
+
+def chat_reachable(bot, chat_id: int) -> bool:
+    if chat_health.allow(chat_id):
+        return True
+    if chat_health.probe_due(chat_id):
+        spawn_background(probe_chat(bot, chat_id), name=f"probe-{chat_id}")
+    return False
+
+# ── Перегрузка ─────────────────────────────────────────────────────────────────
+SHED_STAGES = ("normal", "no_acks", "defer_autodelete", "batch_translators", "reject")
+
+def parse_levels(spec: str) -> list[float]:
+    values = [float(x) if float(x) > 0 else float("inf") for x in spec.split(",") if x.strip()]
+    return (values + [float("inf")] * len(SHED_STAGES))[:len(SHED_STAGES) - 1]
+
+class AdmissionControl:
+    # ступень = максимум из ступеней по длине очереди и по задержке цикла событий;
+    # вверх сразу, вниз — по одной, когда нагрузка держится ниже дольше cooldown
+    def __init__(self, depth: Callable[[], int], queue_levels: list[float], lag_levels: list[float],
+                 interval: float, cooldown: float, clock: Callable[[], float] = time.monotonic):
+        self.depth = depth
+        self.queue_levels = queue_levels
+        self.lag_levels = lag_levels
+        self.interval = interval
+        self.cooldown = cooldown
+        self.clock = clock
+        self.level = 0
+        self.lag = 0.0
+        self._calm_since: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self.actions: Dict[str, int] = defaultdict(int)
+
+    @property
+    def stage(self) -> str:
+        return SHED_STAGES[self.level]
+
+    @property
+    def skip_acks(self) -> bool:
+        return self.level >= 1
+
+    @property
+    def defer_deletes(self) -> bool:
+        return self.level >= 2
+
+    @property
+    def batch_busy_chats(self) -> bool:
+        return self.level >= 3
+
+    @property
+    def reject(self) -> bool:
+        return self.level >= 4
+
+    def count(self, action: str):
+        self.actions[action] += 1
+        metrics.inc("bot_shed_actions_total", action=action)
+
+    def measure(self, depth: int, lag: float) -> int:
+        level = 0
+        for i, (max_depth, max_lag) in enumerate(zip(self.queue_levels, self.lag_levels), start=1):
+            if depth >= max_depth or lag >= max_lag:
+                level = i
+        return level
+
+    def update(self, depth: int, lag: float):
+        target = self.measure(depth, lag)
+        now = self.clock()
+        if target >= self.level:
+            self._calm_since = None
+            if target > self.level:
+                self._set(target, depth, lag)
+        elif self._calm_since is None:
+            self._calm_since = now
+        elif now - self._calm_since >= self.cooldown:
+            self._calm_since = now
+            self._set(self.level - 1, depth, lag)
+
+    def _set(self, level: int, depth: int, lag: float):
+        for stage in SHED_STAGES[self.level + 1:level + 1]:
+            metrics.inc("bot_shed_stage_entered_total", stage=stage)
+        log = logging.warning if level > self.level else logging.info
+        log("Load shedding: %s -> %s (outbound queue %d, loop lag %.3fs)",
+            self.stage, SHED_STAGES[level], depth, lag)
+        self.level = level
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="admission")
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            # пик держится и затухает, чтобы одна заминка не дёргала ступени туда-сюда
+            self.lag = max(lag, self.lag * 0.8)
+            self.update(self.depth(), self.lag)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+shedding = AdmissionControl(lambda: outbound_backlog(), parse_levels(SHED_QUEUE_LEVELS), parse_levels(SHED_LAG_LEVELS),
+                            SHED_CHECK_INTERVAL, SHED_COOLDOWN)
+metrics.describe("bot_shed_stage_entered_total", "counter", "Times each load shedding stage was entered")
+metrics.describe("bot_shed_actions_total", "counter", "Work skipped, deferred, batched or rejected by load shedding")
+
+SHED_REJECT_TEXT = "🙏 Сейчас очень много репортов, бот не успевает. Попробуй, пожалуйста, через пару минут."
+
+# ── Дубликаты репортов ─────────────────────────────────────────────────────────
+@dataclass
+class DuplicateEntry:
+    first_seen: float
+    count: int = 1
+    # заголовки уже доставленного репорта: (lane, chat_id, message_id, html-текст)
+    headers: list = field(default_factory=list)
+    # доставки первого репорта в пути (+1 — резерв, пока fan-out их ставит) и дошла ли хоть одна;
+    # запись, по которой ничего не дошло и ничего не в пути, дубликаты не поглощает
+    inflight: int = 1
+    delivered: bool = False
+    key: tuple = ()
+
+class DuplicateIndex:
+    # (код новеллы, отпечаток) → первый репорт; порядок вставки = порядок по времени,
+    # поэтому просроченные и лишние записи всегда в начале
+    def __init__(self, window: float, max_entries: int, clock: Callable[[], float] = time.monotonic):
+        self.window = window
+        self.max_entries = max(1, max_entries)
+        self.clock = clock
+        self._entries: "OrderedDict[tuple[str, bytes], DuplicateEntry]" = OrderedDict()
+        self.merged = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self, now: float):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - entry.first_seen < self.window:
+                break
+            del self._entries[key]
+
+    def check(self, code: str, fingerprint: Optional[bytes]) -> tuple[bool, Optional[DuplicateEntry]]:
+        # (дубликат?, запись); новая запись создаётся сразу, до доставки,
+        # чтобы одновременные одинаковые репорты не ушли оба
+        if not fingerprint or self.window <= 0:
+            return False, None
+        now = self.clock()
+        self._evict(now)
+        key = (code, fingerprint)
+        entry = self._entries.get(key)
+        if entry is not None and (entry.delivered or entry.inflight):
+            entry.count += 1
+            self.merged += 1
+            return True, entry
+        # первый такой репорт так и не дошёл до переводчика — этот считается новым
+        self._entries.pop(key, None)
+        entry = self._entries[key] = DuplicateEntry(now, key=key)
+        return False, entry
+
+    def discard(self, code: str, fingerprint: Optional[bytes]):
+        if fingerprint:
+            self._entries.pop((code, fingerprint), None)
+
+    def settle(self, entry: DuplicateEntry, delivered: bool):
+        # доставка (или резерв fan-out) завершилась окончательно
+        entry.inflight = max(0, entry.inflight - 1)
+        entry.delivered = entry.delivered or delivered
+        if not entry.inflight and not entry.delivered and self._entries.get(entry.key) is entry:
+            self.discard(*entry.key)
+
+duplicates = DuplicateIndex(DEDUP_WINDOW if WEBHOOK_WORKERS == 1 else 0, DEDUP_MAX_ENTRIES)
+
+# ── Журнал доставок ────────────────────────────────────────────────────────────
+@dataclass
+class Delivery:
+    # одна доставка: необязательный заголовок + пересылки в один чат
+    chat_id: int
+    refs: list
+    header: Optional[str] = None
+    topic_id: int = 0
+    lane: int = LANE_TRANSLATOR
+    header_sent: bool = False
+    id: int = 0
+    attempts: int = 0
+    next_at: float = 0.0
+    # запись индекса дубликатов, чью судьбу решает эта доставка; в журнал не пишется
+    duplicate: Optional[DuplicateEntry] = field(default=None, repr=False, compare=False)
+
+    def payload(self) -> str:
+        return json.dumps({
+            "chat_id": self.chat_id, "refs": self.refs, "header": self.header, "topic_id": self.topic_id,
+            "lane": self.lane, "header_sent": self.header_sent,
+        }, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_row(cls, row) -> "Delivery":
+        row_id, payload, attempts, next_at = row
+        data = json.loads(payload)
+        return cls(data["chat_id"], [tuple(r) for r in data["refs"]], data["header"], data["topic_id"],
+                   data["lane"], data["header_sent"], row_id, attempts, next_at)
+
+class Outbox:
+    # Все изменения идут через одного писателя: пока в потоке идёт транзакция, новые операции
+    # копятся и уходят следующим коммитом (group commit) — один fsync на пачку, а не на доставку
+    def __init__(self, path: str, max_attempts: int, retry_base: float, retry_max: float,
+                 synchronous: str = "FULL"):
+        self.path = path
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.synchronous = synchronous if synchronous in ("OFF", "NORMAL", "FULL", "EXTRA") else "FULL"
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._ops: list[tuple[str, tuple, Optional[asyncio.Future]]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._retry_heap: list[tuple[float, int, Delivery]] = []
+        self._retry_wakeup: Optional[asyncio.Event] = None
+        self._retry_task: Optional[asyncio.Task] = None
+        self._attempt: Optional[Callable[..., Awaitable[Any]]] = None
+        self._bot = None
+        self.unfinished = 0
+        self.commits = 0
+        self.ops_written = 0
+        self.retried = 0
+        self.dropped = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0, next_at REAL NOT NULL, created_at REAL NOT NULL)"
+            )
+            # репорты, ждущие дайджеста: пишутся при приёме, удаляются в одной транзакции с доставкой дайджеста
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS digest_items ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, payload TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+        return self._db
+
+    def _write(self, ops: list[tuple[str, tuple, Optional[asyncio.Future]]]) -> list[int]:
+        with self._db_lock:
+            db = self._connect()
+            with db:
+                return [db.execute(sql, params).lastrowid for sql, params, _ in ops]
+
+    def _load(self) -> list[Delivery]:
+        with self._db_lock:
+            rows = self._connect().execute("SELECT id, payload, attempts, next_at FROM outbox ORDER BY id").fetchall()
+        return [Delivery.from_row(row) for row in rows]
+
+    def load_digest_items(self) -> list[tuple[int, int, str]]:
+        with self._db_lock:
+            return self._connect().execute("SELECT id, chat_id, payload FROM digest_items ORDER BY id").fetchall()
+
+    def _submit(self, sql: str, params: tuple, wait: bool) -> Optional[asyncio.Future]:
+        if self._writer is None:
+            self._wakeup = asyncio.Event()
+            self._writer = asyncio.create_task(self._write_loop(), name="outbox-writer")
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self._ops.append((sql, params, future))
+        self._wakeup.set()
+        return future
 
-from dotenv import load_dotenv
-from telegram import (
-    Update, InlineKeyboardMarkup, InlineKeyboardButton, Message,
-    ReplyKeyboardMarkup, KeyboardButton, BotCommand
-)
-from telegram.constants import ParseMode
-from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler,
-    ConversationHandler, CallbackQueryHandler, ContextTypes, filters,
-)
-from telegram.error import Forbidden, BadRequest, TimedOut, RetryAfter, NetworkError
+    async def _write_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await self._commit()
 
-# ── Окружение ──────────────────────────────────────────────────────────────────
-load_dotenv()
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-ADMINS = {int(x) for x in os.getenv("ADMINS", "").split(",") if x.strip().isdigit()}
-MODE = os.getenv("MODE", "polling").lower()
-WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "dev-secret")
+    async def _commit(self):
+        ops, self._ops = self._ops, []
+        if not ops:
+            return
+        try:
+            ids = await asyncio.to_thread(self._write, ops)
+        except Exception as e:
+            logging.error("Outbox commit of %d ops failed: %s", len(ops), e)
+            for *_, future in ops:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+        self.commits += 1
+        self.ops_written += len(ops)
+        for (*_, future), row_id in zip(ops, ids):
+            if future is not None and not future.done():
+                future.set_result(row_id)
 
-FEED_ERRORS_CHAT_ID = int(os.getenv("FEED_ERRORS_CHAT_ID", "0") or 0)
-FEED_ERRORS_TOPIC_ID = int(os.getenv("FEED_ERRORS_TOPIC_ID", "0") or 0)
+    async def record(self, d: Delivery) -> int:
+        # возвращается после коммита: запись переживёт падение процесса
+        now = time.time()
+        d.id = await self._submit(
+            "INSERT INTO outbox (payload, attempts, next_at, created_at) VALUES (?, 0, ?, ?)",
+            (d.payload(), now, now), wait=True,
+        )
+        self.unfinished += 1
+        return d.id
 
-# ── Новеллы ────────────────────────────────────────────────────────────────────
-NOVELS: Dict[str, int] = {
-    "ac": 336967830,
-    "adastra": 0,
-    "ahj": 0,
-    "amitw": 0,
-    "aptch": 1351092369,
-    "arches": 0,
-    "as": 670538680,
-    "auc": 494289742,
-    "avd": 1360254175,
-    "bgad": 1360254175,
-    "bs": 0,
-    "bsm": 0,
-    "bth": 0,
-    "burrows": 112986742,
-    "cc": 494289742,
-    "cienie": 1360254175,
-    "chopro": 112986742,
-    "choprosta": 112986742,
-    "cleaved": 494289742,
-    "conway": 1360254175,
-    "cw": 0,
-    "cycles": 1351092369,
-    "dad": 336967830,
-    "dawntide": 733344501,
-    "dc": 0,
-    "dt": 573586386,
-    "dwb": 2005031396,
-    "dy": 0,
-    "ec": 0,
-    "echo": 0,
-    "eissb": 0,
-    "er": 112986742,
-    "ersf": 0,
-    "exastra": 494289742,
-    "fbi": 0,
-    "fbtw": 792423369,
-    "flfl": 670538680,
-    "fafo": 0,
-    "fur": 646231660,
-    "fwj": 1360254175,
-    "gd": 1236892676,
-    "gh": 897249661,
-    "gwh": 0,
-    "ha": 1139020740,
-    "helward": 112986742,
-    "heso": 494289742,
-    "hise": 0,
-    "hze": 256335589,
-    "icoe": 2023906069,
-    "icoml": 1236892676,
-    "if": 0,
-    "ifs": 1236892676,
-    "iwo": 5481531399,
-    "interea": 0,
-    "khemia": 47456266,
-    "kingsguard": 2023906069,
-    "lautomne": 1916703564,
-    "laranja": 0,
-    "limits": 573586386,
-    "ls": 1360254175,
-    "lwr": 494289742,
-    "lyre": 792423369,
-    "mc": 0,
-    "ne": 792423369,
-    "nerus": 0,
-    "nl": 1731042870,
-    "nmf": 1980970876,
-    "ns": 1360254175,
-    "ntt": 1360254175,
-    "ow": 2005031396,
-    "password": 2005031396,
-    "pervader": 0,
-    "pn": 1360254175,
-    "reconnected": 1236892676,
-    "repeat": 0,
-    "rtf": 494289742,
-    "run": 494289742,
-    "ryt": 1478790307,
-    "sa": 2005031396,
-    "satoi": 1236892676,
-    "sg": 646231660,
-    "sileo": 792423369,
-    "silverstone": 0,
-    "sl": 0,
-    "sn": 0,
-    "soulcreek": 897249661,
-    "starville": 1360254175,
-    "steadfast": 0,
-    "sylving": 256335589,
-    "ta": 1236892676,
-    "tb": 1360254175,
-    "tbc": 1236892676,
-    "tocn": 494289742,
-    "tos": 0,
-    "ts": 646231660,
-    "tsr": 1360254175,
-    "tsrcs": 0,
-    "tsrss": 0,
-    "twt": 1236892676,
-    "undefeated": 1236892676,
-    "unveiling": 897249661,
-    "vd": 1731042870,
-    "ve": 897249661,
-    "vm": 862463638,
-    "wiky": 1236892676,
-    "wyn": 646231660,
-    "yb": 646231660,
-}
-NOVEL_LABELS: Dict[str, str] = {
-    "ac": "After Class (#ac)",
-    "adastra": "Adastra (#adastra)",
-    "ahj": "A Hellish Journey (#ahj)",
-    "amitw": "A Masquerade in the Woods (#amitw)",
-    "aptch": "A Place to Call Home (#aptch)",
-    "arches": "Arches (#arches)",
-    "as": "Arcane Shop (#as)",
-    "auc": "All Under Control (#auc)",
-    "avd": "A Vagrant Disguise (#avd)",
-    "bgad": "Between Gods and Demons (#bgad)",
-    "bs": "Badtime Stories (#bs)",
-    "bsm": "Bitter Sweet Memories (#bsm)",
-    "bth": "Beyond the Harbor (#bth)",
-    "burrows": "Burrows (#burrows)",
-    "cc": "Cryptid Crush (#cc)",
-    "cienie": "Cienie (#cienie)",
-    "chopro": "Chord Progressions (#chopro)",
-    "choprosta": "Chord Progressions: Staccato (#choprosta)",
-    "cleaved": "Cleaved (#cleaved)",
-    "conway": "Conway (#conway)",
-    "cw": "Clawstar Wrestling (#cw)",
-    "cycles": "Cycles (#cycles)",
-    "dad": "Deers and Deckards (#dad)",
-    "dawntide": "DawnTide (#dawntide)",
-    "dc": "Dawn Chorus (#dc)",
-    "dt": "Distant Travels (#dt)",
-    "dwb": "Dinner with Blan (#dwb)",
-    "dy": "Dearest you (#dy)",
-    "ec": "Eclipse City (#ec)",
-    "echo": "Echo (#echo)",
-    "eissb": "Echo Interactive Short Story: Benefits (#eissb)",
-    "er": "Eden's Reach (#er)",
-    "ersf": "Echo: Route 65 (#ersf)",
-    "exastra": "Exastra (#exastra)",
-    "fbi": "Fueled by insanity (#fbi)",
-    "fbtw": "Far Beyond the World (#fbtw)",
-    "flfl": "Flaming Flagon (#flfl)",
-    "fafo": "Fatal Force (#fafo)",
-    "fur": "Furry university rebirth (#fur)",
-    "fwj": "Four Way Junction (#fwj)",
-    "gd": "Gamer Den (#gd)",
-    "gh": "Glory Hounds (#gh)",
-    "gwh": "Gnoll Way Home (#gwh)",
-    "ha": "Hero's Advent (#ha)",
-    "helward": "Helward (#helward)",
-    "heso": "Heat Source (#heso)",
-    "hise": "High Seas (#hise)",
-    "hze": "Home Zomewhere Else (#hze)",
-    "icoe": "In case of Emergency (#icoe)",
-    "icoml": "I.C.O. - Machina Lutris (#icoml)",
-    "if": "Integrity's Fall (#if)",
-    "ifs": "In Finite Space (#ifs)",
-    "iwo": "I Want Out!! (#iwo)",
-    "interea": "Interea (#interea)",
-    "khemia": "Khemia (#khemia)",
-    "kingsguard": "Kingsguard (#kingsguard)",
-    "lautomne": "L'Automne (#lautomne)",
-    "laranja": "Laranja (#laranja)",
-    "limits": "Limits (#limits)",
-    "ls": "Lust Shards (#ls)",
-    "lwr": "Lunch with Ronan (#lwr)",
-    "lyre": "Lyre (#lyre)",
-    "mc": "Moonlight Castle (#mc)",
-    "ne": "Nowhere's End (#ne)",
-    "nerus": "Nerus (#nerus)",
-    "nl": "Northern Lights (#nl)",
-    "nmf": "No more future (#nmf)",
-    "ns": "Next Step (#ns)",
-    "ntt": "9:22 (#ntt)",
-    "ow": "Outland Wanderer (#ow)",
-    "password": "Password (#password)",
-    "pervader": "Pervader (#pervader)",
-    "pn": "Polar Night (#pn)",
-    "reconnected": "Reconnected (#reconnected)",
-    "repeat": "Repeat (#repeat)",
-    "rtf": "Remember the Flowers (#rtf)",
-    "run": "RUN (#run)",
-    "ryt": "Roads Yet Traveled (#ryt)",
-    "sa": "Socially Awkward (#sa)",
-    "satoi": "Sparks: A Tale of Ink (#satoi)",
-    "sg": "Scary Gourmet (#sg)",
-    "sileo": "Sileo (#sileo)",
-    "silverstone": "Silverstone (#silverstone)",
-    "sl": "Santa Lucia (#sl)",
-    "sn": "Super Nova (#sn)",
-    "soulcreek": "Soulcreek (#soulcreek)",
-    "starville": "Starville (#starville)",
-    "steadfast": "Steadfast (#steadfast)",
-    "sylving": "Sylving (#sylving)",
-    "ta": "Tennis Ace (#ta)",
-    "tb": "Temptation's Ballad (#tb)",
-    "tbc": "The Blue Cloth (#tbc)",
-    "tocn": "That One Celestial Night (#tocn)",
-    "tos": "Tavern of Spear (#tos)",
-    "ts": "The Slums (#ts)",
-    "tsr": "The Smoke Room (#tsr)",
-    "tsrcs": "The Smoke Room: Christmas Special (#tsrcs)",
-    "tsrss": "The Smoke Room: Summer Special (#tsrss)",
-    "twt": "The Wayward Tower (#twt)",
-    "undefeated": "Undefeated (#undefeated)",
-    "unveiling": "Unveiling (#unveiling)",
-    "vd": "Void Dreaming (#vd)",
-    "ve": "Vulgor's exchange (#ve)",
-    "vm": "Violet Memoir (#vm)",
-    "wiky": "When I Knew you (#wiky)",
-    "wyn": "What's your name? (#wyn)",
-    "yb": "Yoga Bear (#yb)",
-}
+    async def record_digest_item(self, chat_id: int, payload: str) -> int:
+        return await self._submit(
+            "INSERT INTO digest_items (chat_id, payload, created_at) VALUES (?, ?, ?)",
+            (chat_id, payload, time.time()), wait=True,
+        )
 
-# ── Константы меню ─────────────────────────────────────────────────────────────
-BTN_START = "📝 Начать отчёт"
-BTN_SEND  = "📤 Отправить отчёт"
-BTN_CANCEL= "❌ Отмена"
+    def digest_items_done(self, ids: list[int]):
+        if ids:
+            self._submit(f"DELETE FROM digest_items WHERE id IN ({','.join('?' * len(ids))})", tuple(ids), wait=False)
 
-MENU_KB = ReplyKeyboardMarkup(
-    [
-        [KeyboardButton(BTN_START)],
-        [KeyboardButton(BTN_SEND)],
-        [KeyboardButton(BTN_CANCEL)],
-    ],
-    resize_keyboard=True, one_time_keyboard=False, selective=False
-)
+    def done(self, d: Delivery):
+        # удаление можно не ждать: если не успеет — доставка повторится после рестарта
+        self._submit("DELETE FROM outbox WHERE id = ?", (d.id,), wait=False)
+        self.unfinished -= 1
 
-# ── Диалог ─────────────────────────────────────────────────────────────────────
-CHOOSE_NOVEL, COLLECT_MESSAGES = range(2)
+    def progress(self, d: Delivery):
+        self._submit("UPDATE outbox SET payload = ? WHERE id = ?", (d.payload(), d.id), wait=False)
 
-# ── Антифлуд ───────────────────────────────────────────────────────────────────
-user_last_action_ts: Dict[int, float] = {}
-def rate_limited(user_id: int, cooldown_sec: int = 3) -> bool:
-    now = time.time()
-    prev = user_last_action_ts.get(user_id, 0)
-    if now - prev < cooldown_sec:
+    def failed(self, d: Delivery, error: Exception) -> bool:
+        # False — попытки кончились, запись выброшена
+        d.attempts += 1
+        if d.attempts >= self.max_attempts:
+            self.dropped += 1
+            logging.error("Outbox: delivery %d to %s dropped after %d attempts: %s",
+                          d.id, d.chat_id, d.attempts, error)
+            self.done(d)
+            return False
+        delay = min(self.retry_max, self.retry_base * 2 ** (d.attempts - 1)) * random.uniform(0.8, 1.2)
+        d.next_at = time.time() + delay
+        self._submit("UPDATE outbox SET payload = ?, attempts = ?, next_at = ? WHERE id = ?",
+                     (d.payload(), d.attempts, d.next_at, d.id), wait=False)
+        logging.warning("Outbox: delivery %d to %s failed (attempt %d), retry in %.1fs: %s",
+                        d.id, d.chat_id, d.attempts, delay, error)
+        self._schedule(d)
         return True
-    user_last_action_ts[user_id] = now
-    return False
 
-# ── Модель состояния ───────────────────────────────────────────────────────────
-@dataclass
-class PendingReport:
-    code: Optional[str] = None
-    msgs: list[Message] = field(default_factory=list)
+    def _schedule(self, d: Delivery):
+        heapq.heappush(self._retry_heap, (d.next_at, d.id, d))
+        if self._retry_wakeup is not None:
+            self._retry_wakeup.set()
 
-ACK_TTL   = 15
-DONE_TTL  = 10
-CANCEL_TTL= 7
+    def start(self, bot, attempt: Callable[..., Awaitable[Any]]) -> int:
+        # незавершённые записи прошлого запуска — в очередь повторов сразу
+        self._bot, self._attempt = bot, attempt
+        self._retry_wakeup = asyncio.Event()
+        restored = self._load()
+        for d in restored:
+            self._schedule(d)
+        self.unfinished += len(restored)
+        if restored:
+            logging.info("Outbox: replaying %d unfinished deliveries from %s", len(restored), self.path)
+        self._retry_task = asyncio.create_task(self._retry_loop(), name="outbox-retry")
+        return len(restored)
 
-async def _autodelete_after(bot, chat_id: int, message_id: int, seconds: int):
-    try:
-        await asyncio.sleep(seconds)
-        await bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except Exception as e:
-        logging.debug(f"Autodelete failed ({chat_id}:{message_id}): {e}")
+    async def _retry_loop(self):
+        while True:
+            if not self._retry_heap:
+                await self._retry_wakeup.wait()
+                self._retry_wakeup.clear()
+                continue
+            delay = self._retry_heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._retry_wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._retry_wakeup.clear()
+                continue
+            _, _, d = heapq.heappop(self._retry_heap)
+            self.retried += 1
+            spawn_background(self._attempt(self._bot, d), name=f"outbox-{d.id}")
 
-def schedule_autodelete(context: ContextTypes.DEFAULT_TYPE, message: Message, seconds: int):
-    asyncio.create_task(_autodelete_after(context.bot, message.chat_id, message.message_id, seconds))
-
-def build_novel_keyboard() -> InlineKeyboardMarkup:
-    items = sorted(NOVEL_LABELS.items(), key=lambda kv: kv[1].lower())
-    rows, row = [], []
-    for i, (code, label) in enumerate(items, start=1):
-        row.append(InlineKeyboardButton(label, callback_data=f"pick:{code}"))
-        if i % 2 == 0:
-            rows.append(row); row=[]
-    if row: rows.append(row)
-    rows.append([InlineKeyboardButton("Отмена", callback_data="cancel")])
-    return InlineKeyboardMarkup(rows)
-
-def extract_hashtag_code(text: str) -> Optional[str]:
-    if not text:
-        return None
-    for w in text.lower().split():
-        if w.startswith("#"):
-            code = w[1:]
-            if code in NOVELS:
-                return code
-    return None
-
-async def forward_message(msg: Message, target_chat_id: int):
-    try:
-        await msg.forward(chat_id=target_chat_id)
-    except Exception as e:
-        logging.exception("Forward failed: %s", e)
+    @property
+    def waiting_retry(self) -> int:
+        return len(self._retry_heap)
+
+    async def close(self):
+        for task in (self._retry_task, self._writer):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*(t for t in (self._retry_task, self._writer) if t is not None), return_exceptions=True)
+        self._retry_task = self._writer = None
+        await self._commit()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+outbox = Outbox(worker_path(OUTBOX_DB), OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX, OUTBOX_SYNC)
 
 # ── Сервис ─────────────────────────────────────────────────────────────────────
 async def _chat_name_and_url(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> tuple[str, Optional[str]]:
-    try:
-        chat = await context.bot.get_chat(chat_id)
-        name = chat.title or chat.full_name or chat.username or "❓Безымянный"
-        url = None
-        if getattr(chat, "username", None):
-            url = f"https://t.me/{chat.username}"
-        elif chat.type == "private" and chat_id > 0:
-            url = f"tg://user?id={chat_id}"
-        return name, url
-    except Exception as e:
-        logging.warning(f"Не удалось получить данные чата {chat_id}: {e}")
-        return "❓(неизвестно)", None
+    info = await chat_cache.get(context.bot, chat_id)
+    return info.name, info.url
+
+BULK_MAX_IDS = 100  # лимит forwardMessages/copyMessages
+
+def message_refs(messages) -> list[tuple[int, int]]:
+    return [(m.chat_id, m.message_id) for m in messages]
+
+def _bulk_batches(refs: list[tuple[int, int]]) -> list[tuple[int, list[int]]]:
+    # подряд идущие сообщения одного чата с возрастающими id, не больше 100 — порядок не меняется
+    batches: list[tuple[int, list[int]]] = []
+    for chat_id, message_id in refs:
+        if (batches and batches[-1][0] == chat_id and len(batches[-1][1]) < BULK_MAX_IDS
+                and batches[-1][1][-1] < message_id):
+            batches[-1][1].append(message_id)
+        else:
+            batches.append((chat_id, [message_id]))
+    return batches
+
+def submit_messages(bot, refs: list[tuple[int, int]], target_chat_id: int, topic_id: int = 0,
+                    lane: int = LANE_TRANSLATOR, after: Optional[asyncio.Future] = None, stream: Any = None) -> list:
+    # все пачки репорта встают в один поток очереди разом, поэтому идут подряд и без блокировки чата;
+    # результаты собирает collect_messages
+    copy = REPORT_DELIVERY_MODE == "copy"
+    single = bot.copy_message if copy else bot.forward_message
+    bulk = bot.copy_messages if copy else bot.forward_messages
+    thread_id = topic_id or None
+    jobs = []
+    for from_chat_id, ids in _bulk_batches(refs):
+        if len(ids) > 1:
+            future = outbound.submit(lane, target_chat_id, bulk, chat_id=target_chat_id, from_chat_id=from_chat_id,
+                                     message_ids=ids, message_thread_id=thread_id, after=after, stream=stream)
+        else:
+            future = outbound.submit(lane, target_chat_id, single, chat_id=target_chat_id, from_chat_id=from_chat_id,
+                                     message_id=ids[0], message_thread_id=thread_id, after=after, stream=stream)
+        jobs.append((from_chat_id, ids, future))
+    return jobs
+
+def forget_jobs(futures):
+    # результат больше не нужен: что ещё в очереди — отменяем, ошибки уже завершённых забираем молча
+    for future in futures:
+        future.cancel()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+async def collect_messages(bot, jobs: list, target_chat_id: int, topic_id: int = 0,
+                           lane: int = LANE_TRANSLATOR, stream: Any = None) -> int:
+    copy = REPORT_DELIVERY_MODE == "copy"
+    single = bot.copy_message if copy else bot.forward_message
+    thread_id = topic_id or None
+    delivered = 0
+    for i, (from_chat_id, ids, future) in enumerate(jobs):
+        try:
+            result = await future
+        except Exception as e:
+            if chat_unreachable(e) or isinstance(e, SkippedSend):
+                forget_jobs(f for _, _, f in jobs[i + 1:])
+                raise
+            if len(ids) == 1:
+                logging.exception("Forward to %s failed: %s", target_chat_id, e)
+                continue
+            if not isinstance(e, (Forbidden, BadRequest)):
+                logging.exception("Bulk delivery to %s failed: %s", target_chat_id, e)
+                continue
+            # пачку отклонили целиком — пробуем по одному, чтобы дошло хоть что-то
+            logging.warning("Bulk delivery to %s rejected, falling back to single sends: %s", target_chat_id, e)
+            for message_id in ids:
+                try:
+                    await outbound.send(lane, target_chat_id, single, chat_id=target_chat_id,
+                                        from_chat_id=from_chat_id, message_id=message_id,
+                                        message_thread_id=thread_id, stream=stream)
+                    delivered += 1
+                except Exception as e:
+                    if chat_unreachable(e):
+                        forget_jobs(f for _, _, f in jobs[i + 1:])
+                        raise
+                    logging.exception("Forward to %s failed: %s", target_chat_id, e)
+            continue
+        if len(ids) == 1:
+            delivered += 1
+            continue
+        delivered += len(result)
+        if len(result) < len(ids):
+            logging.warning("Bulk delivery to %s skipped %d of %d messages",
+                            target_chat_id, len(ids) - len(result), len(ids))
+    return delivered
 
 async def send_report_to_chat(
     context: ContextTypes.DEFAULT_TYPE,
     code: str,
     from_user_id: int,
     from_user_name: str,
-    messages: list[Message],
+    refs: list[tuple[int, int]],
     target_chat_id: int,
     topic_id: int = 0,
+    lane: int = LANE_FEED,
+    duplicate: Optional[DuplicateEntry] = None,
 ):
     header = (
-        f"📬 Репорт по новелле: <b>{html.escape(NOVEL_LABELS.get(code, code))}</b>\n"
+        f"📬 Репорт по новелле: <b>{html.escape(registry.current.label(code))}</b>\n"
         f"От: <a href='tg://user?id={from_user_id}'>{html.escape(from_user_name or 'пользователь')}</a>"
     )
-    await context.bot.send_message(
-        chat_id=target_chat_id,
-        text=header,
-        parse_mode=ParseMode.HTML,
-        disable_web_page_preview=True,
-        message_thread_id=(topic_id or None),
-    )
-    for m in messages:
+    await queue_delivery(context.bot, Delivery(target_chat_id, refs, header, topic_id, lane, duplicate=duplicate),
+                         on_sent=lambda sent: remember_header(context.bot, duplicate, lane, sent, header))
+
+async def fan_out_report(context: ContextTypes.DEFAULT_TYPE, code: str, user, refs: list[tuple[int, int]],
+                         duplicate: Optional[DuplicateEntry] = None, translator_header: bool = False):
+    # переводчик, лента (и любые будущие адресаты) доставляются параллельно;
+    # возвращается, как только все доставки записаны в журнал
+    bot = context.bot
+    index = registry.current
+    target_chat_id = index.novels.get(code, 0)
+    queued = []
+    if target_chat_id and not chat_reachable(bot, target_chat_id):
+        # чат переводчика недоступен — репорт уйдёт только в ленту
+        chat_health.skipped += 1
+        target_chat_id = 0
+    batch = (target_chat_id and shedding.batch_busy_chats
+             and deliveries_waiting(target_chat_id) >= SHED_BUSY_CHAT)
+    if batch:
+        shedding.count("batched")
+    if target_chat_id and (batch or digests.enabled_for(target_chat_id)):
+        await digests.add(bot, target_chat_id, code, user.id, user.first_name, refs,
+                          window=SHED_BATCH_WINDOW if batch and not digests.enabled_for(target_chat_id) else None)
+        if duplicate is not None:
+            # репорт принят в дайджест — копии поглощаются, как и при прямой доставке
+            duplicate.delivered = True
+    elif target_chat_id:
+        header = None
+        if translator_header:
+            header = (
+                f"📬 Репорт по новелле: <b>{html.escape(index.label(code))}</b>\n"
+                f"От: <a href='tg://user?id={user.id}'>{html.escape(user.first_name or 'пользователь')}</a>"
+            )
+        queued.append(queue_delivery(
+            bot, Delivery(target_chat_id, refs, header, duplicate=duplicate),
+            on_sent=lambda sent: remember_header(bot, duplicate, LANE_TRANSLATOR, sent, header),
+        ))
+    if FEED_ERRORS_CHAT_ID:
+        queued.append(send_report_to_chat(
+            context=context,
+            code=code,
+            from_user_id=user.id,
+            from_user_name=user.first_name,
+            refs=refs,
+            target_chat_id=FEED_ERRORS_CHAT_ID,
+            topic_id=FEED_ERRORS_TOPIC_ID,
+            duplicate=duplicate,
+        ))
+    try:
+        await asyncio.gather(*queued)
+    finally:
+        # снимаем резерв: если ничего не поставлено или всё уже провалилось, отпечаток освобождается
+        if duplicate is not None:
+            duplicates.settle(duplicate, delivered=False)
+
+def translator_down(bot, code: str) -> bool:
+    # цепь чата переводчика разомкнута — fan_out_report отправит репорт только в ленту
+    return not chat_reachable(bot, registry.current.novels.get(code, 0))
+
+def report_ack(index: NovelIndex, sent: list[str], down: list[str]) -> str:
+    lines = []
+    if sent:
+        lines.append(f"✅ Репорт отправлен переводчику для {', '.join(index.label(code) for code in sent)}.")
+    if down:
+        labels = ", ".join(index.label(code) for code in down)
+        lines.append(f"📥 Переводчик для {labels} сейчас недоступен — репорт сохранён в общей ленте ошибок."
+                     if FEED_ERRORS_CHAT_ID else
+                     f"⚠️ Переводчик для {labels} сейчас недоступен — репорт не доставлен, попробуй позже.")
+    return "\n".join(lines)
+
+# незавершённые доставки по чатам — для перегрузки; порядок сообщений держит сама исходящая очередь
+_deliveries_inflight: Dict[int, int] = {}
+_delivery_seq = 0
+
+def delivery_stream(chat_id: int) -> Any:
+    # доставки в чат расходятся по DELIVERY_STREAMS_PER_CHAT потокам очереди по кругу
+    global _delivery_seq
+    if DELIVERY_STREAMS_PER_CHAT == 1:
+        return chat_id
+    _delivery_seq += 1
+    return (chat_id, _delivery_seq % DELIVERY_STREAMS_PER_CHAT)
+
+def deliveries_waiting(chat_id: int) -> int:
+    return _deliveries_inflight.get(chat_id, 0)
+
+def outbound_backlog() -> int:
+    # доставки ставят все свои отправки в очередь сразу, так что её глубины достаточно
+    return outbound.depth()
+
+async def attempt_delivery(bot, d: Delivery) -> Optional[Message]:
+    _deliveries_inflight[d.chat_id] = _deliveries_inflight.get(d.chat_id, 0) + 1
+    try:
+        return await _attempt_delivery(bot, d)
+    finally:
+        _deliveries_inflight[d.chat_id] -= 1
+        if not _deliveries_inflight[d.chat_id]:
+            del _deliveries_inflight[d.chat_id]
+
+async def _attempt_delivery(bot, d: Delivery) -> Optional[Message]:
+    # заголовок отправляется один раз: после него запись помечается, и повтор шлёт только пересылки.
+    # Заголовок и пересылки встают в один поток очереди вместе и идут подряд; другие репорты в тот же
+    # чат идут соседними потоками и не ждут, пока этот доставится целиком. Без заголовка пересылки не уходят
+    sent = None
+    jobs = []
+    stream = delivery_stream(d.chat_id)
+    try:
+        if not chat_reachable(bot, d.chat_id):
+            raise ChatUnavailable(f"чат недоступен: {chat_health.get(d.chat_id).last_error}")
+        header = None
+        if d.header and not d.header_sent:
+            header = outbound.submit(
+                d.lane, d.chat_id, bot.send_message,
+                chat_id=d.chat_id, text=d.header, parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True, message_thread_id=(d.topic_id or None), stream=stream,
+            )
+        if d.refs:
+            jobs = submit_messages(bot, d.refs, d.chat_id, topic_id=d.topic_id, lane=d.lane, after=header,
+                                   stream=stream)
+        if header is not None:
+            sent = await header
+            d.header_sent = True
+            if d.id:
+                outbox.progress(d)
+        if jobs and not await collect_messages(bot, jobs, d.chat_id, topic_id=d.topic_id, lane=d.lane, stream=stream):
+            raise RuntimeError(f"ни одно из {len(d.refs)} сообщений не доставлено")
+    except Exception as e:
+        forget_jobs(future for _, _, future in jobs)
+        if d.id:
+            retrying = outbox.failed(d, e)
+        else:
+            retrying = False
+            logging.exception("Delivery to %s failed: %s", d.chat_id, e)
+        if not retrying and d.duplicate is not None:
+            duplicates.settle(d.duplicate, delivered=False)
+        return sent
+    if d.id:
+        outbox.done(d)
+    if d.duplicate is not None:
+        duplicates.settle(d.duplicate, delivered=True)
+    return sent
+
+async def deliver(bot, d: Delivery) -> Optional[Message]:
+    try:
+        await outbox.record(d)
+    except Exception as e:
+        logging.warning("Outbox unavailable, delivering to %s without it: %s", d.chat_id, e)
+    return await attempt_delivery(bot, d)
+
+async def queue_delivery(bot, d: Delivery, on_sent: Optional[Callable[[Message], None]] = None) -> asyncio.Task:
+    # запись в журнал ждём, саму отправку — нет
+    if d.duplicate is not None:
+        d.duplicate.inflight += 1
+    try:
+        await outbox.record(d)
+    except Exception as e:
+        logging.warning("Outbox unavailable, delivering to %s without it: %s", d.chat_id, e)
+
+    async def run():
+        sent = await attempt_delivery(bot, d)
+        if sent is not None and on_sent is not None:
+            on_sent(sent)
+    return spawn_background(run(), name=f"delivery-{d.chat_id}")
+
+def _duplicate_header(header: str, count: int) -> str:
+    return f"{header}\n🔁 Повторных репортов: {count - 1}" if count > 1 else header
+
+async def _edit_header(bot, lane: int, chat_id: int, message_id: int, text: str):
+    try:
+        await outbound.send(lane, chat_id, bot.edit_message_text, chat_id=chat_id, message_id=message_id,
+                            text=text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    except BadRequest as e:
+        # «message is not modified» или заголовок уже удалили
+        logging.debug("Duplicate counter edit skipped in %s: %s", chat_id, e)
+    except Exception as e:
+        logging.warning("Duplicate counter edit failed in %s: %s", chat_id, e)
+
+def remember_header(bot, entry: Optional[DuplicateEntry], lane: int, sent: Optional[Message], header: str):
+    if entry is None or sent is None:
+        return
+    entry.headers.append((lane, sent.chat_id, sent.message_id, header))
+    # пока первый репорт доставлялся, могли прийти его копии
+    if entry.count > 1:
+        spawn_background(_edit_header(bot, lane, sent.chat_id, sent.message_id,
+                                      _duplicate_header(header, entry.count)), name="dedup-edit")
+
+async def merge_duplicate(bot, entry: DuplicateEntry):
+    # вместо повторной пересылки — счётчик в заголовках первого репорта
+    await asyncio.gather(*(
+        _edit_header(bot, lane, chat_id, message_id, _duplicate_header(header, entry.count))
+        for lane, chat_id, message_id, header in entry.headers
+    ))
+
+# ── Дайджесты переводчикам ─────────────────────────────────────────────────────
+DIGEST_HEADER_LIMIT = 3500  # запас до 4096 символов сообщения
+
+@dataclass
+class _DigestItem:
+    code: str
+    user_id: int
+    user_name: str
+    refs: list[tuple[int, int]]
+    window: float = 0.0
+    id: int = 0
+
+    def payload(self) -> str:
+        return json.dumps({"code": self.code, "user_id": self.user_id, "user_name": self.user_name,
+                           "refs": self.refs, "window": self.window}, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_row(cls, row) -> "_DigestItem":
+        row_id, _, payload = row
+        data = json.loads(payload)
+        return cls(data["code"], data["user_id"], data["user_name"], [tuple(r) for r in data["refs"]],
+                   data["window"], row_id)
+
+class DigestBuffer:
+    def __init__(self, chats: set[int], window: float, max_reports: int):
+        self.chats = chats
+        self.window = window
+        self.max_reports = max(1, max_reports)
+        self._items: Dict[int, list[_DigestItem]] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._bot = None
+        self.flushed = 0
+        self.reports = 0
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self._items.values())
+
+    def enabled_for(self, chat_id: int) -> bool:
+        return chat_id in self.chats
+
+    async def add(self, bot, chat_id: int, code: str, user_id: int, user_name: str, refs: list[tuple[int, int]],
+                  window: Optional[float] = None):
+        # как и обычная доставка, репорт сначала записывается в журнал — подтверждение пользователю уже честное
+        self._bot = bot
+        item = _DigestItem(code, user_id, user_name, refs, self.window if window is None else window)
+        try:
+            item.id = await outbox.record_digest_item(chat_id, item.payload())
+        except Exception as e:
+            logging.warning("Outbox unavailable, digest item for %s kept in memory only: %s", chat_id, e)
+        self._buffer(chat_id, item)
+
+    def _buffer(self, chat_id: int, item: _DigestItem):
+        items = self._items.setdefault(chat_id, [])
+        items.append(item)
+        timer = self._timers.get(chat_id)
+        loop = asyncio.get_running_loop()
+        if len(items) >= self.max_reports:
+            self._flush(chat_id)
+        elif timer is None or timer.when() > loop.time() + item.window:
+            # у пачки срок самого нетерпеливого репорта
+            if timer is not None:
+                timer.cancel()
+            self._timers[chat_id] = loop.call_later(item.window, self._flush, chat_id)
+
+    def restore(self, bot) -> int:
+        # репорты, принятые до падения/рестарта, снова ждут своего дайджеста
+        self._bot = bot
+        try:
+            rows = outbox.load_digest_items()
+        except Exception as e:
+            logging.warning("Не удалось прочитать дайджесты из %s: %s", outbox.path, e)
+            return 0
+        for row in rows:
+            self._buffer(row[1], _DigestItem.from_row(row))
+        if rows:
+            logging.info("Digests: restored %d buffered reports", len(rows))
+        return len(rows)
+
+    def _take(self, chat_id: int) -> list[_DigestItem]:
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        return self._items.pop(chat_id, [])
+
+    def _flush(self, chat_id: int):
+        items = self._take(chat_id)
+        if items:
+            spawn_background(self._send(self._bot, chat_id, items), name=f"digest-{chat_id}")
+
+    @staticmethod
+    def render(items: list[_DigestItem]) -> tuple[str, list[tuple[int, int]]]:
+        # репорты группируются по новелле: в заголовке новелла и кто прислал, пересылки в том же порядке
+        index = registry.current
+        by_code: Dict[str, list[_DigestItem]] = {}
+        for item in items:
+            by_code.setdefault(item.code, []).append(item)
+        lines = [f"📬 Репорты за последнее время: {len(items)}"]
+        refs: list[tuple[int, int]] = []
+        size, hidden = len(lines[0]), 0
+        for code, group in by_code.items():
+            reporters = ", ".join(
+                f"<a href='tg://user?id={it.user_id}'>{html.escape(it.user_name or 'пользователь')}</a>"
+                for it in group
+            )
+            line = f"• <b>{html.escape(index.label(code))}</b> ({len(group)}) — {reporters}"
+            if hidden or size + len(line) > DIGEST_HEADER_LIMIT:
+                hidden += 1
+            else:
+                lines.append(line)
+                size += len(line) + 1
+            for it in group:
+                refs.extend(it.refs)
+        if hidden:
+            lines.append(f"…и ещё новелл: {hidden}")
+        return "\n".join(lines), refs
+
+    async def _send(self, bot, chat_id: int, items: list[_DigestItem]):
+        header, refs = self.render(items)
         try:
-            await m.forward(chat_id=target_chat_id, message_thread_id=(topic_id or None))
+            # удаление репортов и запись доставки ставятся подряд без await между ними —
+            # попадают в один групповой коммит журнала
+            outbox.digest_items_done([it.id for it in items if it.id])
+            await deliver(bot, Delivery(chat_id, refs, header))
         except Exception as e:
-            logging.exception("Forward to feed failed: %s", e)
+            logging.exception("Digest to %s failed: %s", chat_id, e)
+            return
+        self.flushed += 1
+        self.reports += len(items)
+
+    async def flush_all(self):
+        # при остановке — отправить всё накопленное, пока исходящая очередь ещё работает
+        pending = {chat_id: self._take(chat_id) for chat_id in list(self._items)}
+        await asyncio.gather(*(self._send(self._bot, chat_id, items) for chat_id, items in pending.items() if items))
+
+digests = DigestBuffer(DIGEST_CHATS if WEBHOOK_WORKERS == 1 else set(), DIGEST_WINDOW, DIGEST_MAX_REPORTS)
 
 # ── Команды ────────────────────────────────────────────────────────────────────
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.effective_message.reply_text(
+    await reply_text(update.effective_message,
         "Привет! Я пересылаю репорты об ошибках переводчикам.\n\n"
         f"• Нажми «{BTN_START}», выбери новеллу и присылай сообщения/фото.\n"
         "• Или добавь к сообщению хэштег новеллы (например: «Нашёл опечатку #aptch»).\n"
@@ -373,136 +2611,262 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=MENU_KB,
     )
 
+@timed_handler
 async def whoami(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     user = update.effective_user
-    await update.effective_message.reply_html(
+    await reply_html(update.effective_message,
         f"🪪 chat_id: <code>{chat.id}</code>\n"
         f"👤 user_id: <code>{user.id}</code>\n"
         f"Тип чата: {chat.type}"
     )
 
 # ── Диалог /report ─────────────────────────────────────────────────────────────
+@timed_handler
 async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if rate_limited(update.effective_user.id):
         return
-    context.user_data["pending"] = PendingReport()
-    await update.effective_message.reply_text("Выбери новеллу:", reply_markup=build_novel_keyboard())
+    if shedding.reject:
+        shedding.count("rejected")
+        m = await reply_text(update.effective_message, SHED_REJECT_TEXT)
+        schedule_autodelete(context, m, ACK_TTL)
+        return ConversationHandler.END
+    set_pending(context, update.effective_user.id, PendingReport())
+    await reply_text(update.effective_message, "Выбери новеллу:", reply_markup=build_novel_keyboard())
     return CHOOSE_NOVEL
 
+@timed_handler
 async def pick_novel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
-    await q.answer()
+    chat_id = update.effective_chat.id
+    await outbound.send(LANE_ACK, chat_id, q.answer)
     _, code = q.data.split(":", 1)
-    if code not in NOVELS:
-        await q.edit_message_text("Неизвестная новелла. Отменено.")
+    index = registry.current
+    if code not in index.novels:
+        await outbound.send(LANE_ACK, chat_id, q.edit_message_text, "Неизвестная новелла. Отменено.")
         return ConversationHandler.END
 
-    pending: PendingReport = context.user_data.get("pending")
-    if not pending:
+    pending = get_pending(context, update.effective_user.id)
+    if pending is None:
         pending = PendingReport()
     pending.code = code
-    context.user_data["pending"] = pending
+    pending.touch()
+    set_pending(context, update.effective_user.id, pending)
 
-    await q.edit_message_text(
-        f"Новелла: {NOVEL_LABELS.get(code, code)}\n\n"
+    await outbound.send(
+        LANE_ACK, chat_id, q.edit_message_text,
+        f"Новелла: {index.label(code)}\n\n"
         f"Пришли сообщения с ошибками. Когда закончишь — нажми «{BTN_SEND}» или команду /send."
     )
     return COLLECT_MESSAGES
 
+@timed_handler
+async def novel_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    chat_id = update.effective_chat.id
+    await outbound.send(LANE_ACK, chat_id, q.answer)
+    _, page = q.data.split(":", 1)
+    if page.isdigit():
+        try:
+            await outbound.send(LANE_ACK, chat_id, q.edit_message_reply_markup,
+                                reply_markup=build_novel_keyboard(int(page)))
+        except BadRequest as e:
+            # «message is not modified» — нажали на уже открытую страницу
+            logging.debug("Novel page switch skipped: %s", e)
+    return CHOOSE_NOVEL
+
+@dataclass
+class _Album:
+    update: Update
+    context: ContextTypes.DEFAULT_TYPE
+    msgs: list[Message]
+    timer: Optional[asyncio.TimerHandle] = None
+
+class MediaGroupAggregator:
+    # части альбома приходят отдельными апдейтами; копим их, пока не стихнет поток
+    def __init__(self, window: float, handler: Callable[..., Awaitable[Any]]):
+        self.window = window
+        self.handler = handler
+        self._albums: Dict[tuple[int, str], _Album] = {}
+
+    def __len__(self) -> int:
+        return len(self._albums)
+
+    def add(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        msg = update.effective_message
+        key = (update.effective_user.id, msg.media_group_id)
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = _Album(update, context, [])
+        album.msgs.append(msg)
+        if album.timer is not None:
+            album.timer.cancel()
+        album.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+
+    def _flush(self, key: tuple[int, str]):
+        # альбом остаётся в словаре до обработки — его может забрать flush_user
+        self._albums[key].timer = None
+        spawn_background(self._run(key), name=f"album-{key[1]}")
+
+    async def _run(self, key: tuple[int, str]):
+        try:
+            # альбом обрабатывается в очереди своего пользователя, как обычный апдейт
+            started = time.perf_counter()
+            await update_lanes.run_in_lane(key[0], self._handle(key))
+            metrics.observe("bot_handler_seconds", time.perf_counter() - started, handler="album")
+        except Exception as e:
+            logging.exception("Album handling failed: %s", e)
+
+    async def _handle(self, key: tuple[int, str]):
+        album = self._albums.get(key)
+        if album is None or album.timer is not None:
+            return  # уже обработан через flush_user или пришла новая часть и окно началось заново
+        del self._albums[key]
+        album.msgs.sort(key=lambda m: m.message_id)
+        await self.handler(album.update, album.context, album.msgs)
+
+    async def flush_user(self, user_id: int):
+        # /send и /cancel не должны обгонять части альбома, которые ещё ждут окна:
+        # обрабатываем их сразу. Вызывается из очереди этого пользователя, поэтому
+        # обработчик зовём напрямую — run_in_lane здесь ждал бы сам себя
+        for key in [key for key in self._albums if key[0] == user_id]:
+            album = self._albums.pop(key)
+            if album.timer is not None:
+                album.timer.cancel()
+            album.msgs.sort(key=lambda m: m.message_id)
+            try:
+                await self.handler(album.update, album.context, album.msgs)
+            except Exception as e:
+                logging.exception("Album handling failed: %s", e)
+
+@timed_handler
 async def collect_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    pending: PendingReport = context.user_data.get("pending")
     msg = update.effective_message
-    text = (msg.text or msg.caption or "")
-    code = extract_hashtag_code(text)
+    if msg.media_group_id:
+        albums.add(update, context)
+        pending = get_pending(context, update.effective_user.id)
+        return COLLECT_MESSAGES if pending is not None and pending.code else ConversationHandler.END
+    return await handle_report_messages(update, context, [msg])
 
-    if not ((pending and pending.code) or code):
+async def handle_report_messages(update: Update, context: ContextTypes.DEFAULT_TYPE, msgs: list[Message]):
+    # одно сообщение или целый альбом — одно событие для антифлуда и одна доставка
+    pending = get_pending(context, update.effective_user.id)
+    msg = msgs[0]
+    codes = list(dict.fromkeys(code for m in msgs for code in extract_hashtag_codes(m)))
+
+    if not ((pending is not None and pending.code) or codes):
         return ConversationHandler.END
 
-    if rate_limited(update.effective_user.id, cooldown_sec=3):
-        if pending and pending.code:
-            m = await msg.reply_text("⏱ Подожди пару секунд перед новым репортом.")
+    if rate_limited(update.effective_user.id, "collect" if pending is not None and pending.code else "hashtag"):
+        if pending is not None and pending.code:
+            m = await reply_text(msg, "⏱ Подожди пару секунд перед новым репортом.")
             schedule_autodelete(context, m, ACK_TTL)
         return ConversationHandler.END
 
-    if not (pending and pending.code):
-        target_chat_id = NOVELS.get(code, 0)
-        if target_chat_id:
-            await forward_message(msg, target_chat_id)
-        if FEED_ERRORS_CHAT_ID:
-            try:
-                await send_report_to_chat(
-                    context=context,
-                    code=code,
-                    from_user_id=update.effective_user.id,
-                    from_user_name=update.effective_user.first_name,
-                    messages=[msg],
-                    target_chat_id=FEED_ERRORS_CHAT_ID,
-                    topic_id=FEED_ERRORS_TOPIC_ID,
-                )
-            except Exception as e:
-                logging.exception("Send to feed failed: %s", e)
-        ack = await msg.reply_text(f"✅ Репорт отправлен переводчику для {NOVEL_LABELS.get(code, code)}.")
+    if not (pending is not None and pending.code):
+        if shedding.reject:
+            shedding.count("rejected")
+            m = await reply_text(msg, SHED_REJECT_TEXT)
+            schedule_autodelete(context, m, ACK_TTL)
+            return ConversationHandler.END
+        index = registry.current
+        refs = message_refs(msgs)
+        fingerprint = report_fingerprint(msgs)
+        delivered = []
+        down = [code for code in codes if translator_down(context.bot, code)]
+        for code in codes:
+            is_duplicate, entry = duplicates.check(code, fingerprint)
+            if is_duplicate:
+                spawn_background(merge_duplicate(context.bot, entry), name="dedup-merge")
+            else:
+                delivered.append((code, entry))
+        try:
+            await asyncio.gather(*(
+                fan_out_report(context, code, update.effective_user, refs, entry) for code, entry in delivered
+            ))
+        except Exception as e:
+            logging.exception("Report fan-out failed: %s", e)
+        delivered = [code for code, _ in delivered]
+        if delivered:
+            ack = await reply_text(msg, report_ack(index, [code for code in delivered if code not in down],
+                                                   [code for code in delivered if code in down]))
+        else:
+            ack = await reply_text(msg, "✅ Такой репорт уже есть у переводчика — отметили, что ты тоже его нашёл.")
         schedule_autodelete(context, ack, ACK_TTL)
         return ConversationHandler.END
 
-    pending.msgs.append(msg)
-    context.user_data["pending"] = pending
-    note = await msg.reply_text(f"Принял. Можешь отправить ещё или нажми «{BTN_SEND}».")
+    added = 0
+    for m in msgs:
+        if not pending.add(m):
+            break
+        added += 1
+    if added:
+        set_pending(context, update.effective_user.id, pending)
+    if added < len(msgs):
+        m = await reply_text(msg, f"Лимит — {REPORT_MAX_MESSAGES} сообщений в одном репорте. Нажми «{BTN_SEND}».")
+        schedule_autodelete(context, m, ACK_TTL)
+        return COLLECT_MESSAGES
+    if shedding.skip_acks:
+        shedding.count("ack_skipped")
+        return COLLECT_MESSAGES
+    note = await reply_text(msg, f"Принял. Можешь отправить ещё или нажми «{BTN_SEND}».")
     schedule_autodelete(context, note, ACK_TTL)
     return COLLECT_MESSAGES
 
+albums = MediaGroupAggregator(MEDIA_GROUP_WINDOW, handle_report_messages)
+
+@timed_handler
 async def send_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    pending: PendingReport = context.user_data.get("pending")
-    if not pending or not pending.code or not pending.msgs:
-        await update.effective_message.reply_text("❌ Нет сообщений для отправки.")
+    await albums.flush_user(update.effective_user.id)
+    pending = get_pending(context, update.effective_user.id)
+    if not pending or not pending.code or not len(pending):
+        await reply_text(update.effective_message, "❌ Нет сообщений для отправки.")
         return ConversationHandler.END
 
+    if shedding.reject:
+        # собранное не теряется — /send можно повторить позже
+        shedding.count("rejected")
+        await reply_text(update.effective_message, SHED_REJECT_TEXT + " Собранные сообщения сохранены.")
+        return COLLECT_MESSAGES
+
     code = pending.code
-    target_chat_id = NOVELS.get(code, 0)
+    refs = pending.refs()
+    down = translator_down(context.bot, code)
+    if down and not FEED_ERRORS_CHAT_ID:
+        # доставить некуда — оставляем собранное, чтобы повторить /send позже
+        chat_health.skipped += 1
+        await reply_text(update.effective_message,
+                         "⚠️ Переводчик сейчас недоступен — репорт не отправлен. "
+                         "Собранные сообщения сохранены, попробуй /send позже.")
+        return COLLECT_MESSAGES
 
-    if target_chat_id:
-        header = (
-            f"📬 Репорт по новелле: <b>{NOVEL_LABELS.get(code, code)}</b>\n"
-            f"От: <a href='tg://user?id={update.effective_user.id}'>{update.effective_user.first_name}</a>"
-        )
-        try:
-            await context.bot.send_message(
-                chat_id=target_chat_id, text=header,
-                parse_mode=ParseMode.HTML, disable_web_page_preview=True
-            )
-            for m in pending.msgs:
-                try:
-                    await forward_message(m, target_chat_id)
-                except (Forbidden, BadRequest, TimedOut, RetryAfter, NetworkError) as e:
-                    logging.exception("Forward to translator failed: %s", e)
-        except Exception as e:
-            logging.exception("Translator DM failed: %s", e)
+    is_duplicate, entry = duplicates.check(code, pending.fingerprint)
+    if is_duplicate:
+        spawn_background(merge_duplicate(context.bot, entry), name="dedup-merge")
+        await reply_text(update.effective_message, "✅ Такой репорт уже есть у переводчика — отметили, что ты тоже его нашёл.")
+        set_pending(context, update.effective_user.id, None)
+        return ConversationHandler.END
 
-    if FEED_ERRORS_CHAT_ID:
-        try:
-            await send_report_to_chat(
-                context=context,
-                code=code,
-                from_user_id=update.effective_user.id,
-                from_user_name=update.effective_user.first_name,
-                messages=pending.msgs,
-                target_chat_id=FEED_ERRORS_CHAT_ID,
-                topic_id=FEED_ERRORS_TOPIC_ID,
-            )
-        except Exception as e:
-            logging.exception("Send to feed failed: %s", e)
+    try:
+        await fan_out_report(context, code, update.effective_user, refs, entry, translator_header=True)
+    except Exception as e:
+        logging.exception("Report fan-out failed: %s", e)
 
-    await update.effective_message.reply_text("✅ Репорт передан переводчику 🙌")
-    context.user_data["pending"] = None
+    await reply_text(update.effective_message,
+                     "📥 Переводчик сейчас недоступен — репорт сохранён в общей ленте ошибок."
+                     if down else "✅ Репорт передан переводчику 🙌")
+    set_pending(context, update.effective_user.id, None)
     return ConversationHandler.END
 
+@timed_handler
 async def cancel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["pending"] = None
-    await update.effective_message.reply_text("Отчёт отменён.")
+    await albums.flush_user(update.effective_user.id)
+    set_pending(context, update.effective_user.id, None)
+    await reply_text(update.effective_message, "Отчёт отменён.")
     return ConversationHandler.END
 
 # ── Меню-кнопки (Reply Keyboard) ───────────────────────────────────────────────
+@timed_handler
 async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     txt = (update.message.text or "").strip()
     if txt == BTN_START:
@@ -513,20 +2877,73 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await cancel_cmd(update, context)
     # если это не наша кнопка — ничего не делаем
 
-# ── Админка ─────────────────────────────────────────────────────────
-def _group_targets_by_chat() -> dict[int, list[str]]:
-    by_chat: dict[int, list[str]] = {}
-    for code, chat_id in NOVELS.items():
-        by_chat.setdefault(chat_id, []).append(code)
-    return by_chat
+# ── Рассылка ───────────────────────────────────────────────────────────────────
+@dataclass
+class BroadcastStats:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    skipped: int = 0
+
+    @property
+    def pending(self) -> int:
+        return self.total - self.sent - self.failed - self.skipped
+
+    def render(self, done: bool = False) -> str:
+        title = "✅ Рассылка завершена" if done else "📢 Рассылка идёт…"
+        return (f"{title}\n"
+                f"Отправлено: {self.sent} · ❌ Ошибок: {self.failed} · ⏳ В очереди: {self.pending}"
+                + (f"\n🔁 Повторов: {self.retried}" if self.retried else "")
+                + (f"\n⚠️ Пропущено недоступных чатов: {self.skipped}" if self.skipped else ""))
+
+async def run_broadcast(bot, jobs: list[tuple[int, str]], disable_notification: bool = False,
+                        stats: Optional[BroadcastStats] = None) -> BroadcastStats:
+    # лимиты, RetryAfter и повторы берёт на себя исходящая очередь
+    stats = stats or BroadcastStats()
+    stats.total = len(jobs)
+
+    def on_retry():
+        stats.retried += 1
 
+    async def one(chat_id: int, text: str):
+        if not chat_reachable(bot, chat_id):
+            stats.skipped += 1
+            return
+        try:
+            await outbound.send(LANE_BROADCAST, chat_id, bot.send_message, chat_id=chat_id, text=text,
+                                disable_notification=disable_notification, on_retry=on_retry)
+            stats.sent += 1
+        except Exception as e:
+            logging.warning("Broadcast to %s failed: %s", chat_id, e)
+            stats.failed += 1
+
+    await asyncio.gather(*(one(chat_id, text) for chat_id, text in jobs))
+    return stats
+
+async def _broadcast_progress(progress_msg: Message, stats: BroadcastStats):
+    last = None
+    while True:
+        await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+        text = stats.render()
+        if text == last:
+            continue
+        try:
+            # RetryAfter выжидает сама очередь
+            await outbound.send(LANE_SERVICE, progress_msg.chat_id, progress_msg.edit_text, text)
+            last = text
+        except Exception as e:
+            logging.debug("Broadcast progress edit failed: %s", e)
+
+# ── Админка ─────────────────────────────────────────────────────────
+@timed_handler
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id not in ADMINS:
-        await update.message.reply_text("⛔ Нет прав.")
+        await reply_text(update.message, "⛔ Нет прав.")
         return
     if not context.args:
-        await update.message.reply_text(
+        await reply_text(update.message,
             "Используй: /broadcast <текст>\n"
             "Опции:\n"
             "  /broadcast -codes aptch,soulcreek <текст>\n"
@@ -548,10 +2965,11 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     text = " ".join(args).strip()
     if not text:
-        await update.message.reply_text("Пустой текст. Используй: /broadcast <текст>")
+        await reply_text(update.message, "Пустой текст. Используй: /broadcast <текст>")
         return
 
-    by_chat = _group_targets_by_chat()
+    index = registry.current
+    by_chat = dict(index.by_chat)
     if target_codes is not None:
         filtered: dict[int, list[str]] = {}
         for chat_id, codes in by_chat.items():
@@ -559,79 +2977,148 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if keep: filtered[chat_id] = keep
         by_chat = filtered
 
-    ok, fail = 0, 0
+    jobs = []
     for chat_id, codes in by_chat.items():
         if chat_id == 0: continue
-        novels_line = ", ".join(NOVEL_LABELS.get(c, c) for c in sorted(codes))
+        novels_line = ", ".join(index.label(c) for c in sorted(codes))
         header = f"📢 Сообщение от админа\nТвои новеллы: {novels_line}\n\n"
-        try:
-            await context.bot.send_message(chat_id=chat_id, text=header + text, disable_notification=disable_notification)
-            ok += 1
-        except Exception:
-            fail += 1
+        jobs.append((chat_id, header + text))
+
+    stats = BroadcastStats(total=len(jobs))
+    msg = await reply_text(update.message, stats.render())
+    progress = asyncio.create_task(_broadcast_progress(msg, stats))
+    started = time.monotonic()
+    try:
+        await run_broadcast(context.bot, jobs, disable_notification=disable_notification, stats=stats)
+    finally:
+        progress.cancel()
+    logging.info("Broadcast: %d sent, %d failed, %d retries in %.2fs",
+                 stats.sent, stats.failed, stats.retried, time.monotonic() - started)
 
-    msg = await update.message.reply_text(f"✅ Отправлено: {ok}, ❌ Ошибок: {fail}")
+    try:
+        await outbound.send(LANE_SERVICE, msg.chat_id, msg.edit_text, stats.render(done=True))
+    except Exception as e:
+        logging.debug("Broadcast summary edit failed: %s", e)
     schedule_autodelete(context, msg, ACK_TTL)
 
+def _ago(t: float) -> str:
+    return f"{max(0, time.monotonic() - t) / 60:.0f} мин"
+
+def _until(t: float) -> str:
+    left = t - time.monotonic()
+    return f"через {left / 60:.0f} мин" if left > 0 else "скоро"
+
+@timed_handler
 async def listnovels(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id not in ADMINS:
-        await update.message.reply_text("⛔ Нет прав."); return
-    if not NOVELS:
-        await update.message.reply_text("❌ Список новелл пуст."); return
+        await reply_text(update.message, "⛔ Нет прав."); return
+    index = registry.current
+    if not index.novels:
+        await reply_text(update.message, "❌ Список новелл пуст."); return
 
     MAX_HTML_LEN = 3500
-    lines = []
-    for code, chat_id in sorted(NOVELS.items(), key=lambda kv: NOVEL_LABELS.get(kv[0], kv[0]).lower()):
-        label = NOVEL_LABELS.get(code, code)
-        if chat_id == 0:
-            name_html = "🚫 переводчика нет"
-        else:
-            try:
-                chat = await context.bot.get_chat(chat_id)
-                chat_name = chat.title or chat.full_name or chat.username or "❓Безымянный"
-                url = None
-                if getattr(chat, "username", None):
-                    url = f"https://t.me/{chat.username}"
-                elif chat.type == "private" and chat_id > 0:
-                    url = f"tg://user?id={chat_id}"
-                name_html = (f'<a href="{html.escape(url, quote=True)}">{html.escape(chat_name)}</a>' if url
-                             else html.escape(chat_name))
-            except Exception as e:
-                logging.warning(f"Не удалось получить имя/ссылку для {chat_id}: {e}")
-                name_html = "❓(неизвестно)"
-        lines.append(f"• {html.escape(label)}\n   ↳ {name_html} (<code>{chat_id}</code>)")
+    started = time.monotonic()
+    entries = [(code, index.novels[code]) for code in index.sorted_codes]
+    cached = sum(1 for cid in index.by_chat if cid and chat_cache.peek(cid) is not None)
+    lookups = chat_cache.resolve_many(context.bot, (chat_id for _, chat_id in entries))
 
     header = "📚 Список новелл:\n"
     footer = ""
 
+    # куски уходят по мере готовности, не дожидаясь всех get_chat
+    sent = 0
     buf, cur_len = [], len(header) + len(footer) + 10
-    for line in lines:
-        add_len = len(line) + 1
-        if cur_len + add_len > MAX_HTML_LEN and buf:
-            await update.message.reply_html(header + "\n".join(buf) + footer, disable_web_page_preview=True)
-            buf, cur_len = [], len(header) + len(footer) + 10
-        buf.append(line); cur_len += add_len
-    if buf:
-        await update.message.reply_html(header + "\n".join(buf) + footer, disable_web_page_preview=True)
+    try:
+        for code, chat_id in entries:
+            label = index.label(code)
+            if chat_id == 0:
+                name_html = "🚫 переводчика нет"
+            else:
+                name_html = chat_name_html(await lookups[chat_id])
+            line = f"• {html.escape(label)}\n   ↳ {name_html} (<code>{chat_id}</code>)"
+            health = chat_health.get(chat_id)
+            if health is not None:
+                line += (f"\n   ⚠️ недоступен уже {_ago(health.opened_at)}: {html.escape(health.last_error)}, "
+                         f"проверка {_until(health.next_probe)}")
+            add_len = len(line) + 1
+            if cur_len + add_len > MAX_HTML_LEN and buf:
+                await reply_html(update.message, header + "\n".join(buf) + footer, disable_web_page_preview=True)
+                sent += 1
+                buf, cur_len = [], len(header) + len(footer) + 10
+            buf.append(line); cur_len += add_len
+        if buf:
+            await reply_html(update.message, header + "\n".join(buf) + footer, disable_web_page_preview=True)
+            sent += 1
+        unhealthy = [cid for cid in chat_health.unhealthy() if cid in index.by_chat]
+        if unhealthy:
+            await reply_text(update.message, f"⚠️ Недоступно чатов переводчиков: {len(unhealthy)} — "
+                                             f"репорты по их новеллам идут только в ленту.")
+            sent += 1
+    finally:
+        for task in lookups.values():
+            task.cancel()
+
+    logging.info(
+        "listnovels: %d novels, %d unique chats (%d cached), %d messages in %.2fs",
+        len(entries), len(lookups), cached, sent, time.monotonic() - started,
+    )
+
+@timed_handler
+async def queue_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMINS:
+        await reply_text(update.message, "⛔ Нет прав."); return
+    await reply_text(
+        update.message,
+        f"📮 Исходящая очередь ({outbound.depth()} в ожидании):\n{outbound.render()}\n\n"
+        f"🗑 Автоудаление: ждут {autodelete.pending}, удалено {autodelete.deleted}, ошибок {autodelete.failed}\n"
+        f"🔁 Дубликаты: объединено {duplicates.merged}, в индексе {len(duplicates)}\n"
+        f"⚠️ Недоступные чаты: {len(chat_health.unhealthy())} (с ошибками {len(chat_health)}), "
+        f"отрезано репортов {chat_health.skipped}\n"
+        f"📒 Журнал доставок: незавершённых {outbox.unfinished}, ждут повтора {outbox.waiting_retry}, "
+        f"повторов {outbox.retried}, брошено {outbox.dropped}\n"
+        f"🗞 Дайджесты: ждут {len(digests)} репортов, отправлено {digests.flushed} ({digests.reports} репортов)\n"
+        f"🚦 Нагрузка: {shedding.stage} (ступень {shedding.level}), задержка цикла {shedding.lag * 1000:.0f} мс"
+        + "".join(f", {action} {n}" for action, n in sorted(shedding.actions.items())),
+    )
+
+@timed_handler
+async def reload_novels(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMINS:
+        await reply_text(update.message, "⛔ Нет прав."); return
+    old = registry.current
+    try:
+        index = registry.load()
+    except Exception as e:
+        logging.warning("Novel registry reload failed: %s", e)
+        await reply_text(update.message, f"❌ Не удалось перечитать реестр, оставлена v{old.version}: {e}")
+        return
+    spawn_background(chat_cache.warm(context.bot, index.by_chat), name="chat-cache-warm")
+    await reply_text(
+        update.message,
+        f"🔄 Реестр v{index.version}: новелл {len(index.novels)} (было {len(old.novels)}), "
+        f"чатов {len(index.by_chat)}",
+    )
 
+@timed_handler
 async def contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id not in ADMINS:
-        await update.message.reply_text("⛔ Нет прав."); return
+        await reply_text(update.message, "⛔ Нет прав."); return
+    index = registry.current
     if not context.args:
-        codes = ", ".join(sorted(NOVELS.keys()))
-        await update.message.reply_text(f"Использование: /contact <код>\nДоступные: {codes}")
+        codes = ", ".join(sorted(index.novels))
+        await reply_text(update.message, f"Использование: /contact <код>\nДоступные: {codes}")
         return
 
     code = context.args[0].lower()
-    if code not in NOVELS:
-        await update.message.reply_text(f"Не знаю новеллу «{code}». Проверь код."); return
+    if code not in index.novels:
+        await reply_text(update.message, f"Не знаю новеллу «{code}». Проверь код."); return
 
-    chat_id = NOVELS[code]
-    label = NOVEL_LABELS.get(code, code)
+    chat_id = index.novels[code]
+    label = index.label(code)
     if chat_id == 0:
-        await update.message.reply_html(
+        await reply_html(update.message,
             f"📇 Контакт для <b>{html.escape(label)}</b>:\n"
             f"↳ 🚫 переводчика сейчас нет\n"
             f"ℹ️ Репорты по этой новелле дублируются в общий чат."
@@ -643,17 +3130,18 @@ async def contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"↳ <a href=\"{html.escape(url, quote=True)}\">{html.escape(name)}</a>\n"
                 f"<code>{chat_id}</code>")
         kb = InlineKeyboardMarkup([[InlineKeyboardButton("Открыть чат", url=url)]])
-        await update.message.reply_html(text, reply_markup=kb, disable_web_page_preview=True)
+        await reply_html(update.message, text, reply_markup=kb, disable_web_page_preview=True)
     else:
         text = (f"📇 Контакт для <b>{html.escape(label)}</b>:\n"
                 f"↳ {html.escape(name)}\n"
                 f"<code>{chat_id}</code>\n\n"
                 f"ℹ️ Прямая ссылка недоступна (приватный чат без @username). "
                 f"Открой чат вручную через список диалогов.")
-        await update.message.reply_html(text)
+        await reply_html(update.message, text)
 
 # ── Ошибки ─────────────────────────────────────────────────────────────────────
 async def errors_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
+    metrics.inc("bot_update_errors_total", error=type(context.error).__name__)
     logging.exception("Update caused error: %s", context.error)
 
 # ── Команды в списке бота ──────────────────────────────────────────────────────
@@ -664,15 +3152,324 @@ async def set_bot_commands(app):
         BotCommand("send", "Отправить накопленные сообщения"),
         BotCommand("whoami", "Показать chat_id/user_id"),
     ]
+    # сверяемся с тем, что уже стоит у бота: локальный файл на эфемерном диске
+    # теряется при деплое, а устаревший мог бы ошибочно пропустить обновление
+    current = await app.bot.get_my_commands()
+    if [(c.command, c.description) for c in current] == [(c.command, c.description) for c in base_cmds]:
+        logging.info("Bot commands unchanged, set_my_commands skipped")
+        return
     await app.bot.set_my_commands(base_cmds)
 
-# ── Main ───────────────────────────────────────────────────────────────────────
-def main():
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
-    if not BOT_TOKEN:
-        raise RuntimeError("BOT_TOKEN не задан в .env")
+async def post_init(app):
+    # только то, без чего нельзя принимать апдейты; остальное — в post_serve
+    startup.mark("initialize")
+    autodelete.start(app.bot)
+    autodelete.restore(app.bot)
+    report_store.restore(app)
+    report_store.start(app)
+    outbox.start(app.bot, attempt_delivery)
+    digests.restore(app.bot)
+    shedding.start()
+    if app.updater is not None:
+        # polling: отдельного момента «начали принимать» нет, запускаем сразу в фоне
+        spawn_background(post_serve(app), name="post-serve")
+    startup.mark("post_init")
+
+async def post_serve(app):
+    # некритичное: запускается, когда апдейты уже принимаются
+    if WORKER_INDEX <= 0:
+        try:
+            await set_bot_commands(app)
+        except Exception as e:
+            logging.warning("set_my_commands failed: %s", e)
+    spawn_background(chat_cache.warm(app.bot, registry.current.by_chat), name="chat-cache-warm")
+    if NOVELS_RELOAD_INTERVAL > 0:
+        spawn_background(watch_registry(app.bot, NOVELS_RELOAD_INTERVAL), name="registry-watch")
+
+async def watch_registry(bot, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if registry.reload_if_changed():
+                await chat_cache.warm(bot, registry.current.by_chat)
+        except Exception as e:
+            logging.warning("Novel registry reload failed, keeping v%d: %s", registry.current.version, e)
+
+async def post_stop(app):
+    # бот ещё инициализирован — можно успеть удалить/сохранить хвосты
+    await shedding.stop()
+    await digests.flush_all()
+    await autodelete.shutdown()
+    await outbound.stop()
+    await outbox.close()
+    await report_store.close()
+    state_store.close()
+
+# ── Метрики: текущие значения подсистем ────────────────────────────────────────
+def register_metrics(app):
+    def lanes(attr: str):
+        return lambda: {(("lane", name),): getattr(outbound.stats[lane], attr) for lane, name in LANE_NAMES.items()}
+
+    metrics.callback("bot_outbound_queue_depth", "gauge", "Outbound jobs waiting per lane",
+                     lambda: {(("lane", name),): outbound.depth(lane) for lane, name in LANE_NAMES.items()})
+    metrics.callback("bot_outbound_sent_total", "counter", "Outbound jobs done per lane", lanes("done"))
+    metrics.callback("bot_outbound_failed_total", "counter", "Outbound jobs failed per lane", lanes("failed"))
+    metrics.callback("bot_outbound_retry_after_total", "counter", "RetryAfter per lane", lanes("retry_after"))
+    metrics.callback("bot_outbound_wait_seconds_max", "gauge", "Max queue wait per lane", lanes("wait_max"))
+    metrics.callback("bot_rate_limit_rejections_total", "counter", "Per-user rate limit rejections",
+                     lambda: {(("action", a),): n for a, n in user_limiter.rejected.items()})
+    metrics.callback("bot_rate_limit_tracked", "gauge", "Tracked (user, action) buckets", lambda: len(user_limiter))
+    metrics.callback("bot_autodelete_pending", "gauge", "Scheduled autodeletes", lambda: autodelete.pending)
+    metrics.callback("bot_pending_reports", "gauge", "Open /report sessions",
+                     lambda: sum(1 for data in app.user_data.values() if data.get("pending") is not None))
+    metrics.callback("bot_duplicates_merged_total", "counter", "Reports merged into an earlier identical one",
+                     lambda: duplicates.merged)
+    metrics.callback("bot_duplicate_index_entries", "gauge", "Report fingerprints in the window",
+                     lambda: len(duplicates))
+    metrics.callback("bot_circuit_open_chats", "gauge", "Chats with an open circuit",
+                     lambda: len(chat_health.unhealthy()))
+    metrics.callback("bot_circuit_opened_total", "counter", "Circuits opened", lambda: chat_health.opened)
+    metrics.callback("bot_circuit_skipped_total", "counter", "Translator deliveries skipped by an open circuit",
+                     lambda: chat_health.skipped)
+    metrics.callback("bot_outbox_unfinished", "gauge", "Deliveries recorded but not done", lambda: outbox.unfinished)
+    metrics.callback("bot_outbox_waiting_retry", "gauge", "Deliveries waiting for a retry", lambda: outbox.waiting_retry)
+    metrics.callback("bot_outbox_commits_total", "counter", "Outbox group commits", lambda: outbox.commits)
+    metrics.callback("bot_outbox_ops_total", "counter", "Outbox operations written", lambda: outbox.ops_written)
+    metrics.callback("bot_outbox_dropped_total", "counter", "Deliveries dropped after max attempts", lambda: outbox.dropped)
+    metrics.callback("bot_digest_buffered", "gauge", "Reports waiting for a translator digest", lambda: len(digests))
+    metrics.callback("bot_digests_sent_total", "counter", "Translator digests sent", lambda: digests.flushed)
+    metrics.callback("bot_albums_buffered", "gauge", "Albums waiting for the debounce window", lambda: len(albums))
+    metrics.callback("bot_update_lanes", "gauge", "Users with updates in flight", lambda: update_lanes.lanes)
+    metrics.callback("bot_chat_cache_entries", "gauge", "Chat metadata cache size", lambda: len(chat_cache))
+    metrics.callback("bot_shed_level", "gauge", "Current load shedding stage (0 — normal)", lambda: shedding.level)
+    metrics.callback("bot_event_loop_lag_seconds", "gauge", "Event loop lag (decaying peak)", lambda: shedding.lag)
+    metrics.callback("bot_log_queue_depth", "gauge", "Log records waiting for the writer thread",
+                     lambda: log_handler.queue.qsize())
+    metrics.callback("bot_log_dropped_total", "counter", "Log records dropped on a full queue", lambda: log_handler.dropped)
+    metrics.callback("bot_log_suppressed_total", "counter", "Repeated warnings/errors suppressed",
+                     lambda: log_repeats.suppressed)
+    metrics.callback("bot_novel_registry_version", "gauge", "Loaded novel registry version",
+                     lambda: registry.current.version)
+
+# ── Вебхук-сервер ──────────────────────────────────────────────────────────────
+def build_web_app(app, url_path: str, public: bool = True):
+    # tornado приходит вместе с python-telegram-bot[webhooks]; нужен только в режиме вебхука
+    import tornado.web
+
+    class TelegramWebhookHandler(tornado.web.RequestHandler):
+        async def post(self):
+            if WEBHOOK_SECRET and self.request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+                raise tornado.web.HTTPError(403)
+            try:
+                data = json.loads(self.request.body)
+            except ValueError:
+                raise tornado.web.HTTPError(400)
+            update = Update.de_json(data, app.bot)
+            if update:
+                await app.update_queue.put(update)
+
+    return tornado.web.Application([
+        (rf"/{re.escape(url_path)}/?", TelegramWebhookHandler),
+        *metrics_routes(public),
+    ], log_function=lambda handler: None)
+
+def metrics_handler():
+    import tornado.web
+
+    class MetricsHandler(tornado.web.RequestHandler):
+        def get(self):
+            if METRICS_TOKEN:
+                auth = self.request.headers.get("Authorization", "")
+                if self.get_query_argument("token", "") != METRICS_TOKEN and auth != f"Bearer {METRICS_TOKEN}":
+                    raise tornado.web.HTTPError(403)
+            self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.write(metrics.render())
+
+    return MetricsHandler
+
+def metrics_routes(public: bool) -> list:
+    # на публичном порту метрики без токена не отдаём — для них есть METRICS_BIND
+    if public and not METRICS_TOKEN:
+        return []
+    return [(re.escape(METRICS_PATH), metrics_handler())]
+
+def start_metrics_server():
+    if not METRICS_BIND:
+        return None
+    import tornado.web
+    from tornado.httpserver import HTTPServer
+
+    host, _, port = METRICS_BIND.rpartition(":")
+    server = HTTPServer(tornado.web.Application([(re.escape(METRICS_PATH), metrics_handler())],
+                                                log_function=lambda handler: None))
+    server.listen(int(port), address=host or "127.0.0.1")
+    logging.info("Metrics on %s:%s%s", host or "127.0.0.1", port, METRICS_PATH)
+    return server
+
+async def serve_webhook(app, port: int, url_path: str, webhook_url: Optional[str], address: str = "0.0.0.0"):
+    # webhook_url=None — воркер за главным процессом: вебхук ставит главный
+    # свой сервер вместо run_webhook: на том же порту живёт /metrics
+    from tornado.httpserver import HTTPServer
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    await app.initialize()
+    server = metrics_server = None
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        server = HTTPServer(build_web_app(app, url_path, public=address != "127.0.0.1"))
+        server.listen(port, address=address)
+        if WORKER_INDEX < 0:
+            metrics_server = start_metrics_server()
+        # вебхук обычно уже стоит с прошлого деплоя: сначала начинаем разбирать очередь,
+        # потом переустанавливаем его
+        await app.start()
+        startup.mark("serving")
+        if webhook_url:
+            await app.bot.set_webhook(url=webhook_url, secret_token=WEBHOOK_SECRET)
+            startup.mark("set_webhook")
+        spawn_background(post_serve(app), name="post-serve")
+        await stop.wait()
+    finally:
+        if server is not None:
+            server.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if app.running:
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+# ── Несколько воркеров ─────────────────────────────────────────────────────────
+metrics.describe("bot_router_updates_total", "counter", "Updates routed to each worker")
+metrics.describe("bot_router_errors_total", "counter", "Updates a worker did not accept")
+metrics.describe("bot_worker_restarts_total", "counter", "Worker processes restarted")
+
+def update_user_id(data: dict) -> int:
+    # по сырому JSON, без Update.de_json: у всех типов апдейта автор лежит в from / user / chat
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        for field_name in ("from", "user", "chat"):
+            who = value.get(field_name)
+            if isinstance(who, dict) and isinstance(who.get("id"), int):
+                return who["id"]
+    return 0
+
+def per_process_features() -> list[str]:
+    # включённые настройки, которые при нескольких воркерах не действуют (см. WEBHOOK_WORKERS)
+    return [name for name, enabled in (("DEDUP_WINDOW", DEDUP_WINDOW > 0), ("DIGEST_CHATS", bool(DIGEST_CHATS)),
+                                       ("CIRCUIT_FAILURES", CIRCUIT_FAILURES > 0)) if enabled]
+
+def spawn_worker(index: int, port: int) -> subprocess.Popen:
+    env = dict(os.environ, BOT_WORKER_INDEX=str(index), PORT=str(port))
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+def build_router_app(ports: list[int], url_path: str, client: httpx.AsyncClient):
+    import tornado.web
+
+    class RouterHandler(tornado.web.RequestHandler):
+        async def post(self):
+            if WEBHOOK_SECRET and self.request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+                raise tornado.web.HTTPError(403)
+            try:
+                data = json.loads(self.request.body)
+            except ValueError:
+                raise tornado.web.HTTPError(400)
+            worker = update_user_id(data) % len(ports)
+            # не отвечаем 200, пока воркер не принял апдейт: иначе Telegram не повторит его при падении воркера
+            try:
+                r = await client.post(
+                    f"http://127.0.0.1:{ports[worker]}/{url_path}", content=self.request.body,
+                    headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET},
+                )
+            except httpx.HTTPError as e:
+                metrics.inc("bot_router_errors_total", worker=str(worker))
+                logging.warning("Worker %d unavailable: %s", worker, e)
+                raise tornado.web.HTTPError(503)
+            metrics.inc("bot_router_updates_total", worker=str(worker))
+            if r.status_code != 200:
+                metrics.inc("bot_router_errors_total", worker=str(worker))
+            self.set_status(r.status_code)
+
+    return tornado.web.Application([
+        (rf"/{re.escape(url_path)}/?", RouterHandler),
+        *metrics_routes(public=True),
+    ], log_function=lambda handler: None)
+
+async def serve_router(port: int, url_path: str, webhook_url: str, workers: int):
+    # главный процесс: только приём вебхука, раздача апдейтов и перезапуск упавших воркеров
+    from tornado.httpserver import HTTPServer
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    ports = [(WORKER_BASE_PORT or port + 1) + i for i in range(workers)]
+    procs = {i: spawn_worker(i, p) for i, p in enumerate(ports)}
+    client = httpx.AsyncClient(
+        timeout=HTTP_READ_TIMEOUT,
+        limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE,
+                            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+    )
+    server = HTTPServer(build_router_app(ports, url_path, client))
+    server.listen(port, address="0.0.0.0")
+    metrics_server = start_metrics_server()
+    try:
+        bot = Bot(BOT_TOKEN, base_url=BOT_API_URL or "https://api.telegram.org/bot", request=build_send_request(pool_size=1))
+        async with bot:
+            await bot.set_webhook(url=webhook_url, secret_token=WEBHOOK_SECRET)
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            for i, proc in procs.items():
+                if proc.poll() is not None and not stop.is_set():
+                    logging.warning("Worker %d exited with %s, restarting", i, proc.returncode)
+                    metrics.inc("bot_worker_restarts_total", worker=str(i))
+                    procs[i] = spawn_worker(i, ports[i])
+    finally:
+        server.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        for proc in procs.values():
+            if proc.poll() is None:
+                proc.terminate()
+        for i, proc in procs.items():
+            try:
+                await asyncio.to_thread(proc.wait, 30)
+            except subprocess.TimeoutExpired:
+                logging.warning("Worker %d did not stop in time, killing", i)
+                proc.kill()
+        await client.aclose()
+
+# ── Main ───────────────────────────────────────────────────────────────────────
+def build_application(token: str, base_url: Optional[str] = None, updater: bool = True):
+    # base_url — префикс Bot API вида "http://host:port/bot" (нужен для нагрузочного стенда)
+    builder = ApplicationBuilder().token(token).concurrent_updates(update_lanes).request(build_send_request())
+    if base_url:
+        builder = builder.base_url(base_url).base_file_url(base_url.replace("/bot", "/file/bot", 1))
+    if updater:
+        builder = builder.get_updates_request(build_get_updates_request())
+    else:
+        builder = builder.updater(None)
+    app = builder.build()
+    register_metrics(app)
 
     # Обработчики
     conv = ConversationHandler(
@@ -681,6 +3478,7 @@ def main():
             CHOOSE_NOVEL: [
                 CallbackQueryHandler(lambda u,c: cancel_cmd(u,c), pattern=r"^cancel$"),
                 CallbackQueryHandler(pick_novel, pattern=r"^pick:.+"),
+                CallbackQueryHandler(novel_page, pattern=r"^page:.+"),
             ],
             COLLECT_MESSAGES: [
                 CallbackQueryHandler(lambda u,c: cancel_cmd(u,c), pattern=r"^cancel$"),
@@ -707,20 +3505,37 @@ def main():
     app.add_handler(CommandHandler("broadcast", broadcast))
     app.add_handler(CommandHandler("listnovels", listnovels))
     app.add_handler(CommandHandler("contact", contact))
+    app.add_handler(CommandHandler("queue", queue_stats))
+    app.add_handler(CommandHandler("reload", reload_novels))
 
     # Диалог /report
     app.add_handler(conv)
 
     # РЕЗЕРВ: если почему-то не в состоянии диалога, всё равно обрабатываем клики
     app.add_handler(CallbackQueryHandler(pick_novel, pattern=r"^pick:.+"))
+    app.add_handler(CallbackQueryHandler(novel_page, pattern=r"^page:.+"))
     app.add_handler(CallbackQueryHandler(lambda u, c: cancel_cmd(u, c), pattern=r"^cancel$"))
     
     # Автодетект хэштегов
     app.add_handler(MessageHandler(~filters.COMMAND, collect_any))
 
     app.add_error_handler(errors_handler)
-    app.post_init = set_bot_commands
+    app.post_init = post_init
+    app.post_stop = post_stop
+    return app
 
+def main():
+    listener = setup_logging()
+    try:
+        run_bot()
+    finally:
+        listener.stop()
+
+def run_bot():
+    if not BOT_TOKEN:
+        raise RuntimeError("BOT_TOKEN не задан в .env")
+
+    startup.mark("module")
     if MODE == "webhook":
         base_url = os.environ.get("RENDER_EXTERNAL_URL")
         if not base_url:
@@ -728,12 +3543,26 @@ def main():
         base_url = base_url.rstrip("/")
         port = int(os.environ.get("PORT", 8000))
         webhook_url = f"{base_url}/{WEBHOOK_SECRET}"
-        logging.info(f"Running in WEBHOOK mode on port {port}, webhook -> {webhook_url}")
-        app.run_webhook(
-            listen="0.0.0.0", port=port,
-            url_path=WEBHOOK_SECRET, webhook_url=webhook_url,
-            secret_token=WEBHOOK_SECRET,
-        )
+        if WEBHOOK_WORKERS > 1 and WORKER_INDEX < 0:
+            logging.info("Running in WEBHOOK mode on port %d with %d workers, webhook -> %s, metrics -> %s",
+                         port, WEBHOOK_WORKERS, webhook_url, METRICS_PATH if METRICS_TOKEN else "off (no METRICS_TOKEN)")
+            if per_process_features():
+                logging.warning("%s are ignored with %d workers: this state is per process",
+                                ", ".join(per_process_features()), WEBHOOK_WORKERS)
+            asyncio.run(serve_router(port, WEBHOOK_SECRET, webhook_url, WEBHOOK_WORKERS))
+            return
+
+    app = build_application(BOT_TOKEN, base_url=BOT_API_URL or None, updater=MODE != "webhook")
+    startup.mark("builder")
+    logging.info("Bot API HTTP/%s: send pool %d, keep-alive %ss, getUpdates pool %d",
+                 HTTP_VERSION, HTTP_POOL_SIZE, HTTP_KEEPALIVE_EXPIRY, GET_UPDATES_POOL_SIZE)
+    if MODE == "webhook" and WORKER_INDEX >= 0:
+        logging.info("Worker %d/%d on 127.0.0.1:%d", WORKER_INDEX, WEBHOOK_WORKERS, port)
+        asyncio.run(serve_webhook(app, port, WEBHOOK_SECRET, None, address="127.0.0.1"))
+    elif MODE == "webhook":
+        logging.info("Running in WEBHOOK mode on port %d, webhook -> %s, metrics -> %s", port, webhook_url,
+                     METRICS_PATH if METRICS_TOKEN else "off (no METRICS_TOKEN)")
+        asyncio.run(serve_webhook(app, port, WEBHOOK_SECRET, webhook_url))
     else:
         logging.info("Running in POLLING mode")
         app.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# bot.py читает окружение при импорте: задаём его до первого import bot,
+# чтобы .env разработчика не влиял на тесты, а базы не ложились в рабочий каталог
+_tmp = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ.update({
+    "BOT_TOKEN": "123456:TEST",
+    "MODE": "polling",
+    "WEBHOOK_WORKERS": "1",
+    "FEED_ERRORS_CHAT_ID": "0",
+    "NOVELS_RELOAD_INTERVAL": "0",
+    "LOG_FORMAT": "text",
+    "REPORTS_DB": os.path.join(_tmp, "reports.sqlite3"),
+    "OUTBOX_DB": os.path.join(_tmp, "outbox.sqlite3"),
+    "AUTODELETE_STATE_FILE": os.path.join(_tmp, "autodelete.json"),
+})
+os.environ.pop("BOT_WORKER_INDEX", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
@@ -0,0 +1,43 @@
+import bot
+
+
+def test_one_per_period(clock):
+    limiter = bot.UserRateLimiter({"report_start": (1, 3)}, idle_ttl=60, clock=clock)
+    assert not limiter.hit(1, "report_start")
+    assert limiter.hit(1, "report_start")
+    clock.advance(2.9)
+    assert limiter.hit(1, "report_start")
+    clock.advance(3)
+    assert not limiter.hit(1, "report_start")
+    assert limiter.rejected["report_start"] == 2
+
+
+def test_burst_then_steady_rate(clock):
+    limiter = bot.UserRateLimiter({"collect": (5, 5)}, idle_ttl=60, clock=clock)
+    assert [limiter.hit(1, "collect") for _ in range(6)] == [False] * 5 + [True]
+    clock.advance(1)
+    assert [limiter.hit(1, "collect") for _ in range(2)] == [False, True]
+
+
+def test_users_and_actions_are_independent(clock):
+    limiter = bot.UserRateLimiter({"a": (1, 3), "b": (1, 3)}, idle_ttl=60, clock=clock)
+    assert not limiter.hit(1, "a")
+    assert not limiter.hit(2, "a")
+    assert not limiter.hit(1, "b")
+
+
+def test_idle_buckets_are_evicted_but_not_before_full_refill(clock):
+    limiter = bot.UserRateLimiter({"slow": (1, 120)}, idle_ttl=10, clock=clock)
+    limiter.hit(1, "slow")
+    clock.advance(60)
+    limiter.sweep()
+    # ведро ещё не восполнилось: выкинуть его значило бы подарить токен
+    assert len(limiter) == 1 and limiter.hit(1, "slow")
+    clock.advance(121)
+    limiter.sweep()
+    assert len(limiter) == 0
+
+
+def test_parse_rate():
+    assert bot.parse_rate("5/10") == (5.0, 10.0)
+    assert bot.parse_rate("3") == (3.0, 1.0)
@@ -0,0 +1,78 @@
+from telegram.error import BadRequest, Forbidden, NetworkError, TimedOut
+
+import bot
+
+KICKED = Forbidden("Forbidden: bot was kicked from the supergroup chat")
+
+
+def breaker(clock, threshold=3, max_chats=100) -> bot.ChatCircuitBreaker:
+    return bot.ChatCircuitBreaker(threshold, probe_base=60, probe_max=600, max_chats=max_chats, clock=clock)
+
+
+def test_opens_after_threshold_unreachable_errors(clock):
+    cb = breaker(clock)
+    for _ in range(2):
+        cb.failure(-100, KICKED)
+    assert cb.allow(-100) and cb.get(-100) is None
+    cb.failure(-100, KICKED)
+    assert not cb.allow(-100)
+    assert cb.opened == 1 and list(cb.unhealthy()) == [-100]
+
+
+def test_transient_errors_do_not_count(clock):
+    cb = breaker(clock, threshold=1)
+    for e in (TimedOut(), NetworkError("connection reset"), BadRequest("Message to forward not found")):
+        cb.failure(-100, e)
+    assert cb.allow(-100) and len(cb) == 0
+    cb.failure(-100, BadRequest("Chat not found"))
+    assert not cb.allow(-100)
+
+
+def test_success_before_threshold_resets_count(clock):
+    cb = breaker(clock)
+    cb.failure(-100, KICKED)
+    cb.failure(-100, KICKED)
+    cb.success(-100)
+    cb.failure(-100, KICKED)
+    assert cb.allow(-100)
+
+
+def test_half_open_probe_is_granted_once_when_due(clock):
+    cb = breaker(clock, threshold=1)
+    cb.failure(-100, KICKED)
+    assert not cb.probe_due(-100)
+    clock.advance(60)
+    assert cb.probe_due(-100)
+    # пока проверка идёт, вторую не запускаем, и чат остаётся закрытым
+    assert not cb.probe_due(-100)
+    assert not cb.allow(-100)
+    cb.success(-100)
+    assert cb.allow(-100) and len(cb) == 0
+
+
+def test_failed_probes_back_off_up_to_max(clock):
+    cb = breaker(clock, threshold=1)
+    cb.failure(-100, KICKED)
+    delays = []
+    for _ in range(6):
+        clock.advance(cb.get(-100).next_probe - clock())
+        assert cb.probe_due(-100)
+        cb.failure(-100, KICKED)
+        cb.probe_finished(-100)
+        delays.append(cb.get(-100).next_probe - clock())
+    assert delays == [120, 240, 480, 600, 600, 600]
+    assert cb.opened == 1
+
+
+def test_disabled_with_zero_threshold(clock):
+    cb = breaker(clock, threshold=0)
+    for _ in range(10):
+        cb.failure(-100, KICKED)
+    assert cb.allow(-100) and len(cb) == 0
+
+
+def test_tracks_a_bounded_number_of_chats(clock):
+    cb = breaker(clock, threshold=1, max_chats=2)
+    for chat_id in (-1, -2, -3):
+        cb.failure(chat_id, KICKED)
+    assert set(cb.unhealthy()) == {-2, -3}
@@ -0,0 +1,91 @@
+from datetime import datetime, timezone
+
+import pytest
+from telegram import Chat, Document, Message, PhotoSize
+
+import bot
+
+LONG = "Опечатка в главе 12: «превет» вместо «привет», и ещё пропущена запятая после обращения"
+
+
+@pytest.fixture(autouse=True)
+def min_text(monkeypatch):
+    monkeypatch.setattr(bot, "DEDUP_MIN_TEXT", 60)
+
+
+def message(message_id=1, **kwargs) -> Message:
+    return Message(message_id, datetime.now(timezone.utc), Chat(1, Chat.PRIVATE), **kwargs)
+
+
+def photo(unique_id: str) -> list[PhotoSize]:
+    return [PhotoSize("small", unique_id + "-s", 90, 90), PhotoSize("big", unique_id, 1280, 1280)]
+
+
+def test_short_text_is_not_compared():
+    assert bot.message_fingerprint(message(text="#aptch опечатка в главе 12")) is None
+
+
+def test_long_text_ignores_case_yo_punctuation_and_hashtags():
+    a = bot.message_fingerprint(message(text="#aptch " + LONG))
+    b = bot.message_fingerprint(message(text="#APTCH   " + LONG.upper().replace("Е", "Ё").replace(",", "")))
+    assert a is not None and a == b
+    assert a != bot.message_fingerprint(message(text=LONG.replace("12", "13")))
+
+
+def test_media_is_compared_without_text():
+    a = bot.message_fingerprint(message(photo=photo("AQAD1")))
+    assert a is not None
+    assert a == bot.message_fingerprint(message(2, photo=photo("AQAD1")))
+    assert a != bot.message_fingerprint(message(photo=photo("AQAD2")))
+    assert a != bot.message_fingerprint(message(photo=photo("AQAD1"), caption="глава 3"))
+    assert bot.message_fingerprint(message(document=Document("doc", "AQAD3"))) is not None
+
+
+def test_report_with_an_uncomparable_message_is_not_compared():
+    media = message(photo=photo("AQAD1"))
+    assert bot.report_fingerprint([media, message(2, text="см. выше")]) is None
+    assert bot.report_fingerprint([]) is None
+
+
+def test_report_fingerprint_depends_on_order():
+    a, b = message(1, photo=photo("AQAD1")), message(2, photo=photo("AQAD2"))
+    assert bot.report_fingerprint([a, b]) != bot.report_fingerprint([b, a])
+    assert bot.report_fingerprint([a, b]) == bot.report_fingerprint([a, b])
+
+
+def test_copy_merges_only_while_first_is_in_flight_or_delivered(clock):
+    index = bot.DuplicateIndex(window=600, max_entries=100, clock=clock)
+    dup, first = index.check("aptch", b"fp")
+    assert not dup
+    dup, entry = index.check("aptch", b"fp")
+    assert dup and entry is first and first.count == 2
+    # первый репорт никуда не дошёл — запись освобождается, следующая копия уходит как новая
+    index.settle(first, delivered=False)
+    assert len(index) == 0
+    dup, second = index.check("aptch", b"fp")
+    assert not dup and second is not first
+    index.settle(second, delivered=True)
+    assert index.check("aptch", b"fp") == (True, second)
+    assert index.merged == 2
+
+
+def test_other_novel_or_expired_entry_is_not_a_duplicate(clock):
+    index = bot.DuplicateIndex(window=600, max_entries=100, clock=clock)
+    _, entry = index.check("aptch", b"fp")
+    index.settle(entry, delivered=True)
+    assert not index.check("other", b"fp")[0]
+    clock.advance(601)
+    assert not index.check("aptch", b"fp")[0]
+
+
+def test_index_is_bounded(clock):
+    index = bot.DuplicateIndex(window=600, max_entries=2, clock=clock)
+    for fp in (b"1", b"2", b"3", b"4"):
+        index.check("aptch", fp)
+    # лишнее выселяется перед вставкой: не больше max_entries старых + новая
+    assert len(index) == 3
+
+
+def test_disabled_window_or_missing_fingerprint(clock):
+    assert bot.DuplicateIndex(0, 100, clock=clock).check("aptch", b"fp") == (False, None)
+    assert bot.DuplicateIndex(600, 100, clock=clock).check("aptch", None) == (False, None)
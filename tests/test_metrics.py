@@ -0,0 +1,43 @@
+import bot
+
+
+def test_values_render_without_rounding():
+    m = bot.Metrics()
+    m.inc("big_total", 1234567)
+    m.inc("big_total")
+    m.callback("users", "gauge", "", lambda: 10_000_001)
+    m.callback("ratio", "gauge", "", lambda: {(("kind", "a"),): 0.1 + 0.2})
+    lines = m.render().splitlines()
+    assert "big_total 1234568.0" in lines
+    assert "users 10000001" in lines
+    assert 'ratio{kind="a"} 0.30000000000000004' in lines
+
+
+def test_special_values():
+    assert [bot._fmt_value(v) for v in (True, 7, float("nan"), float("inf"), float("-inf"), 2.5)] == [
+        "1", "7", "NaN", "+Inf", "-Inf", "2.5"]
+
+
+def test_histogram_buckets_are_cumulative():
+    m = bot.Metrics(buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 5.0):
+        m.observe("lat", v, handler="x")
+    lines = m.render().splitlines()
+    assert 'lat_bucket{handler="x",le="0.1"} 1' in lines
+    assert 'lat_bucket{handler="x",le="1"} 2' in lines
+    assert 'lat_bucket{handler="x",le="+Inf"} 3' in lines
+    assert 'lat_sum{handler="x"} 5.55' in lines
+
+
+def test_label_values_are_escaped():
+    m = bot.Metrics()
+    m.inc("errors_total", error='say "hi"\\\n')
+    assert 'errors_total{error="say \\"hi\\"\\\\\\n"} 1.0' in m.render().splitlines()
+
+
+def test_metrics_stay_off_the_public_port_without_token(monkeypatch):
+    monkeypatch.setattr(bot, "METRICS_TOKEN", "")
+    assert bot.metrics_routes(public=True) == []
+    assert len(bot.metrics_routes(public=False)) == 1
+    monkeypatch.setattr(bot, "METRICS_TOKEN", "secret")
+    assert len(bot.metrics_routes(public=True)) == 1
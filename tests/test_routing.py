@@ -0,0 +1,57 @@
+import pytest
+
+import bot
+
+USER = {"id": 42, "is_bot": False, "first_name": "U"}
+CHAT = {"id": 42, "type": "private"}
+
+
+@pytest.mark.parametrize("update", [
+    {"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": CHAT, "from": USER, "text": "#aptch"}},
+    {"update_id": 2, "edited_message": {"message_id": 1, "date": 0, "chat": CHAT, "from": USER, "text": "x"}},
+    {"update_id": 3, "callback_query": {"id": "1", "from": USER, "chat_instance": "c", "data": "novel:aptch",
+                                        "message": {"message_id": 5, "date": 0, "chat": {"id": -100, "type": "supergroup"}}}},
+    {"update_id": 4, "poll_answer": {"poll_id": "p", "user": USER, "option_ids": [0]}},
+    {"update_id": 5, "my_chat_member": {"chat": {"id": -100, "type": "supergroup"}, "from": USER, "date": 0}},
+])
+def test_updates_route_by_their_author(update):
+    assert bot.update_user_id(update) == 42
+
+
+def test_callback_goes_to_the_user_not_the_chat_of_the_message():
+    # кнопка в группе: очередь и антифлуд — того, кто нажал
+    update = {"update_id": 1, "callback_query": {
+        "id": "1", "chat_instance": "c", "message": {"chat": {"id": -100}}, "from": {"id": 7}}}
+    assert bot.update_user_id(update) == 7
+
+
+def test_channel_post_falls_back_to_the_chat():
+    update = {"update_id": 1, "channel_post": {"message_id": 1, "date": 0, "chat": {"id": -1001, "type": "channel"}}}
+    assert bot.update_user_id(update) == -1001
+    # у отрицательного id тоже есть воркер
+    assert 0 <= bot.update_user_id(update) % 3 < 3
+
+
+def test_update_without_author_goes_to_first_worker():
+    assert bot.update_user_id({"update_id": 1, "poll": {"id": "p", "question": "?", "options": []}}) == 0
+    assert bot.update_user_id({"update_id": 1}) == 0
+    assert bot.update_user_id({"update_id": 1, "message": {"from": {"id": "42"}}}) == 0
+
+
+def test_all_updates_of_one_user_land_on_one_worker():
+    updates = [
+        {"update_id": 1, "message": {"chat": CHAT, "from": USER}},
+        {"update_id": 2, "callback_query": {"from": USER, "message": {"chat": {"id": -100}}}},
+        {"update_id": 3, "edited_message": {"chat": CHAT, "from": USER}},
+    ]
+    assert len({bot.update_user_id(u) % 4 for u in updates}) == 1
+
+
+def test_per_process_features_lists_only_enabled(monkeypatch):
+    monkeypatch.setattr(bot, "DEDUP_WINDOW", 0.0)
+    monkeypatch.setattr(bot, "DIGEST_CHATS", set())
+    monkeypatch.setattr(bot, "CIRCUIT_FAILURES", 3)
+    assert bot.per_process_features() == ["CIRCUIT_FAILURES"]
+    monkeypatch.setattr(bot, "DEDUP_WINDOW", 600.0)
+    monkeypatch.setattr(bot, "DIGEST_CHATS", {-100})
+    assert bot.per_process_features() == ["DEDUP_WINDOW", "DIGEST_CHATS", "CIRCUIT_FAILURES"]
@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import bot
+
+
+def test_bucket_starts_full_and_refills_at_rate():
+    b = bot.TokenBucket(rate=2.0, capacity=4.0)
+    assert b.idle()
+
+    async def drain():
+        for _ in range(4):
+            await b.acquire()
+    asyncio.run(drain())
+    now = time.monotonic()
+    assert not b.idle(now)
+    # 4 токена при 2/с восполняются за 2 секунды
+    assert not b.idle(now + 1.5)
+    assert b.idle(now + 2.1)
+
+
+def test_bucket_default_capacity_is_at_least_one():
+    assert bot.TokenBucket(0.5).capacity == 1.0
+    assert bot.TokenBucket(30).capacity == 30
+
+
+def test_bucket_waits_for_tokens_after_burst():
+    b = bot.TokenBucket(rate=50.0, capacity=2.0)
+
+    async def take(n):
+        started = time.monotonic()
+        for _ in range(n):
+            await b.acquire()
+        return time.monotonic() - started
+    # два сразу из запаса, ещё три — по 20 мс
+    assert asyncio.run(take(5)) >= 0.055
+
+
+def test_block_holds_bucket_even_when_full():
+    b = bot.TokenBucket(rate=10.0)
+    b.block(5)
+    now = time.monotonic()
+    assert not b.idle(now)
+    assert b.idle(now + 5.1)
+
+
+def test_private_chats_keep_full_rate_with_several_workers():
+    limiter = bot.ChatRateLimiter(1.0, burst=3.0, shares=4, shared=lambda chat_id: chat_id < 0)
+    private = limiter.bucket(42)
+    assert (private.rate, private.capacity) == (1.0, 3.0)
+
+
+def test_shared_chats_split_rate_and_burst_between_workers():
+    limiter = bot.ChatRateLimiter(1.0, burst=3.0, shares=4, shared=lambda chat_id: chat_id < 0)
+    shared = limiter.bucket(-100)
+    assert shared.rate == 0.25
+    # 3/4 сообщения запаса округляется вверх до одного, иначе acquire ждал бы вечно
+    assert shared.capacity == 1.0
+
+
+def test_single_worker_ignores_shared():
+    limiter = bot.ChatRateLimiter(1.0, burst=3.0, shares=1, shared=lambda chat_id: True)
+    assert (limiter.bucket(-100).rate, limiter.bucket(-100).capacity) == (1.0, 3.0)
+
+
+def test_limiter_drops_only_idle_buckets_when_full():
+    limiter = bot.ChatRateLimiter(1.0, burst=1.0, max_chats=2)
+    busy = limiter.bucket(1)
+    asyncio.run(busy.acquire())
+    limiter.bucket(2)
+    limiter.bucket(3)
+    # ведро 2 было полным и выброшено; у 1 ещё нет токена — его забывать нельзя
+    assert limiter.bucket(1) is busy
+    assert set(limiter._buckets) == {1, 3}